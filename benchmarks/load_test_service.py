@@ -0,0 +1,166 @@
+"""
+Load test for the calculation service (early-retirement/calculation_service.py).
+
+Runs a number of concurrent clients, each with its own connection sending one retirement request at a time and
+ waiting for the answer, and reports the latency percentiles clients saw plus the service's own batching and
+ coalescing metrics. Without --socket or --port it starts a service of its own on a temporary Unix socket:
+
+    python benchmarks/load_test_service.py --requests 20000 --concurrency 64
+    python benchmarks/load_test_service.py --port 8765 --duplicates 0.5
+
+--duplicates is the fraction of requests that repeat a scenario from a small shared pool, to exercise coalescing.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'early-retirement'))
+CLI_PATH = os.path.join(REPO_ROOT, 'early-retirement', 'early-retirement-cli.py')
+
+from instrumentation import nearest_rank_percentile
+
+DEFAULT_REQUESTS = 20000
+DEFAULT_CONCURRENCY = 64
+PERCENTILES = (50, 90, 99)
+# Number of distinct scenarios the duplicate requests are drawn from
+DUPLICATE_POOL_SIZE = 16
+# Fixed seed so every run sends the same requests
+SEED = 1234
+STARTUP_TIMEOUT_SECONDS = 30
+
+def _random_scenario(rng):
+    return {
+        'current_savings': rng.randint(0, 1000000),
+        'annual_contribution': rng.randint(0, 60000),
+        'annual_contrib_increase_rate': round(rng.uniform(0, 0.05), 4),
+        'pre_growth_rate': round(rng.uniform(0.02, 0.1), 4),
+        'post_growth_rate': round(rng.uniform(0.01, 0.06), 4),
+        'inflation_rate': round(rng.uniform(0.01, 0.04), 4),
+        'years_to_live': rng.randint(20, 80),
+        'net_retirement_income': rng.randint(20000, 120000),
+        'retirement_tax_rate': round(rng.uniform(0.1, 0.35), 4),
+    }
+
+def make_requests(num_requests, duplicates):
+    rng = random.Random(SEED)
+    pool = [_random_scenario(rng) for _ in range(DUPLICATE_POOL_SIZE)]
+    requests = []
+    for request_id in range(num_requests):
+        scenario = dict(rng.choice(pool)) if rng.random() < duplicates else _random_scenario(rng)
+        scenario['id'] = request_id
+        requests.append((json.dumps(scenario) + '\n').encode('utf-8'))
+    return requests
+
+async def _connect(socket_path, host, port):
+    if socket_path is not None:
+        return await asyncio.open_unix_connection(socket_path)
+    return await asyncio.open_connection(host, port)
+
+async def _client(requests, latencies, errors, socket_path, host, port):
+    reader, writer = await _connect(socket_path, host, port)
+    try:
+        while requests:
+            request = requests.pop()
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start)
+            if response.get('error') is not None:
+                errors.append(response['error'])
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def _service_metrics(socket_path, host, port):
+    reader, writer = await _connect(socket_path, host, port)
+    try:
+        writer.write(b'{"type": "metrics"}\n')
+        await writer.drain()
+        return json.loads(await reader.readline())['metrics']
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+async def run_load_test(requests, concurrency, socket_path=None, host=None, port=None):
+    """
+    Send requests (encoded lines) from concurrency clients, returning client latencies (seconds), error messages,
+     the total wall time and the service's metrics afterwards
+    """
+    pending = list(reversed(requests))
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[_client(pending, latencies, errors, socket_path, host, port) for _ in range(concurrency)])
+    seconds = time.perf_counter() - start
+    return latencies, errors, seconds, await _service_metrics(socket_path, host, port)
+
+def _start_service(socket_path):
+    service = subprocess.Popen([sys.executable, CLI_PATH, 'serve', '--socket', socket_path], stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while not os.path.exists(socket_path):
+        if service.poll() is not None or time.monotonic() > deadline:
+            service.kill()
+            print("ERROR: The service didn't start")
+            sys.exit(1)
+        time.sleep(0.05)
+    return service
+
+# ========================== Arg Parsing ===========================================================
+
+SOCKET_KEY = 'socket'
+HOST_KEY = 'host'
+PORT_KEY = 'port'
+REQUESTS_KEY = 'requests'
+CONCURRENCY_KEY = 'concurrency'
+DUPLICATES_KEY = 'duplicates'
+
+parser = argparse.ArgumentParser(description='Load test the calculation service and report client-side latency percentiles.')
+parser.add_argument('--socket', dest=SOCKET_KEY, metavar='path', help='Unix socket of a running service')
+parser.add_argument('--host', dest=HOST_KEY, default='127.0.0.1', help='Host of a running service')
+parser.add_argument('--port', dest=PORT_KEY, type=int, help='Port of a running service')
+parser.add_argument('-n', '--requests', dest=REQUESTS_KEY, type=int, default=DEFAULT_REQUESTS, help='Total number of requests to send')
+parser.add_argument('-c', '--concurrency', dest=CONCURRENCY_KEY, type=int, default=DEFAULT_CONCURRENCY, help='Number of concurrent clients')
+parser.add_argument('--duplicates', dest=DUPLICATES_KEY, type=float, default=0.0, help='Fraction of requests repeating a scenario from a small shared pool, in the form 0.XX')
+
+if __name__ == '__main__':
+    parsed_args = vars(parser.parse_args())
+    if parsed_args[REQUESTS_KEY] < 1 or parsed_args[CONCURRENCY_KEY] < 1:
+        print("ERROR: Requests and concurrency must be >= 1")
+        sys.exit(1)
+    if parsed_args[DUPLICATES_KEY] < 0 or parsed_args[DUPLICATES_KEY] > 1:
+        print("ERROR: Duplicates must be between 0 and 1")
+        sys.exit(1)
+
+    requests = make_requests(parsed_args[REQUESTS_KEY], parsed_args[DUPLICATES_KEY])
+    socket_path = parsed_args[SOCKET_KEY]
+    service = None
+    if socket_path is None and parsed_args[PORT_KEY] is None:
+        socket_path = os.path.join(tempfile.mkdtemp(), 'calculation_service.sock')
+        service = _start_service(socket_path)
+    try:
+        latencies, errors, seconds, metrics = asyncio.run(run_load_test(
+            requests,
+            parsed_args[CONCURRENCY_KEY],
+            socket_path=socket_path,
+            host=parsed_args[HOST_KEY],
+            port=parsed_args[PORT_KEY]))
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+
+    latencies.sort()
+    print(" > REQUESTS: %s from %s clients in %.2fs (%s requests/s), %s errors" % (len(latencies), parsed_args[CONCURRENCY_KEY], seconds, '{:,.0f}'.format(len(latencies) / seconds), len(errors)))
+    print(" > CLIENT LATENCY: " + ", ".join("p%s %.2f ms" % (percentile, 1000 * nearest_rank_percentile(latencies, percentile)) for percentile in PERCENTILES) + ", max %.2f ms" % (1000 * latencies[-1]))
+    print(" > SERVICE: %s batches, mean batch size %.1f, largest %s, %s requests coalesced" % (metrics['batches'], metrics['mean_batch_size'] or 0, metrics['largest_batch'], metrics['coalesced']))
+    if errors:
+        print("WARN: first error: %s" % errors[0])
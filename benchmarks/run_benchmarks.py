@@ -0,0 +1,263 @@
+"""
+Benchmarks for the retirement and equity engines.
+
+Each benchmark times a representative workload several times and reports throughput, latency percentiles and peak
+ memory (from a separate tracemalloc run, as tracing slows everything down). Results can be saved as a JSON baseline
+ and later runs compared against it, flagging any benchmark whose median latency or peak memory grew by more than a
+ threshold:
+
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+    # ... make changes ...
+    python benchmarks/run_benchmarks.py --compare benchmarks/baseline.json
+
+Baselines are only comparable on the same machine and Python version, which are recorded alongside the results.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, 'early-retirement'))
+sys.path.insert(0, REPO_ROOT)
+
+from instrumentation import nearest_rank_percentile
+from retirement_age_calculator import RetirementAgeCalculator, Series
+from equity.grant import Grant
+from equity.equity_value_estimator import EquityValueEstimator
+
+try:
+    import numpy
+    have_numpy = True
+except ImportError:
+    have_numpy = False
+
+try:
+    import tabulate
+    have_tabulate = True
+except ImportError:
+    have_tabulate = False
+
+DEFAULT_REPEAT = 20
+# Fast benchmarks keep sampling past repeat until they've run this long, so their percentiles aren't just noise
+MIN_SAMPLE_SECONDS = 0.5
+DEFAULT_THRESHOLD = 0.2
+PERCENTILES = (50, 90, 99)
+# Fixed seed so every run benchmarks the same inputs
+SEED = 1234
+
+# ========================== Workloads ===========================================================
+
+def _scenario(years_to_live, **changes):
+    return dict(
+        current_retirement_savings=150000,
+        annual_contribution=30000,
+        annual_contribution_increase_rate=0.02,
+        pre_retirement_growth_rate=0.07,
+        post_retirement_growth_rate=0.04,
+        inflation_rate=0.025,
+        years_to_live=years_to_live,
+        desired_net_retirement_income_todays_dollars=60000,
+        retirement_tax_rate=0.2,
+        **changes)
+
+def single_scenario(years_to_live, lazy=False):
+    scenario = _scenario(years_to_live)
+    return lambda: RetirementAgeCalculator(lazy=lazy, **scenario).get_waste()
+
+def scenario_series(years_to_live, compact=False):
+    scenario = _scenario(years_to_live)
+    def workload():
+        calculator = RetirementAgeCalculator(compact=compact, **scenario)
+        return [calculator.get_series_data(series, copy=not compact) for series in Series]
+    return workload
+
+def heavy_changes(years_to_live=120):
+    rng = random.Random(SEED)
+    scenario = _scenario(
+        years_to_live,
+        manual_contrib_changes={year: (rng.randint(0, 60000), rng.uniform(0, 0.05)) for year in range(0, years_to_live, 2)},
+        manual_net_worth_changes={year: rng.randint(-20000, 50000) for year in range(1, years_to_live, 3)},
+        manual_retirement_income_changes={year: rng.randint(30000, 90000) for year in range(0, years_to_live, 2)})
+    return lambda: RetirementAgeCalculator(**scenario).get_waste()
+
+def tax_aware_scenario(years_to_live):
+    from tax_aware_retirement_calculator import TaxAwareRetirementCalculator, TaxBrackets
+    scenario = _scenario(years_to_live)
+    del scenario['current_retirement_savings'], scenario['retirement_tax_rate']
+    brackets = TaxBrackets([0, 11000, 44725, 95375, 182100], [0.10, 0.12, 0.22, 0.24, 0.32], deduction=13850)
+    return lambda: TaxAwareRetirementCalculator(
+        50000, 80000, 20000, deferred_contribution_share=0.6, tax_brackets=brackets, **scenario).get_waste()
+
+def _random_batch(num_scenarios):
+    rng = numpy.random.default_rng(SEED)
+    return dict(
+        current_retirement_savings=rng.uniform(0, 1e6, num_scenarios),
+        annual_contribution=rng.uniform(0, 60000, num_scenarios),
+        annual_contribution_increase_rate=rng.uniform(0, 0.05, num_scenarios),
+        pre_retirement_growth_rate=rng.uniform(0.02, 0.1, num_scenarios),
+        post_retirement_growth_rate=rng.uniform(0.01, 0.06, num_scenarios),
+        inflation_rate=rng.uniform(0.01, 0.04, num_scenarios),
+        years_to_live=rng.integers(20, 80, num_scenarios),
+        desired_net_retirement_income_todays_dollars=rng.uniform(20000, 120000, num_scenarios),
+        retirement_tax_rate=rng.uniform(0.1, 0.35, num_scenarios))
+
+def batch_scenarios(num_scenarios=10000):
+    from batch_retirement_calculator import BatchRetirementAgeCalculator
+    batch = _random_batch(num_scenarios)
+    return lambda: BatchRetirementAgeCalculator(**batch).get_waste()
+
+def _random_grants(num_grants):
+    rng = random.Random(SEED)
+    return [
+        Grant(rng.randint(1000, 50000), rng.randint(10, 1000), '%d-%02d' % (rng.randint(2020, 2030), rng.randint(1, 12)), rng.uniform(0, 20), rng.uniform(0, 0.05))
+        for _ in range(num_grants)
+    ]
+
+def _leave_dates(num_dates):
+    return ['%d-%02d' % (2020 + month // 12, month % 12 + 1) for month in range(num_dates)]
+
+def equity_estimator(num_grants=10000, num_dates=100):
+    estimator = EquityValueEstimator(_random_grants(num_grants), 12.5, 0.2)
+    leave_dates = _leave_dates(num_dates)
+    return lambda: [estimator.total_value(leave_date) for leave_date in leave_dates]
+
+def equity_grant_book(num_grants=10000, num_dates=100):
+    from equity.grant_book import GrantBook
+    book = GrantBook.from_grants(_random_grants(num_grants))
+    leave_dates = _leave_dates(num_dates)
+    return lambda: book.total_value(leave_dates, [12.5], 0.2)
+
+# (name, workload factory, units of work per call, unit, needs numpy)
+BENCHMARKS = [
+    ('scenario_years_30', lambda: single_scenario(30), 1, 'scenario', False),
+    ('scenario_years_60', lambda: single_scenario(60), 1, 'scenario', False),
+    ('scenario_years_120', lambda: single_scenario(120), 1, 'scenario', False),
+    ('scenario_years_120_lazy', lambda: single_scenario(120, lazy=True), 1, 'scenario', False),
+    ('scenario_series_years_120', lambda: scenario_series(120), 1, 'scenario', False),
+    ('scenario_series_years_120_compact', lambda: scenario_series(120, compact=True), 1, 'scenario', False),
+    ('heavy_manual_changes', heavy_changes, 1, 'scenario', False),
+    ('tax_aware_scenario_years_60', lambda: tax_aware_scenario(60), 1, 'scenario', True),
+    ('batch_10k_scenarios', batch_scenarios, 10000, 'scenario', True),
+    ('equity_estimator_10k_grants_100_dates', equity_estimator, 10000 * 100, 'grant-date', False),
+    ('equity_grant_book_10k_grants_100_dates', equity_grant_book, 10000 * 100, 'grant-date', True),
+]
+
+# ========================== Measurement ===========================================================
+
+def measure(workload, units_per_call, repeat):
+    """
+    Time at least repeat calls of workload (after one warm-up call) and measure its peak traced memory
+    """
+    workload()
+    latencies = []
+    while len(latencies) < repeat or sum(latencies) < MIN_SAMPLE_SECONDS:
+        start = time.perf_counter()
+        workload()
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    tracemalloc.start()
+    try:
+        workload()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        'calls': len(latencies),
+        'mean_ms': 1000 * sum(latencies) / len(latencies),
+        'throughput_per_s': units_per_call * len(latencies) / sum(latencies),
+        'peak_memory_kb': peak_bytes / 1024,
+    }
+    for percentile in PERCENTILES:
+        result['p%s_ms' % percentile] = 1000 * nearest_rank_percentile(latencies, percentile)
+    return result
+
+def find_regressions(results, baseline, threshold):
+    """
+    (benchmark, metric, baseline value, new value) for every median latency or peak memory that grew by more than
+     threshold (a fraction) over the baseline. Benchmarks missing from either side are skipped.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in ('p50_ms', 'peak_memory_kb'):
+            old, new = baseline[name][metric], result[metric]
+            if new > old * (1 + threshold) and new > 0:
+                regressions.append((name, metric, old, new))
+    return regressions
+
+# ========================== Arg Parsing ===========================================================
+
+SAVE_BASELINE_KEY = 'save_baseline'
+COMPARE_KEY = 'compare'
+THRESHOLD_KEY = 'threshold'
+REPEAT_KEY = 'repeat'
+FILTER_KEY = 'filter'
+
+parser = argparse.ArgumentParser(description='Benchmark the retirement and equity engines.')
+parser.add_argument('--save-baseline', dest=SAVE_BASELINE_KEY, metavar='path', help='Save the results as a JSON baseline to this file')
+parser.add_argument('--compare', dest=COMPARE_KEY, metavar='path', help='Compare against a JSON baseline saved earlier, and exit with status 1 on regressions')
+parser.add_argument('--threshold', dest=THRESHOLD_KEY, type=float, default=DEFAULT_THRESHOLD, help='Allowed growth in median latency/peak memory over the baseline before it counts as a regression, in the form 0.XX')
+parser.add_argument('--repeat', dest=REPEAT_KEY, type=int, default=DEFAULT_REPEAT, help='Number of timed calls per benchmark')
+parser.add_argument('-k', '--filter', dest=FILTER_KEY, default='', help='Only run benchmarks whose name contains this string')
+
+if __name__ == '__main__':
+    parsed_args = vars(parser.parse_args())
+    if parsed_args[REPEAT_KEY] < 1:
+        print("ERROR: Repeat must be >= 1")
+        sys.exit(1)
+
+    results = {}
+    for name, make_workload, units_per_call, unit, needs_numpy in BENCHMARKS:
+        if parsed_args[FILTER_KEY] not in name:
+            continue
+        if needs_numpy and not have_numpy:
+            print("INFO: skipping %s as numpy was not found; run 'pip install numpy' to include it" % name)
+            continue
+        results[name] = measure(make_workload(), units_per_call, parsed_args[REPEAT_KEY])
+        results[name]['unit'] = unit
+
+    headers = ['benchmark', 'throughput', 'p50 ms', 'p90 ms', 'p99 ms', 'peak KB']
+    rows = [
+        [name, '%s %s/s' % ('{:,.0f}'.format(result['throughput_per_s']), result['unit'])]
+        + ['%.3f' % result['p%s_ms' % percentile] for percentile in PERCENTILES]
+        + ['{:,.0f}'.format(result['peak_memory_kb'])]
+        for name, result in results.items()
+    ]
+    if have_tabulate:
+        print(tabulate.tabulate(rows, headers=headers, tablefmt='presto'))
+    else:
+        print("   ".join(headers))
+        for row in rows:
+            print("   ".join(row))
+
+    if parsed_args[SAVE_BASELINE_KEY] is not None:
+        baseline = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'benchmarks': results,
+        }
+        with open(parsed_args[SAVE_BASELINE_KEY], 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print("Saved baseline to %s" % parsed_args[SAVE_BASELINE_KEY])
+
+    if parsed_args[COMPARE_KEY] is not None:
+        with open(parsed_args[COMPARE_KEY]) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('python') != platform.python_version() or baseline.get('machine') != platform.machine():
+            print("WARN: baseline was recorded with Python %s on %s, so the comparison may not be meaningful" % (baseline.get('python'), baseline.get('machine')))
+        regressions = find_regressions(results, baseline['benchmarks'], parsed_args[THRESHOLD_KEY])
+        if regressions:
+            for name, metric, old, new in regressions:
+                print("REGRESSION: %s %s went from %.3f to %.3f" % (name, metric, old, new))
+            sys.exit(1)
+        print("No regressions over %.0f%% against %s" % (100 * parsed_args[THRESHOLD_KEY], parsed_args[COMPARE_KEY]))
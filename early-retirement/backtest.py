@@ -0,0 +1,334 @@
+"""
+Historical backtesting: the constant rates RetirementAgeCalculator assumes hide sequence-of-returns risk, so instead
+ replay each client's plan against every rolling window of a historical returns/inflation dataset.
+
+A client's plan is the earliest retirement year under their constant (expected) rates. For every historical start
+ year, the pre-retirement growth, post-retirement growth and inflation rates are replaced by the sequence starting
+ that year, and we check whether retiring as planned would have run out of money before death.
+
+The dataset is a CSV with 'year', 'return' and 'inflation' columns (rates in the form 0.XX) plus an optional
+ 'post_return' column for retirement-era returns, which otherwise match 'return'. It's converted once to a .npy file
+ next to it, which later runs memory-map instead of re-parsing. Windows are views into that array, and every
+ (client, window) pair is evaluated as one vectorized batch.
+"""
+
+import csv
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from batch_retirement_calculator import (
+    NEVER_RETIRE,
+    BatchRetirementAgeCalculator,
+    broadcast_inputs,
+    per_scenario_changes,
+    contribution_matrix,
+    cumulative_growth,
+    net_worth_change_matrix,
+    no_retirement_matrix,
+    withdrawals_matrix,
+    min_worth_matrix,
+    earliest_retirement,
+    account_value_matrix,
+    actual_withdrawals_matrix,
+    waste_vector,
+)
+from instrumentation import NULL_INSTRUMENTATION
+
+YEAR_COLUMN = 'year'
+RETURN_COLUMN = 'return'
+POST_RETURN_COLUMN = 'post_return'
+INFLATION_COLUMN = 'inflation'
+
+# Max (client, window) rows evaluated at once, to bound memory with many clients
+DEFAULT_CHUNK_SIZE = 50000
+
+class HistoricalReturns:
+    """
+    Annual historical rates, stored as a (4, years) array of rows year, pre-retirement growth, post-retirement growth
+     and inflation, so each series is contiguous and windows over it are plain views
+    """
+    def __init__(self, data):
+        if data.ndim != 2 or data.shape[0] != 4:
+            raise ValueError("Expected a (4, years) array of year, return, post return and inflation rows")
+        if data.shape[1] == 0:
+            raise ValueError("Historical dataset has no years")
+        self.data = data
+
+    @classmethod
+    def from_csv(cls, csv_path, npy_path=None):
+        """
+        Load a dataset CSV through its binary copy (by default the CSV's path with a .npy extension), which is
+         (re)built if it's missing or older than the CSV and otherwise just memory-mapped
+        """
+        if npy_path is None:
+            npy_path = os.path.splitext(csv_path)[0] + '.npy'
+        if not os.path.exists(npy_path) or os.path.getmtime(npy_path) < os.path.getmtime(csv_path):
+            data = cls._parse_csv(csv_path)
+            # Through a file handle, as np.save adds .npy to any path without it, and to a temporary file first so a
+            #  concurrent load never maps a half-written one
+            temporary_path = npy_path + '.tmp'
+            with open(temporary_path, 'wb') as npy_file:
+                np.save(npy_file, data)
+            os.replace(temporary_path, npy_path)
+        return cls(np.load(npy_path, mmap_mode='r'))
+
+    @staticmethod
+    def _parse_csv(csv_path):
+        with open(csv_path, newline='') as csv_file:
+            reader = csv.DictReader(csv_file)
+            missing = {YEAR_COLUMN, RETURN_COLUMN, INFLATION_COLUMN} - set(reader.fieldnames or [])
+            if missing:
+                raise ValueError("Historical dataset '%s' is missing columns %s" % (csv_path, sorted(missing)))
+            rows = []
+            for row in reader:
+                post_return = row.get(POST_RETURN_COLUMN)
+                try:
+                    rows.append((
+                        int(row[YEAR_COLUMN]),
+                        float(row[RETURN_COLUMN]),
+                        float(post_return) if post_return not in (None, '') else float(row[RETURN_COLUMN]),
+                        float(row[INFLATION_COLUMN])))
+                except ValueError:
+                    raise ValueError("Invalid row in historical dataset '%s' at line %s" % (csv_path, reader.line_num))
+        rows.sort()
+        years = [row[0] for row in rows]
+        if len(set(years)) != len(years):
+            raise ValueError("Historical dataset '%s' has duplicate years" % csv_path)
+        if years and years[-1] - years[0] != len(years) - 1:
+            raise ValueError("Historical dataset '%s' has gaps between years" % csv_path)
+        return np.array(rows, dtype=float).reshape(len(rows), 4).T.copy()
+
+    def __len__(self):
+        return self.data.shape[1]
+
+    @property
+    def years(self):
+        return self.data[0].astype(int)
+
+    def windows(self, num_years, wrap=False):
+        """
+        (start years, pre-retirement growth, post-retirement growth, inflation) for every rolling window of
+         num_years, with a (windows, num_years) array per rate. Without wrap only windows that fit in the history
+         are used, and they're views into it; with wrap every year is a start year and windows run past the end
+         back into the start.
+        """
+        data = self.data
+        if wrap:
+            data = np.concatenate([data] + [data] * ((num_years - 1) // len(self)) + [data[:, :(num_years - 1) % len(self)]], axis=1)
+        elif num_years > len(self):
+            raise ValueError("History only covers %s years, not enough for a %s year window; use wrap to reuse it" % (len(self), num_years))
+        years, pre_retirement_growth_rate, post_retirement_growth_rate, inflation_rate = (sliding_window_view(row, num_years) for row in data)
+        return years[:, 0].astype(int), pre_retirement_growth_rate, post_retirement_growth_rate, inflation_rate
+
+class BacktestResult:
+    """
+    Per-client, per-start-year outcomes of a backtest, as (clients, windows) arrays. Each client is only evaluated in
+     the start years whose window covers their own years_to_live, marked in evaluated; in the others plan_succeeded is
+     False, years_to_retirement is NEVER_RETIRE and everything else is NaN, and they don't count towards the stats.
+    """
+    def __init__(self, start_years, planned_retirement, evaluated, plan_succeeded, funded_ratio, years_to_retirement, waste):
+        self.start_years = start_years
+        self.planned_retirement = planned_retirement
+        self.evaluated = evaluated
+        self.plan_succeeded = plan_succeeded
+        self.funded_ratio = funded_ratio
+        self.years_to_retirement = years_to_retirement
+        self.waste = waste
+
+    def __len__(self):
+        return len(self.planned_retirement)
+
+    def failure_rate(self):
+        """
+        Fraction of start years in which retiring at the planned year runs out of money, per client (NaN for clients
+         that can't retire even with their constant rates)
+        """
+        failure_rate = 1.0 - self.plan_succeeded.sum(axis=1) / self.evaluated.sum(axis=1)
+        failure_rate[self.planned_retirement == NEVER_RETIRE] = np.nan
+        return failure_rate
+
+    def worst_start_year(self):
+        """
+        Start year in which the plan comes up shortest (the lowest funded ratio at retirement), per client, or
+         NEVER_RETIRE for clients without a plan
+        """
+        worst = self.start_years[np.argmin(np.nan_to_num(self.funded_ratio, nan=np.inf), axis=1)]
+        return np.where(self.planned_retirement == NEVER_RETIRE, NEVER_RETIRE, worst)
+
+    def waste_percentiles(self, percentiles=(5, 25, 50, 75, 95)):
+        """
+        Dict of percentile -> per-client dollars at death across start years, when retiring as planned (0 in years the
+         money runs out; NaN for clients without a plan)
+        """
+        has_plan = self.planned_retirement != NEVER_RETIRE
+        waste = np.full((len(percentiles), len(self)), np.nan)
+        if np.any(has_plan):
+            # Start years a client isn't evaluated in are NaN, so they're left out
+            waste[:, has_plan] = np.nanpercentile(self.waste[has_plan], percentiles, axis=1)
+        return dict(zip(percentiles, waste))
+
+class RetirementBacktest:
+    """
+    Takes the same inputs as BatchRetirementAgeCalculator, one entry per client, with the growth and inflation rates
+     being the constant rates each client plans with. planned_retirement optionally overrides the planned retirement
+     year (a scalar, or one per client).
+
+    With an Instrumentation, making the plans and the stages of each run are recorded in it, one calculation per run.
+    """
+    def __init__(self,
+            history,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None,
+            planned_retirement=None,
+            instrumentation=None):
+        self.history = history
+        self._instrumentation = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+        # The plans made with constant rates; this also validates the inputs
+        with self._instrumentation.stage('plan'):
+            plan = BatchRetirementAgeCalculator(
+                current_retirement_savings,
+                annual_contribution,
+                annual_contribution_increase_rate,
+                pre_retirement_growth_rate,
+                post_retirement_growth_rate,
+                inflation_rate,
+                years_to_live,
+                desired_net_retirement_income_todays_dollars,
+                retirement_tax_rate,
+                manual_contrib_changes=manual_contrib_changes,
+                manual_net_worth_changes=manual_net_worth_changes,
+                manual_retirement_income_changes=manual_retirement_income_changes)
+        num_clients = len(plan)
+        self.years_to_live = plan.years_to_live
+        num_years = int(self.years_to_live.max())
+
+        if planned_retirement is None:
+            self.planned_retirement = plan.get_earliest_retirement()
+        else:
+            self.planned_retirement = np.broadcast_to(np.asarray(planned_retirement, dtype=int), (num_clients,)).copy()
+            if np.any((self.planned_retirement < 0) | (self.planned_retirement >= self.years_to_live)):
+                raise ValueError("Planned retirement years must be in range [0,years_to_live)")
+
+        (current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate) = broadcast_inputs(
+                current_retirement_savings,
+                annual_contribution,
+                annual_contribution_increase_rate,
+                desired_net_retirement_income_todays_dollars,
+                retirement_tax_rate,
+                np.zeros(num_clients))[:5]
+        self.current_retirement_savings = current_retirement_savings
+        # Everything that doesn't depend on the historical rates is computed once per client
+        self.contributions = contribution_matrix(
+            num_years,
+            per_scenario_changes(manual_contrib_changes, num_clients, 'contrib change'),
+            annual_contribution,
+            annual_contribution_increase_rate)
+        self.net_worth_changes = net_worth_change_matrix(
+            num_years,
+            per_scenario_changes(manual_net_worth_changes, num_clients, 'net worth change'))
+        # Withdrawals with zero inflation are just the gross income; each window applies its own inflation on top
+        self.gross_income = withdrawals_matrix(
+            num_years,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            np.zeros(num_clients),
+            per_scenario_changes(manual_retirement_income_changes, num_clients, 'retirement income change'))
+
+    def run(self, wrap=False, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Evaluate every client against every rolling window of the history as long as their own years_to_live (see
+         HistoricalReturns.windows), all windows in one batch, and return a BacktestResult. Start years are those of
+         the shortest-lived client, which has the most windows. Clients are evaluated chunk_size rows (clients x
+         windows) at a time.
+        """
+        with self._instrumentation.calculation():
+            return self._run(wrap, chunk_size)
+
+    def _run(self, wrap, chunk_size):
+        num_clients = len(self.years_to_live)
+        # Grouped by years_to_live, so a client's start years don't depend on who else is in the backtest
+        horizons = np.unique(self.years_to_live).tolist()
+        start_years = self.history.windows(horizons[0], wrap)[0]
+        num_windows = len(start_years)
+
+        shape = (num_clients, num_windows)
+        evaluated = np.zeros(shape, dtype=bool)
+        plan_succeeded = np.zeros(shape, dtype=bool)
+        funded_ratio = np.full(shape, np.nan)
+        years_to_retirement = np.full(shape, NEVER_RETIRE, dtype=int)
+        waste = np.full(shape, np.nan)
+        for horizon in horizons:
+            # Windows all start at the beginning of the history, so a longer horizon's are the first of these
+            _, pre_retirement_growth_rate, post_retirement_growth_rate, inflation_rate = self.history.windows(horizon, wrap)
+            inflation_growth = cumulative_growth(inflation_rate)
+            horizon_windows = len(inflation_growth)
+            group = np.flatnonzero(self.years_to_live == horizon)
+            clients_per_chunk = max(1, chunk_size // horizon_windows)
+            for start in range(0, len(group), clients_per_chunk):
+                clients = group[start:start + clients_per_chunk]
+                chunk = self._evaluate_chunk(clients, horizon, pre_retirement_growth_rate, post_retirement_growth_rate, inflation_growth)
+                evaluated[clients, :horizon_windows] = True
+                (plan_succeeded[clients, :horizon_windows],
+                    funded_ratio[clients, :horizon_windows],
+                    years_to_retirement[clients, :horizon_windows],
+                    waste[clients, :horizon_windows]) = (result.reshape(len(clients), horizon_windows) for result in chunk)
+        return BacktestResult(start_years, self.planned_retirement, evaluated, plan_succeeded, funded_ratio, years_to_retirement, waste)
+
+    def _evaluate_chunk(self, clients, num_years, pre_retirement_growth_rate, post_retirement_growth_rate, inflation_growth):
+        """
+        Outcomes for every (client, window) pair of the given clients, who all live num_years, as flat arrays ordered
+         client by client
+        """
+        num_windows = len(inflation_growth)
+        # Row r is client client_rows[r] starting in window window_rows[r]
+        client_rows = np.repeat(clients, num_windows)
+        window_rows = np.tile(np.arange(num_windows), len(clients))
+        years_to_live = self.years_to_live[client_rows]
+        post_growth = post_retirement_growth_rate[window_rows]
+
+        instrumentation = self._instrumentation
+        with instrumentation.stage('min_worth'):
+            all_withdrawals = self.gross_income[client_rows, :num_years] * inflation_growth[window_rows]
+            min_worth = min_worth_matrix(years_to_live, all_withdrawals, post_growth)
+        with instrumentation.stage('no_retirement'):
+            no_retirement = no_retirement_matrix(
+                self.net_worth_changes[client_rows, :num_years],
+                self.current_retirement_savings[client_rows],
+                pre_retirement_growth_rate[window_rows],
+                self.contributions[client_rows, :num_years])
+        # Earliest retirement had you known the sequence ahead of time
+        with instrumentation.stage('retirement_scan'):
+            years_to_retirement = earliest_retirement(no_retirement, min_worth)
+
+        planned_retirement = self.planned_retirement[client_rows]
+        has_plan = planned_retirement != NEVER_RETIRE
+        rows = np.arange(len(client_rows))
+        plan_year = np.where(has_plan, planned_retirement, 0)
+        # Having at least the minimum worth at retirement is exactly what keeps the account from running dry
+        with np.errstate(divide='ignore', invalid='ignore'):
+            funded_ratio = no_retirement[rows, plan_year] / min_worth[rows, plan_year]
+        plan_succeeded = has_plan & (no_retirement[rows, plan_year] >= min_worth[rows, plan_year])
+
+        with instrumentation.stage('waste'):
+            account_value = account_value_matrix(planned_retirement, no_retirement, all_withdrawals, post_growth)
+            actual_withdrawals = actual_withdrawals_matrix(planned_retirement, all_withdrawals)
+            waste = np.where(plan_succeeded, waste_vector(years_to_live, account_value, actual_withdrawals), 0.0)
+        waste[~has_plan] = np.nan
+        funded_ratio[~has_plan] = np.nan
+        return plan_succeeded, funded_ratio, years_to_retirement, waste
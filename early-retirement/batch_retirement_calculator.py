@@ -0,0 +1,317 @@
+"""
+Vectorized counterpart to RetirementAgeCalculator, evaluating many scenarios at once.
+
+Every series is a 2-D matrix of shape (scenarios, years), where `years` is the longest years_to_live in the
+ batch. Recurrences still step year by year, but each step is a single array operation across all scenarios,
+ so the cost of a batch is roughly that of a handful of scalar calculations.
+Cells past a scenario's own years_to_live are padded with NaN in the exported series.
+
+The module-level helpers accept growth and inflation rates either per scenario (1-D) or per scenario per year
+ (2-D, scenarios x years), which is what the stochastic and historical engines build on.
+"""
+
+import numpy as np
+
+from retirement_age_calculator import Series
+
+# Sentinel used in place of None for scenarios that can never retire
+NEVER_RETIRE = -1
+
+def broadcast_inputs(*values):
+    """
+    Broadcast scalar/per-scenario inputs to 1-D float arrays of equal length
+    """
+    arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(value, dtype=float)) for value in values])
+    for array in arrays:
+        if array.ndim != 1:
+            raise ValueError("Batch inputs must be scalars or 1-D arrays, got shape %s" % (array.shape,))
+    return [array.copy() for array in arrays]
+
+def per_scenario_changes(changes, num_scenarios, name):
+    """
+    Normalize a per-scenario list of change dicts (or None) to a list of dicts
+    """
+    if changes is None:
+        return [{}] * num_scenarios
+    if len(changes) != num_scenarios:
+        raise ValueError("Expected %s %s dicts, one per scenario, but got %s" % (num_scenarios, name, len(changes)))
+    return [change_dict if change_dict is not None else {} for change_dict in changes]
+
+def validate_change_years(changes, years_to_live, name):
+    """
+    Raise ValueError if any change dict has a year outside its scenario's [0, years_to_live)
+    """
+    for scenario, change_dict in enumerate(changes):
+        for years_out in change_dict.keys():
+            if years_out < 0 or years_out >= years_to_live[scenario]:
+                raise ValueError("Invalid %s change year '%s' in scenario %s; must be in range [0,%s)" % (name, years_out, scenario, years_to_live[scenario]))
+
+def _forward_fill_index(is_change):
+    """
+    For every cell, the column index of the most recent change at or before it (column 0 always counts as a change)
+    """
+    index = np.where(is_change, np.arange(is_change.shape[1]), 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    return index
+
+def _year_rate(rate, year):
+    """
+    Rate in effect during the given year, for rates given per scenario (1-D) or per scenario per year (2-D)
+    """
+    return rate if rate.ndim == 1 else rate[:, year]
+
+def cumulative_growth(rates):
+    """
+    Growth factors from per-year rates: column i is the product of (1 + rate) over years [0, i), so column 0 is 1
+    """
+    factors = np.ones(rates.shape)
+    np.cumprod(1.0 + rates[:, :-1], axis=1, out=factors[:, 1:])
+    return factors
+
+def _power_table(bases, num_exponents):
+    """
+    Table of base ** k for every distinct base and k in [0, num_exponents), plus the index of each input base into it.
+     Powers use Python's float pow so results are bit-for-bit identical to the scalar classes (NumPy's vectorized pow
+     can differ in the last ulp); building one row per distinct base keeps this cheap for batches that share rates.
+    """
+    unique_bases, base_index = np.unique(bases, return_inverse=True)
+    exponents = range(num_exponents)
+    table = np.array([[base ** k for k in exponents] for base in unique_bases.tolist()]).reshape(len(unique_bases), num_exponents)
+    return table, base_index.reshape(np.shape(bases))
+
+def contribution_matrix(num_years, manual_contrib_changes, initial_contrib_amount, initial_contrib_rate):
+    """
+    Vectorized ContributionFunction; initial amounts/rates are 1-D arrays, changes a list of dicts
+    """
+    num_scenarios = len(initial_contrib_amount)
+    is_change = np.zeros((num_scenarios, num_years), dtype=bool)
+    base = np.zeros((num_scenarios, num_years))
+    rate = np.zeros((num_scenarios, num_years))
+    is_change[:, 0] = True
+    base[:, 0] = initial_contrib_amount
+    rate[:, 0] = initial_contrib_rate
+    for scenario, change_dict in enumerate(manual_contrib_changes):
+        for years_out, (contrib, contrib_rate) in change_dict.items():
+            is_change[scenario, years_out] = True
+            base[scenario, years_out] = contrib
+            rate[scenario, years_out] = contrib_rate
+
+    # Only the rates at change cells are distinct, so build the power table from those and forward-fill indexes into it
+    growth_table, change_growth_index = _power_table(1 + rate[is_change], num_years)
+    growth_index = np.zeros((num_scenarios, num_years), dtype=int)
+    growth_index[is_change] = change_growth_index
+    last_change = _forward_fill_index(is_change)
+    years_since_last_change = np.arange(num_years) - last_change
+    current_base = np.take_along_axis(base, last_change, axis=1)
+    current_growth_index = np.take_along_axis(growth_index, last_change, axis=1)
+    return current_base * growth_table[current_growth_index, years_since_last_change]
+
+def net_worth_change_matrix(num_years, manual_net_worth_changes):
+    """
+    Dense (scenarios, years) matrix of one-off net worth changes from a list of change dicts
+    """
+    net_worth_changes = np.zeros((len(manual_net_worth_changes), num_years))
+    for scenario, change_dict in enumerate(manual_net_worth_changes):
+        for years_out, change in change_dict.items():
+            net_worth_changes[scenario, years_out] = change
+    return net_worth_changes
+
+def no_retirement_matrix(net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, contributions):
+    """
+    Vectorized NoRetirementNetWorthFunction. The change and contribution matrices may have a single row, which is
+     then shared by every scenario.
+    """
+    num_years = net_worth_changes.shape[1]
+    num_scenarios = max(len(current_retirement_savings), len(pre_retirement_growth_rate), len(contributions), len(net_worth_changes))
+    growth = 1 + pre_retirement_growth_rate
+    net_worth = np.empty((num_scenarios, num_years))
+    net_worth[:, 0] = np.maximum(0, current_retirement_savings + net_worth_changes[:, 0])
+    for i in range(1, num_years):
+        net_worth[:, i] = np.maximum(0, net_worth[:, i - 1] * _year_rate(growth, i - 1) + contributions[:, i - 1] + net_worth_changes[:, i])
+    return net_worth
+
+def withdrawals_matrix(num_years, net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes):
+    """
+    Vectorized RetirementWithdrawalsFunction; with per-year inflation rates, year i is inflated by the product of
+     the rates for years [0, i)
+    """
+    num_scenarios = len(net_retirement_income_todays_dollars)
+    is_change = np.zeros((num_scenarios, num_years), dtype=bool)
+    net_income = np.zeros((num_scenarios, num_years))
+    is_change[:, 0] = True
+    net_income[:, 0] = net_retirement_income_todays_dollars
+    for scenario, change_dict in enumerate(manual_retirement_income_changes):
+        for years_out, income in change_dict.items():
+            is_change[scenario, years_out] = True
+            net_income[scenario, years_out] = income
+
+    current_net_income = np.take_along_axis(net_income, _forward_fill_index(is_change), axis=1)
+    gross_income = current_net_income / (1.0 - retirement_tax_rate[:, None])
+    if inflation_rate.ndim == 2:
+        return gross_income * cumulative_growth(inflation_rate)
+    inflation_table, inflation_index = _power_table(1.0 + inflation_rate, num_years)
+    return gross_income * inflation_table[inflation_index]
+
+def min_worth_matrix(years_to_live, withdrawals, post_retirement_growth_rate):
+    """
+    Vectorized RetirementMinWorthFunction. Years past a scenario's years_to_live get an infinite minimum worth,
+     so they can never be picked as a retirement year.
+    """
+    num_scenarios, num_years = withdrawals.shape
+    rows = np.arange(num_scenarios)
+    last_year = years_to_live - 1
+    growth = 1 + post_retirement_growth_rate
+
+    min_worth = np.full((num_scenarios, num_years), np.inf)
+    min_worth[rows, last_year] = withdrawals[rows, last_year]
+    for i in range(num_years - 2, -1, -1):
+        # Our bank account can be a little lower because we'll get in-year growth
+        with np.errstate(invalid='ignore'):
+            value = withdrawals[:, i] + min_worth[:, i + 1] / _year_rate(growth, i)
+        min_worth[:, i] = np.where(i < last_year, value, min_worth[:, i])
+    return min_worth
+
+def earliest_retirement(no_retirement, min_worth):
+    """
+    First year in which the no-retirement net worth covers the minimum retirement worth, or NEVER_RETIRE
+    """
+    can_retire = no_retirement >= min_worth
+    return np.where(can_retire.any(axis=1), can_retire.argmax(axis=1), NEVER_RETIRE)
+
+def account_value_matrix(years_to_retirement, no_retirement, withdrawals, post_retirement_growth_rate):
+    """
+    Vectorized AccountValueFunction; rows that never retire are NaN
+    """
+    growth = 1 + post_retirement_growth_rate
+    account_value = no_retirement.copy()
+    for i in range(1, account_value.shape[1]):
+        # To be conservative, we assume you take out your retirement income at the start of the year (i.e. no market growth on it)
+        retired = np.maximum(0, (account_value[:, i - 1] - withdrawals[:, i - 1]) * _year_rate(growth, i - 1))
+        account_value[:, i] = np.where(i > years_to_retirement, retired, no_retirement[:, i])
+    account_value[years_to_retirement == NEVER_RETIRE] = np.nan
+    return account_value
+
+def actual_withdrawals_matrix(years_to_retirement, withdrawals):
+    """
+    Vectorized ActualWithdrawalsFunction; rows that never retire are NaN
+    """
+    years = np.arange(withdrawals.shape[1])
+    actual_withdrawals = np.where(years >= years_to_retirement[:, None], withdrawals, 0.0)
+    actual_withdrawals[years_to_retirement == NEVER_RETIRE] = np.nan
+    return actual_withdrawals
+
+def waste_vector(years_to_live, account_value, actual_withdrawals):
+    """
+    Dollars left at death for each scenario, NaN where the scenario never retires
+    """
+    rows = np.arange(len(years_to_live))
+    last_year = years_to_live - 1
+    return account_value[rows, last_year] - actual_withdrawals[rows, last_year]
+
+class BatchRetirementAgeCalculator:
+    """
+    Batched version of RetirementAgeCalculator: each numeric input is either a scalar shared by every scenario or a
+     1-D array with one entry per scenario, and each manual change argument is either None or a list with one
+     change dict (or None) per scenario. Results match the scalar class scenario by scenario.
+    """
+    def __init__(self,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None,
+            keep_series=False):
+        """
+        keep_series keeps the full 2-D series matrices around so they can be fetched with get_series_data; without it
+         only the earliest retirement years and waste are retained.
+        """
+        (current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate) = broadcast_inputs(
+                current_retirement_savings,
+                annual_contribution,
+                annual_contribution_increase_rate,
+                pre_retirement_growth_rate,
+                post_retirement_growth_rate,
+                inflation_rate,
+                years_to_live,
+                desired_net_retirement_income_todays_dollars,
+                retirement_tax_rate)
+        if np.any(years_to_live != np.floor(years_to_live)):
+            raise ValueError("Years to live must be whole numbers")
+        years_to_live = years_to_live.astype(int)
+        if len(years_to_live) == 0:
+            raise ValueError("At least one scenario is required")
+        if np.any(years_to_live < 1):
+            raise ValueError("Years to live must be >= 1")
+        num_scenarios = len(years_to_live)
+        num_years = int(years_to_live.max())
+
+        manual_contrib_changes = per_scenario_changes(manual_contrib_changes, num_scenarios, 'contrib change')
+        manual_net_worth_changes = per_scenario_changes(manual_net_worth_changes, num_scenarios, 'net worth change')
+        manual_retirement_income_changes = per_scenario_changes(manual_retirement_income_changes, num_scenarios, 'retirement income change')
+        validate_change_years(manual_contrib_changes, years_to_live, 'contrib')
+        validate_change_years(manual_net_worth_changes, years_to_live, 'net worth')
+        validate_change_years(manual_retirement_income_changes, years_to_live, 'retirement income')
+
+        all_withdrawals = withdrawals_matrix(num_years, desired_net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes)
+        min_worth = min_worth_matrix(years_to_live, all_withdrawals, post_retirement_growth_rate)
+        contributions = contribution_matrix(num_years, manual_contrib_changes, annual_contribution, annual_contribution_increase_rate)
+        net_worth_changes = net_worth_change_matrix(num_years, manual_net_worth_changes)
+        no_retirement = no_retirement_matrix(net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, contributions)
+
+        self.years_to_live = years_to_live
+        self.years_to_retirement = earliest_retirement(no_retirement, min_worth)
+        account_value = account_value_matrix(self.years_to_retirement, no_retirement, all_withdrawals, post_retirement_growth_rate)
+        actual_withdrawals = actual_withdrawals_matrix(self.years_to_retirement, all_withdrawals)
+        self.waste = waste_vector(years_to_live, account_value, actual_withdrawals)
+
+        self.series = None
+        if keep_series:
+            self.series = {
+                Series.ALL_WITHDRAWALS: all_withdrawals,
+                Series.MIN_RETIREMENT_WORTH: min_worth,
+                Series.CONTRIBUTIONS: contributions,
+                Series.NO_RETIREMENT: no_retirement,
+                Series.ACCOUNT_VALUE: account_value,
+                Series.ACTUAL_WITHDRAWALS: actual_withdrawals,
+            }
+            past_death = np.arange(num_years) >= years_to_live[:, None]
+            for matrix in self.series.values():
+                matrix[past_death] = np.nan
+
+    def __len__(self):
+        return len(self.years_to_live)
+
+    def get_earliest_retirement(self):
+        """
+        Array with the smallest number of years after which each scenario can retire, or NEVER_RETIRE if not possible
+        """
+        return self.years_to_retirement
+
+    def get_waste(self):
+        """
+        Array with the dollars each scenario would die with, or NaN if it never gets to retire
+        """
+        return self.waste
+
+    def get_series_data(self, series):
+        """
+        2-D (scenarios, years) matrix for the given series; only available when built with keep_series=True
+        """
+        if self.series is None:
+            raise ValueError("Series data wasn't kept; build the calculator with keep_series=True")
+        return self.series[series]
@@ -0,0 +1,398 @@
+"""
+Long-running calculation service, so a front end can keep one warm process around instead of starting the CLI (and
+ paying for the interpreter, argparse and tabulate imports) for every request.
+
+Clients connect over a Unix socket or TCP and speak newline-delimited JSON: one request object per line, answered by
+ one response object per line with the request's 'id'. Responses are written as they finish, which isn't necessarily
+ request order, so a client can pipeline many requests over one connection. The 'type' field picks the request:
+ - 'retirement' (the default): a scenario with the same fields as a scenario_stream record, answered with
+   years_to_retirement and waste (both None if you can't retire)
+ - 'equity': 'grants' (objects with Grant's arguments: total_shares, shares_per_month, end_date, strike_price and
+   optionally execution_fee), 'leave_dates', 'share_prices' and 'capital_gains', plus optional pay_execution_fee and
+   pay_capital_gains; answered with 'values', a leave dates x share prices grid of GrantBook.total_value. Needs the
+   equity package at the root of this repo to be importable (e.g. with the repo root on PYTHONPATH).
+ - 'metrics': answered with the service's counters and latency percentiles (see CalculationService.metrics)
+Invalid requests are answered with an 'error' field instead.
+
+Requests are queued for a single batcher, which takes everything waiting (after giving stragglers up to max_wait to
+ arrive) and evaluates all the retirement scenarios in it with one BatchRetirementAgeCalculator call, off the event
+ loop. While it's busy the next batch builds up, so batches get bigger, and cheaper per scenario, as load goes up.
+ Identical requests in flight at the same time are coalesced into a single calculation. The queue is bounded and
+ each connection can only have so many requests outstanding, so when the service falls behind it stops reading
+ from clients (and their sends block) rather than buffering without limit.
+"""
+
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import signal
+import time
+
+from instrumentation import nearest_rank_percentile
+from result_cache import canonical_key
+from scenario_stream import ID_FIELD, evaluate_scenarios, parse_scenario
+
+TYPE_FIELD = 'type'
+RETIREMENT_REQUEST = 'retirement'
+EQUITY_REQUEST = 'equity'
+METRICS_REQUEST = 'metrics'
+REQUEST_TYPES = (RETIREMENT_REQUEST, EQUITY_REQUEST, METRICS_REQUEST)
+
+GRANT_FIELDS = ('total_shares', 'shares_per_month', 'end_date', 'strike_price', 'execution_fee')
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH_SIZE = 512
+DEFAULT_MAX_WAIT = 0.001
+DEFAULT_MAX_QUEUE = 4096
+DEFAULT_MAX_CONNECTION_REQUESTS = 256
+# Requests longer than this (e.g. a huge grant list) are refused; asyncio's default line limit is only 64 KiB
+MAX_LINE_BYTES = 16 * 1024 * 1024
+# Number of most recent requests the latency percentiles and recent throughput are taken over
+LATENCY_WINDOW = 10000
+LATENCY_PERCENTILES = (50, 90, 99)
+
+# ========================== Requests ===========================================================
+
+def parse_equity_request(request):
+    """
+    Normalized GrantBook.total_value inputs for an equity request, raising ValueError if it's invalid
+    """
+    try:
+        from equity.grant import month_index
+    except ImportError:
+        raise ValueError("Equity requests need the equity package, which isn't importable; put the repo root on PYTHONPATH")
+
+    grants = request.get('grants')
+    if not isinstance(grants, list) or len(grants) == 0:
+        raise ValueError("Expected 'grants' as a non-empty list of grant objects")
+    grant_rows = []
+    for grant in grants:
+        if not isinstance(grant, dict):
+            raise ValueError("Expected each grant as an object with the fields %s" % ', '.join(GRANT_FIELDS))
+        row = []
+        for field in GRANT_FIELDS:
+            value = grant.get(field, 0 if field == 'execution_fee' else None)
+            if value is None:
+                raise ValueError("Missing grant field '%s'" % field)
+            try:
+                row.append(month_index(value) if field == 'end_date' else float(value))
+            except (TypeError, ValueError):
+                raise ValueError("Invalid value '%s' for grant field '%s'" % (value, field))
+        grant_rows.append(row)
+
+    leave_dates = request.get('leave_dates')
+    share_prices = request.get('share_prices')
+    if not isinstance(leave_dates, list) or len(leave_dates) == 0:
+        raise ValueError("Expected 'leave_dates' as a non-empty list of YYYY-mm dates")
+    if not isinstance(share_prices, list) or len(share_prices) == 0:
+        raise ValueError("Expected 'share_prices' as a non-empty list of prices")
+    try:
+        leave_months = [month_index(date) for date in leave_dates]
+    except (TypeError, ValueError):
+        raise ValueError("Invalid leave dates %s; expected YYYY-mm dates" % leave_dates)
+    try:
+        share_prices = [float(price) for price in share_prices]
+        capital_gains = float(request.get('capital_gains'))
+    except (TypeError, ValueError):
+        raise ValueError("Invalid share prices or capital gains; expected numbers")
+    return {
+        'grants': grant_rows,
+        'leave_months': leave_months,
+        'share_prices': share_prices,
+        'capital_gains': capital_gains,
+        'pay_execution_fee': bool(request.get('pay_execution_fee', True)),
+        'pay_capital_gains': bool(request.get('pay_capital_gains', True)),
+    }
+
+def evaluate_equity(inputs):
+    """
+    Result dict (values and error) for parse_equity_request inputs
+    """
+    from equity.grant_book import GrantBook
+
+    book = GrantBook(*zip(*inputs['grants']))
+    values = book.total_value(
+        inputs['leave_months'],
+        inputs['share_prices'],
+        inputs['capital_gains'],
+        pay_execution_fee=inputs['pay_execution_fee'],
+        pay_capital_gains=inputs['pay_capital_gains'])
+    return {'values': values.tolist(), 'error': None}
+
+def evaluate_batch(requests):
+    """
+    Result dicts for a list of (request type, parsed inputs) pairs, with all the retirement scenarios evaluated
+     together
+    """
+    results = [None] * len(requests)
+    retirement_rows = [row for row, (request_type, _) in enumerate(requests) if request_type == RETIREMENT_REQUEST]
+    if retirement_rows:
+        for row, result in zip(retirement_rows, evaluate_scenarios([requests[row][1] for row in retirement_rows])):
+            results[row] = result
+    for row, (request_type, inputs) in enumerate(requests):
+        if request_type == EQUITY_REQUEST:
+            try:
+                results[row] = evaluate_equity(inputs)
+            except (ValueError, ArithmeticError) as error:
+                results[row] = {'values': None, 'error': "Calculation failed: %s" % error}
+    return results
+
+# ========================== Service ===========================================================
+
+class CalculationService:
+    """
+    Micro-batching, coalescing evaluator of service requests; see the module docstring. Call start() from within the
+     event loop before handling requests, and stop() when done.
+
+    max_batch_size caps the requests evaluated together, max_wait (seconds) is how long the batcher waits for more
+     requests once it has one, max_queue bounds the requests waiting for the batcher, and max_connection_requests
+     bounds the requests a single connection can have outstanding.
+    """
+    def __init__(self,
+            max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+            max_wait=DEFAULT_MAX_WAIT,
+            max_queue=DEFAULT_MAX_QUEUE,
+            max_connection_requests=DEFAULT_MAX_CONNECTION_REQUESTS):
+        if max_batch_size < 1:
+            raise ValueError("Max batch size must be >= 1")
+        if max_wait < 0:
+            raise ValueError("Max wait must be >= 0")
+        if max_queue < 1:
+            raise ValueError("Max queue must be >= 1")
+        if max_connection_requests < 1:
+            raise ValueError("Max connection requests must be >= 1")
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.max_connection_requests = max_connection_requests
+
+        self._queue = None
+        self._batcher = None
+        # One thread, as there's only one batcher; it keeps the calculations off the event loop
+        self._executor = None
+        # canonical_key of the request -> future for its result, while it's queued or being evaluated
+        self._in_flight = {}
+        # (finish time, latency) of the most recent requests
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.started_at = None
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.largest_batch = 0
+
+    async def start(self):
+        self._queue = asyncio.Queue(self.max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._batcher = asyncio.create_task(self._run_batches())
+        self.started_at = time.monotonic()
+
+    async def stop(self):
+        self._batcher.cancel()
+        try:
+            await self._batcher
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown(wait=True)
+
+    async def handle(self, request):
+        """
+        Response dict for a request dict
+        """
+        start = time.perf_counter()
+        is_object = isinstance(request, dict)
+        response = {ID_FIELD: request.get(ID_FIELD) if is_object else None}
+        request_type = request.get(TYPE_FIELD, RETIREMENT_REQUEST) if is_object else None
+        if request_type == METRICS_REQUEST:
+            response['metrics'] = self.metrics()
+            response['error'] = None
+            return response
+        self.requests += 1
+        try:
+            if not is_object:
+                raise ValueError("Expected a request object")
+            if request_type == RETIREMENT_REQUEST:
+                inputs = parse_scenario(request)
+            elif request_type == EQUITY_REQUEST:
+                inputs = parse_equity_request(request)
+            else:
+                raise ValueError("Unknown request type '%s'; must be one of %s" % (request_type, REQUEST_TYPES))
+            response.update(await self._submit(request_type, inputs))
+        except ValueError as error:
+            response['error'] = str(error)
+        if response['error'] is not None:
+            self.errors += 1
+        now = time.perf_counter()
+        self._latencies.append((now, now - start))
+        return response
+
+    async def handle_line(self, line):
+        """
+        Response dict for one line of JSON
+        """
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            self.requests += 1
+            self.errors += 1
+            return {ID_FIELD: None, 'error': "Invalid JSON: %s" % error}
+        return await self.handle(request)
+
+    async def _submit(self, request_type, inputs):
+        key = canonical_key([request_type, inputs])
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = future
+            try:
+                # Waits while the queue is full, which is what pushes back on the clients
+                await self._queue.put((request_type, inputs, key, future))
+            except BaseException:
+                del self._in_flight[key]
+                future.cancel()
+                raise
+        # Shielded, so one coalesced request going away doesn't cancel the result for the others
+        return await asyncio.shield(future)
+
+    def _take_queued(self, batch):
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            self._take_queued(batch)
+            if len(batch) < self.max_batch_size and self.max_wait > 0:
+                await asyncio.sleep(self.max_wait)
+                self._take_queued(batch)
+
+            try:
+                results = await loop.run_in_executor(self._executor, evaluate_batch, [(request_type, inputs) for request_type, inputs, _, _ in batch])
+            except Exception as error:
+                # Requests were validated up front and evaluate_batch isolates calculation errors per request, so this
+                #  is a bug, but still answer rather than leave clients hanging
+                results = [{'error': "Internal error: %s" % error}] * len(batch)
+            for (_, _, key, future), result in zip(batch, results):
+                del self._in_flight[key]
+                if not future.cancelled():
+                    future.set_result(result)
+            self.batches += 1
+            self.batched_requests += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+
+    async def handle_connection(self, reader, writer):
+        """
+        asyncio stream server callback, answering each line of JSON with a line of JSON
+        """
+        self.connections += 1
+        slots = asyncio.Semaphore(self.max_connection_requests)
+        write_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while True:
+                # Stop reading once the connection has too many requests outstanding
+                await slots.acquire()
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    writer.write((json.dumps({ID_FIELD: None, 'error': "Request longer than %s bytes" % MAX_LINE_BYTES}) + '\n').encode('utf-8'))
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    slots.release()
+                    continue
+                task = asyncio.create_task(self._respond(line, writer, write_lock, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.connections -= 1
+
+    async def _respond(self, line, writer, write_lock, slots):
+        try:
+            response = await self.handle_line(line)
+            writer.write((json.dumps(response) + '\n').encode('utf-8'))
+            async with write_lock:
+                await writer.drain()
+        finally:
+            slots.release()
+
+    def metrics(self):
+        """
+        Dict of counters since start (requests, errors, coalesced requests, batches, ...), the current queue depth,
+         and latency percentiles (milliseconds, from receiving a request to having its response) and throughput over
+         the most recent requests
+        """
+        now = time.perf_counter()
+        latencies = sorted(latency for _, latency in self._latencies)
+        recent_seconds = now - self._latencies[0][0] + self._latencies[0][1] if self._latencies else 0
+        metrics = {
+            'uptime_seconds': time.monotonic() - self.started_at,
+            'connections': self.connections,
+            'requests': self.requests,
+            'errors': self.errors,
+            'coalesced': self.coalesced,
+            'batches': self.batches,
+            'mean_batch_size': self.batched_requests / self.batches if self.batches else None,
+            'largest_batch': self.largest_batch,
+            'queue_depth': self._queue.qsize(),
+            'in_flight': len(self._in_flight),
+            'recent_requests': len(latencies),
+            'recent_throughput_per_s': len(latencies) / recent_seconds if recent_seconds > 0 else None,
+        }
+        for percentile in LATENCY_PERCENTILES:
+            metrics['p%s_latency_ms' % percentile] = 1000 * nearest_rank_percentile(latencies, percentile) if latencies else None
+        return metrics
+
+# ========================== Server ===========================================================
+
+async def start_server(service, socket_path=None, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Start the service and an asyncio server for it, on the Unix socket at socket_path if given, else on host:port
+    """
+    await service.start()
+    if socket_path is not None:
+        return await asyncio.start_unix_server(service.handle_connection, path=socket_path, limit=MAX_LINE_BYTES)
+    return await asyncio.start_server(service.handle_connection, host, port, limit=MAX_LINE_BYTES)
+
+async def serve(service, socket_path=None, host=DEFAULT_HOST, port=DEFAULT_PORT, on_ready=None):
+    """
+    Run the service until SIGINT/SIGTERM, calling on_ready(server) once it's listening
+    """
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signal_number, stopping.set)
+        except (NotImplementedError, RuntimeError):
+            # Not supported on this platform (or not the main thread); Ctrl-C still raises KeyboardInterrupt
+            pass
+    server = await start_server(service, socket_path, host, port)
+    try:
+        async with server:
+            if on_ready is not None:
+                on_ready(server)
+            await stopping.wait()
+    finally:
+        await service.stop()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.unlink(socket_path)
@@ -1,6 +1,10 @@
 import sys
+import math
+import json
 import argparse
 from retirement_age_calculator import RetirementAgeCalculator, Series
+from instrumentation import add_cli_arguments as add_instrumentation_arguments, start_from_cli as start_instrumentation
+from scenario_stream import parse_net_worth_changes, parse_contrib_changes, parse_retirement_income_changes
 
 try:
     import tabulate
@@ -25,7 +29,216 @@ NET_WORTH_CHANGE_KEY = 'net_worth_change'
 CONTRIB_CHANGE_KEY = 'contrib_change'
 RETIREMENT_INCOME_CHANGE_KEY = 'retirement_income_change'
 
-parser = argparse.ArgumentParser(description='Calculate the earliest retirement is available based on the given parameters.')
+SOLVE_COMMAND = 'solve'
+SOLVE_FOR_KEY = 'solve_for'
+TARGET_YEAR_KEY = 'target_year'
+SOLVE_FOR_INCOME = 'income'
+SOLVE_FOR_CONTRIB = 'contribution'
+SOLVE_FOR_SAVINGS = 'savings'
+
+BATCH_COMMAND = 'batch'
+INPUT_KEY = 'input'
+FORMAT_KEY = 'format'
+OUTPUT_FORMAT_KEY = 'output_format'
+WORKERS_KEY = 'workers'
+CHUNK_SIZE_KEY = 'chunk_size'
+CACHE_KEY = 'cache'
+
+EXPORT_COMMAND = 'export'
+OUTPUT_DIR_KEY = 'output_dir'
+SERIES_KEY = 'series'
+
+SERVE_COMMAND = 'serve'
+SOCKET_KEY = 'socket'
+HOST_KEY = 'host'
+PORT_KEY = 'port'
+MAX_BATCH_SIZE_KEY = 'max_batch_size'
+MAX_WAIT_KEY = 'max_wait'
+MAX_QUEUE_KEY = 'max_queue'
+
+BACKTEST_COMMAND = 'backtest'
+DATASET_KEY = 'dataset'
+WRAP_KEY = 'wrap'
+
+# =============== Batch Mode ====================================
+# 'batch' reads many scenarios from a file/stdin instead of the positional arguments, and streams out one result each
+if len(sys.argv) > 1 and sys.argv[1] == BATCH_COMMAND:
+    import scenario_stream
+
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (sys.argv[0], BATCH_COMMAND),
+        description="Calculate the earliest retirement for each scenario in a CSV/JSONL file (one per row/line, with the same fields as this script's arguments; see scenario_stream.py), writing one result per scenario in input order. Invalid scenarios get an error in their result instead of stopping the run.")
+    parser.add_argument(INPUT_KEY, nargs='?', default='-', help="Input file, or '-' for stdin (the default)")
+    parser.add_argument('-f', '--format', dest=FORMAT_KEY, choices=scenario_stream.FORMATS, help="Input format; defaults to csv for .csv files and jsonl otherwise")
+    parser.add_argument('-o', '--output-format', dest=OUTPUT_FORMAT_KEY, choices=scenario_stream.FORMATS, help='Output format, written to stdout; defaults to the input format')
+    parser.add_argument('-j', '--workers', dest=WORKERS_KEY, type=int, default=None, help='Number of worker processes to evaluate scenarios with')
+    parser.add_argument('--chunk-size', dest=CHUNK_SIZE_KEY, type=int, default=scenario_stream.DEFAULT_CHUNK_SIZE, help='Number of scenarios handed to a worker at a time')
+    parser.add_argument('--cache', dest=CACHE_KEY, metavar='path', help='sqlite file to cache results in, so repeated scenarios (in this run or later ones) are only calculated once')
+    add_instrumentation_arguments(parser)
+    parsed_args = vars(parser.parse_args(sys.argv[2:]))
+    instrumentation = start_instrumentation(parsed_args)
+
+    input_path = parsed_args[INPUT_KEY]
+    input_format = parsed_args[FORMAT_KEY]
+    if input_format is None:
+        input_format = scenario_stream.CSV_FORMAT if input_path.lower().endswith('.csv') else scenario_stream.JSONL_FORMAT
+    output_format = parsed_args[OUTPUT_FORMAT_KEY] or input_format
+    if parsed_args[CHUNK_SIZE_KEY] < 1:
+        print("ERROR: Chunk size must be >= 1")
+        sys.exit(1)
+
+    cache = None
+    if parsed_args[CACHE_KEY] is not None:
+        from result_cache import ResultCache
+        cache = ResultCache(path=parsed_args[CACHE_KEY])
+
+    input_stream = sys.stdin if input_path == '-' else open(input_path, newline='')
+    try:
+        results = scenario_stream.evaluate_stream(
+            scenario_stream.read_records(input_stream, input_format),
+            workers=parsed_args[WORKERS_KEY],
+            chunk_size=parsed_args[CHUNK_SIZE_KEY],
+            cache=cache,
+            instrumentation=instrumentation)
+        scenario_stream.write_results(results, sys.stdout, output_format)
+    finally:
+        if input_stream is not sys.stdin:
+            input_stream.close()
+        if cache is not None:
+            cache.close()
+            # On stderr, so it doesn't end up in the results
+            stats = cache.stats()
+            print("CACHE: %s hits, %s disk hits, %s misses, %s evictions (%.1f%% hit rate)" % (stats['hits'], stats['disk_hits'], stats['misses'], stats['evictions'], 100 * stats['hit_rate']), file=sys.stderr)
+    sys.exit(0)
+
+# =============== Export Mode ====================================
+# 'export' calculates the same scenario files as 'batch', but writes every scenario's per-year series as binary arrays
+if len(sys.argv) > 1 and sys.argv[1] == EXPORT_COMMAND:
+    import scenario_stream
+    import series_export
+
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (sys.argv[0], EXPORT_COMMAND),
+        description="Calculate each scenario in a CSV/JSONL file (same format as the batch command) and write the per-year series of all of them to a directory of .npy files plus a manifest.json, which can be memory-mapped with numpy instead of parsing text (see series_export.py).")
+    parser.add_argument(INPUT_KEY, help="Input file, or '-' for stdin")
+    parser.add_argument(OUTPUT_DIR_KEY, help='Directory to write the export to; created if needed')
+    parser.add_argument('-f', '--format', dest=FORMAT_KEY, choices=scenario_stream.FORMATS, help="Input format; defaults to csv for .csv files and jsonl otherwise")
+    parser.add_argument('-s', '--series', dest=SERIES_KEY, action='append', choices=[series.name for series in Series], help='Series to export (all by default). This option can be specified multiple times.')
+    parser.add_argument('--chunk-size', dest=CHUNK_SIZE_KEY, type=int, default=series_export.DEFAULT_CHUNK_SIZE, help='Number of scenarios calculated at a time')
+    parsed_args = vars(parser.parse_args(sys.argv[2:]))
+
+    input_path = parsed_args[INPUT_KEY]
+    input_format = parsed_args[FORMAT_KEY]
+    if input_format is None:
+        input_format = scenario_stream.CSV_FORMAT if input_path.lower().endswith('.csv') else scenario_stream.JSONL_FORMAT
+
+    # Like batch mode, a bad row is reported and skipped rather than stopping the export
+    scenarios = []
+    ids = []
+    rows = []
+    skipped = 0
+    input_stream = sys.stdin if input_path == '-' else open(input_path, newline='')
+    try:
+        for row, record in enumerate(scenario_stream.read_records(input_stream, input_format), 1):
+            try:
+                if isinstance(record, str):
+                    try:
+                        record = json.loads(record)
+                    except ValueError as error:
+                        raise ValueError("Invalid JSON: %s" % error)
+                scenario = scenario_stream.parse_scenario(record)
+            except ValueError as error:
+                print("ERROR: Row %s: %s" % (row, error))
+                skipped += 1
+                continue
+            scenarios.append(scenario)
+            ids.append(record.get(scenario_stream.ID_FIELD))
+            rows.append(row)
+    finally:
+        if input_stream is not sys.stdin:
+            input_stream.close()
+    if len(scenarios) == 0:
+        print("ERROR: No valid scenarios to export")
+        sys.exit(1)
+
+    series = [Series[name] for name in parsed_args[SERIES_KEY]] if parsed_args[SERIES_KEY] else None
+    try:
+        manifest = series_export.export_series(
+            parsed_args[OUTPUT_DIR_KEY],
+            scenarios,
+            series=series,
+            chunk_size=parsed_args[CHUNK_SIZE_KEY],
+            ids=ids if any(scenario_id is not None for scenario_id in ids) else None,
+            rows=rows)
+    except (OSError, ValueError) as error:
+        print("ERROR: %s" % error)
+        sys.exit(1)
+    print(" > EXPORTED: %s scenarios x %s years, %s series, to %s" % (manifest['num_scenarios'], manifest['num_years'], len(manifest['series']), parsed_args[OUTPUT_DIR_KEY]))
+    if skipped > 0:
+        print(" > SKIPPED: %s invalid rows (see the errors above; the manifest's 'rows' gives each exported scenario's input row)" % skipped)
+    sys.exit(0)
+
+# =============== Serve Mode ====================================
+# 'serve' keeps one process running that answers scenarios sent to it as JSON, instead of starting the CLI per scenario
+if len(sys.argv) > 1 and sys.argv[1] == SERVE_COMMAND:
+    import asyncio
+    import calculation_service
+
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (sys.argv[0], SERVE_COMMAND),
+        description="Run a calculation service that answers retirement and equity requests sent to it as newline-delimited JSON over a Unix socket or TCP (see calculation_service.py). Concurrent requests are evaluated together in batches. Stop it with Ctrl-C or SIGTERM.")
+    parser.add_argument('--socket', dest=SOCKET_KEY, metavar='path', help='Listen on a Unix socket at this path instead of TCP')
+    parser.add_argument('--host', dest=HOST_KEY, default=calculation_service.DEFAULT_HOST, help='Host to listen on')
+    parser.add_argument('--port', dest=PORT_KEY, type=int, default=calculation_service.DEFAULT_PORT, help='Port to listen on')
+    parser.add_argument('--max-batch-size', dest=MAX_BATCH_SIZE_KEY, type=int, default=calculation_service.DEFAULT_MAX_BATCH_SIZE, help='Max number of requests evaluated together')
+    parser.add_argument('--max-wait', dest=MAX_WAIT_KEY, type=float, default=calculation_service.DEFAULT_MAX_WAIT, help='Seconds to wait for more requests to batch with once one arrives')
+    parser.add_argument('--max-queue', dest=MAX_QUEUE_KEY, type=int, default=calculation_service.DEFAULT_MAX_QUEUE, help='Max number of requests waiting to be evaluated before the service stops reading new ones')
+    parsed_args = vars(parser.parse_args(sys.argv[2:]))
+
+    try:
+        service = calculation_service.CalculationService(
+            max_batch_size=parsed_args[MAX_BATCH_SIZE_KEY],
+            max_wait=parsed_args[MAX_WAIT_KEY],
+            max_queue=parsed_args[MAX_QUEUE_KEY])
+    except ValueError as error:
+        print("ERROR: %s" % error)
+        sys.exit(1)
+    socket_path = parsed_args[SOCKET_KEY]
+    address = socket_path if socket_path is not None else '%s:%s' % (parsed_args[HOST_KEY], parsed_args[PORT_KEY])
+    try:
+        asyncio.run(calculation_service.serve(
+            service,
+            socket_path=socket_path,
+            host=parsed_args[HOST_KEY],
+            port=parsed_args[PORT_KEY],
+            on_ready=lambda server: print("Serving on %s" % address, flush=True)))
+    except OSError as error:
+        print("ERROR: %s" % error)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    sys.exit(0)
+
+# 'solve' runs the calculation in reverse, using the same arguments as the default mode
+solve_mode = len(sys.argv) > 1 and sys.argv[1] == SOLVE_COMMAND
+# 'backtest' uses the rates from the same arguments to make the plan it then tests against history
+backtest_mode = len(sys.argv) > 1 and sys.argv[1] == BACKTEST_COMMAND
+if solve_mode:
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (sys.argv[0], SOLVE_COMMAND),
+        description="Find the max net retirement income, min annual contribution or min current savings that lets you retire by a target year. The value given for the parameter being solved for is ignored.")
+    parser.add_argument(SOLVE_FOR_KEY, choices=[SOLVE_FOR_INCOME, SOLVE_FOR_CONTRIB, SOLVE_FOR_SAVINGS], help='Parameter to solve for')
+    parser.add_argument(TARGET_YEAR_KEY, type=int, help='Number of years from now by which you want to retire')
+    cli_args = sys.argv[2:]
+elif backtest_mode:
+    parser = argparse.ArgumentParser(
+        prog='%s %s' % (sys.argv[0], BACKTEST_COMMAND),
+        description="Retire at the earliest year the given (constant) growth and inflation rates allow, then replay that plan against every rolling window of a historical dataset to see how often it would have run out of money.")
+    parser.add_argument(DATASET_KEY, help="CSV of historical rates with 'year', 'return', 'inflation' and optionally 'post_return' columns (see backtest.py)")
+    cli_args = sys.argv[2:]
+else:
+    parser = argparse.ArgumentParser(description='Calculate the earliest retirement is available based on the given parameters.')
+    cli_args = sys.argv[1:]
 parser.add_argument(CURRENT_SAVINGS_KEY, type=int, help='Current retirement savings right now, in dollars')
 parser.add_argument(ANNUAL_CONTRIB_KEY, type=int, help='Annual contribution, in dollars')
 parser.add_argument(ANNUAL_CONTRIB_INCREASE_RATE_KEY, type=float, help='Annual contribution, in dollars')
@@ -38,8 +251,13 @@ parser.add_argument(RETIREMENT_TAX_RATE_KEY, type=float, help='Estimated tax rat
 parser.add_argument('-w', '--change-worth', dest=NET_WORTH_CHANGE_KEY, action='append', nargs=2, metavar=('years_out','value'), default=[], help='Indicate a one-off change in net worth at the start of year X (useful to represent a big cash in/outflux - e.g. selling equity). This option can be specified multiple times.')
 parser.add_argument('-c', '--change-contrib', dest=CONTRIB_CHANGE_KEY, action='append', nargs=3, metavar=('years_out','contrib', 'contrib_rate'), default=[], help='Indicate a change in annual contribution amount/rate at the start of year X (useful to represent changing life situation - e.g. a new job). This option can be specified multiple times.')
 parser.add_argument('-i', '--change-retirement-income', dest=RETIREMENT_INCOME_CHANGE_KEY, action='append', nargs=2, metavar=('years_out','net_income'), default=[], help="Indicate a change in annual net retirement income, denominated in today's dollars,  at the start of year X (useful to represent changing life situation - e.g. children moving out of home). This option can be specified multiple times.")
-parser.add_argument('--no-table', dest=SHOW_TABLE_KEY, default=True, action='store_false', help="Don't show the table, just the number of years to retirement")
-parsed_args = vars(parser.parse_args())
+if backtest_mode:
+    parser.add_argument('--wrap', dest=WRAP_KEY, default=False, action='store_true', help="Also use start years too late for a full window, wrapping around to the start of the history")
+elif not solve_mode:
+    parser.add_argument('--no-table', dest=SHOW_TABLE_KEY, default=True, action='store_false', help="Don't show the table, just the number of years to retirement")
+add_instrumentation_arguments(parser)
+parsed_args = vars(parser.parse_args(cli_args))
+instrumentation = start_instrumentation(parsed_args)
 
 current_retirement_savings = parsed_args[CURRENT_SAVINGS_KEY]
 annual_contribution = parsed_args[ANNUAL_CONTRIB_KEY]
@@ -58,43 +276,98 @@ if years_to_live < 1:
 desired_net_retirement_income_todays_dollars = parsed_args[NET_RETIREMENT_INCOME_KEY]
 retirement_tax_rate = parsed_args[RETIREMENT_TAX_RATE_KEY]
 
-# Validate no duplicates, for sanity
-net_worth_changes = {}
-for years_out_str, change_str in parsed_args[NET_WORTH_CHANGE_KEY]:
-    years_out = int(years_out_str)
-    change = int(change_str)
-    if years_out in net_worth_changes:
-        print("ERROR: Two net worth changes defined with the same year '%s'" % years_out)
-        sys.exit(1)
-    if years_out < 0 or years_out >= years_to_live:
-        print("ERROR: Invalid net worth change year '%s'; must be between [0,%s)" % years_out, years_to_live)
-        sys.exit(1)
-    net_worth_changes[years_out] = change
-
-contrib_changes = {}
-for years_out_str, contrib_str, contrib_rate_str in parsed_args[CONTRIB_CHANGE_KEY]:
-    years_out = int(years_out_str)
-    contrib = int(contrib_str)
-    contrib_rate = float(contrib_rate_str)
-    if years_out in contrib_changes:
-        print("ERROR: Two contrib changes defined with the same year '%s'" % years_out)
-        sys.exit(1)
-    if years_out < 0 or years_out >= years_to_live:
-        print("ERROR: Invalid contrib change year '%s'; must be between [0,%s)" % years_out, years_to_live)
+try:
+    net_worth_changes = parse_net_worth_changes(parsed_args[NET_WORTH_CHANGE_KEY], years_to_live)
+    contrib_changes = parse_contrib_changes(parsed_args[CONTRIB_CHANGE_KEY], years_to_live)
+    retirement_income_changes = parse_retirement_income_changes(parsed_args[RETIREMENT_INCOME_CHANGE_KEY], years_to_live)
+except ValueError as error:
+    print("ERROR: %s" % error)
+    sys.exit(1)
+
+# =============== Backtest Mode ====================================
+if backtest_mode:
+    from backtest import HistoricalReturns, RetirementBacktest
+    from batch_retirement_calculator import NEVER_RETIRE
+
+    try:
+        history = HistoricalReturns.from_csv(parsed_args[DATASET_KEY])
+        backtest = RetirementBacktest(
+            history,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=[contrib_changes],
+            manual_net_worth_changes=[net_worth_changes],
+            manual_retirement_income_changes=[retirement_income_changes],
+            instrumentation=instrumentation)
+        result = backtest.run(wrap=parsed_args[WRAP_KEY])
+    except (OSError, ValueError) as error:
+        print("ERROR: %s" % error)
         sys.exit(1)
-    contrib_changes[years_out] = (contrib, contrib_rate)
-
-retirement_income_changes = {}
-for years_out_str, net_income_str in parsed_args[RETIREMENT_INCOME_CHANGE_KEY]:
-    years_out = int(years_out_str)
-    net_income = int(net_income_str)
-    if years_out in retirement_income_changes:
-        print("ERROR: Two retirement income changes defined with the same year '%s'" % years_out)
+
+    planned_retirement = int(result.planned_retirement[0])
+    if planned_retirement == NEVER_RETIRE:
+        print("You can't retire with the current parameters!")
         sys.exit(1)
-    if years_out < 0 or years_out >= years_to_live:
-        print("ERROR: Invalid retirement income change year '%s'; must be between [0,%s)" % years_out, years_to_live)
+    print(" > PLANNED YEARS TO RETIREMENT: %s" % planned_retirement)
+    print(" > START YEARS TESTED: %s (%s-%s)" % (len(result.start_years), result.start_years[0], result.start_years[-1]))
+    print(" > FAILURE RATE: %.1f%% (start years in which the money runs out before death)" % (100 * result.failure_rate()[0]))
+    print(" > WORST START YEAR: %s" % result.worst_start_year()[0])
+    for percentile, waste in result.waste_percentiles().items():
+        print(" > WASTE P%s: %s (dollars at death)" % (percentile, '{:,}'.format(int(waste[0]))))
+    sys.exit(0)
+
+# =============== Solve Mode ====================================
+if solve_mode:
+    from retirement_solver import RetirementSolver
+
+    target_year = parsed_args[TARGET_YEAR_KEY]
+    if target_year < 0 or target_year >= years_to_live:
+        print("ERROR: Invalid target year '%s'; must be between [0,%s)" % (target_year, years_to_live))
         sys.exit(1)
-    retirement_income_changes[years_out] = net_income
+    solver = RetirementSolver(
+        current_retirement_savings,
+        annual_contribution,
+        annual_contribution_increase_rate,
+        pre_retirement_growth_rate,
+        post_retirement_growth_rate,
+        inflation_rate,
+        years_to_live,
+        desired_net_retirement_income_todays_dollars,
+        retirement_tax_rate,
+        manual_contrib_changes=contrib_changes,
+        manual_net_worth_changes=net_worth_changes,
+        manual_retirement_income_changes=retirement_income_changes,
+        instrumentation=instrumentation)
+
+    solve_for = parsed_args[SOLVE_FOR_KEY]
+    if solve_for == SOLVE_FOR_INCOME:
+        max_income = solver.max_retirement_income(target_year)
+        if max_income is None:
+            print("You can't retire in %s years, even with no retirement income!" % target_year)
+            sys.exit(1)
+        elif math.isinf(max_income):
+            print(" > MAX NET RETIREMENT INCOME: unlimited (your retirement income changes take over before you'd need it)")
+        else:
+            print(" > MAX NET RETIREMENT INCOME: %s (today's dollars)" % '{:,}'.format(int(max_income)))
+    else:
+        if solve_for == SOLVE_FOR_CONTRIB:
+            label = 'MIN ANNUAL CONTRIBUTION'
+            min_value = solver.min_annual_contribution(target_year)
+        else:
+            label = 'MIN CURRENT SAVINGS'
+            min_value = solver.min_current_savings(target_year)
+        if min_value is None:
+            print("You can't retire in %s years by changing only the %s!" % (target_year, solve_for))
+            sys.exit(1)
+        print(" > %s: %s (dollars)" % (label, '{:,}'.format(math.ceil(min_value))))
+    sys.exit(0)
 
 show_table = parsed_args[SHOW_TABLE_KEY]
 
@@ -111,7 +384,8 @@ retirement_calculator = RetirementAgeCalculator(
     retirement_tax_rate,
     manual_contrib_changes=contrib_changes,
     manual_net_worth_changes=net_worth_changes,
-    manual_retirement_income_changes=retirement_income_changes)
+    manual_retirement_income_changes=retirement_income_changes,
+    instrumentation=instrumentation)
 
 years_to_retirement = retirement_calculator.get_earliest_retirement()
 if years_to_retirement is None:
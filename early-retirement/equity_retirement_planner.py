@@ -0,0 +1,182 @@
+"""
+Combined equity + retirement planning: instead of working out EquityValueEstimator.total_value by hand and passing it
+ to the CLI as a -w net worth change, evaluate the earliest retirement and waste for a whole grid of leave dates x
+ share prices at once.
+
+The equity payout for a cell is the vested book's after-fee, after-tax value when leaving on that date at that price,
+ and it lands as a net worth change at the start of the first year after leaving. Withdrawals, min worth,
+ contributions and the net worth without equity don't depend on the payout, so they're computed once. As long as the
+ net worth never gets clipped at 0 after the payout, it just adds payout * (1 + growth)^(years since) on top, so
+ every cell is a single vectorized pass; only cells where clipping breaks that are rebuilt as a batch.
+
+Grants come from the equity package at the root of this repo, which needs to be importable (e.g. with the repo root
+ on PYTHONPATH) when passing Grant objects rather than a GrantBook.
+"""
+
+import numpy as np
+
+from batch_retirement_calculator import (
+    NEVER_RETIRE,
+    contribution_matrix,
+    net_worth_change_matrix,
+    no_retirement_matrix,
+    withdrawals_matrix,
+    min_worth_matrix,
+    earliest_retirement,
+)
+from parameter_sweep import SweepResult
+
+MONTHS_PER_YEAR = 12
+LEAVE_DATE_AXIS = 'leave_date'
+SHARE_PRICE_AXIS = 'share_price'
+
+class EquityPlanResult(SweepResult):
+    """
+    SweepResult over the (leave_date, share_price) grid, plus the equity payout for each cell and the year it lands in
+     for each leave date
+    """
+    def __init__(self, axes, years_to_retirement, waste, payouts, payout_years):
+        super().__init__(axes, years_to_retirement, waste)
+        self.payouts = payouts
+        self.payout_years = payout_years
+
+class EquityRetirementPlanner:
+    """
+    grants is a GrantBook or a list of Grants; start_date (format YYYY-mm) is the month year 0 of the retirement plan
+     starts in. The remaining inputs are RetirementAgeCalculator's, plus how the equity gets taxed (see
+     EquityValueEstimator.total_value). Payouts are floored at 0, as you wouldn't exercise options that are underwater
+     overall.
+    """
+    def __init__(self,
+            grants,
+            start_date,
+            capital_gains,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None,
+            pay_execution_fee=True,
+            pay_capital_gains=True):
+        from equity.grant import month_index
+        from equity.grant_book import GrantBook
+
+        manual_contrib_changes = manual_contrib_changes if manual_contrib_changes is not None else {}
+        manual_net_worth_changes = manual_net_worth_changes if manual_net_worth_changes is not None else {}
+        manual_retirement_income_changes = manual_retirement_income_changes if manual_retirement_income_changes is not None else {}
+        if years_to_live < 1:
+            raise ValueError("Years to live must be >= 1")
+        for name, changes in (('contrib', manual_contrib_changes), ('net worth', manual_net_worth_changes), ('retirement income', manual_retirement_income_changes)):
+            for years_out in changes.keys():
+                if years_out < 0 or years_out >= years_to_live:
+                    raise ValueError("Invalid %s change year '%s'; must be in range [0,%s)" % (name, years_out, years_to_live))
+
+        self.book = grants if isinstance(grants, GrantBook) else GrantBook.from_grants(grants)
+        self.start_month = month_index(start_date)
+        self.capital_gains = capital_gains
+        self.pay_execution_fee = pay_execution_fee
+        self.pay_capital_gains = pay_capital_gains
+        self.years_to_live = years_to_live
+        self.pre_retirement_growth_rate = pre_retirement_growth_rate
+        self.post_retirement_growth_rate = post_retirement_growth_rate
+        self.current_retirement_savings = current_retirement_savings
+
+        # Series that don't depend on the equity payout, as single-row matrices
+        self.min_worth = min_worth_matrix(
+            np.array([years_to_live]),
+            withdrawals_matrix(
+                years_to_live,
+                np.array([desired_net_retirement_income_todays_dollars], dtype=float),
+                np.array([retirement_tax_rate], dtype=float),
+                np.array([inflation_rate], dtype=float),
+                [manual_retirement_income_changes]),
+            np.array([post_retirement_growth_rate], dtype=float))[0]
+        self.contributions = contribution_matrix(
+            years_to_live,
+            [manual_contrib_changes],
+            np.array([annual_contribution], dtype=float),
+            np.array([annual_contribution_increase_rate], dtype=float))
+        self.net_worth_changes = net_worth_change_matrix(years_to_live, [manual_net_worth_changes])[0]
+
+        # Net worth without equity, tracking where the floor at 0 kicks in
+        self.base_net_worth = np.empty(years_to_live)
+        clipped = np.zeros(years_to_live, dtype=bool)
+        growth = 1 + pre_retirement_growth_rate
+        for i in range(0, years_to_live):
+            value = current_retirement_savings if i == 0 else self.base_net_worth[i - 1] * growth + self.contributions[0, i - 1]
+            value += self.net_worth_changes[i]
+            clipped[i] = value < 0
+            self.base_net_worth[i] = max(0, value)
+        # A payout landing in year y stays linear unless clipping happens in y or later
+        self.clipped_from = np.logical_or.accumulate(clipped[::-1])[::-1]
+        self.payout_growth = growth ** np.arange(years_to_live)
+
+    def payout_years(self, leave_dates):
+        """
+        Year (from start_date) each leave date's payout lands in: the start of the first plan year after leaving
+        """
+        from equity.grant_book import to_month_indexes
+
+        months_out = to_month_indexes(leave_dates) - self.start_month
+        if np.any(months_out < 0):
+            raise ValueError("Leave dates can't be before the plan start date")
+        payout_years = -(-months_out // MONTHS_PER_YEAR)
+        if np.any(payout_years >= self.years_to_live):
+            raise ValueError("Leave dates must pay out within years to live (%s)" % self.years_to_live)
+        return payout_years
+
+    def run(self, leave_dates, share_prices):
+        """
+        Earliest retirement and waste for every (leave date, share price) pair, as an EquityPlanResult with
+         (dates, prices) grids
+        """
+        leave_dates = list(leave_dates)
+        share_prices = list(share_prices)
+        if len(leave_dates) == 0 or len(share_prices) == 0:
+            raise ValueError("At least one leave date and one share price are required")
+        payout_years = self.payout_years(leave_dates)
+        payouts = np.maximum(0, self.book.total_value(
+            leave_dates,
+            share_prices,
+            self.capital_gains,
+            pay_execution_fee=self.pay_execution_fee,
+            pay_capital_gains=self.pay_capital_gains))
+
+        # Net worth for every cell: the base plus the payout compounding from its year on
+        years = np.arange(self.years_to_live)
+        years_since_payout = years - payout_years[:, None]
+        payout_factor = np.where(years_since_payout >= 0, self.payout_growth[np.maximum(years_since_payout, 0)], 0.0)
+        net_worth = self.base_net_worth + payouts[:, :, None] * payout_factor[:, None, :]
+
+        # Where the base net worth gets clipped at or after the payout, the payout can absorb that, so redo those cells
+        #  properly (zero payouts are exactly the base, clipping and all)
+        nonlinear = self.clipped_from[payout_years][:, None] & (payouts > 0)
+        if np.any(nonlinear):
+            date_rows, price_rows = np.nonzero(nonlinear)
+            net_worth_changes = np.tile(self.net_worth_changes, (len(date_rows), 1))
+            net_worth_changes[np.arange(len(date_rows)), payout_years[date_rows]] += payouts[date_rows, price_rows]
+            net_worth[date_rows, price_rows] = no_retirement_matrix(
+                net_worth_changes,
+                np.full(len(date_rows), float(self.current_retirement_savings)),
+                np.full(len(date_rows), float(self.pre_retirement_growth_rate)),
+                self.contributions)
+
+        shape = payouts.shape
+        flat_net_worth = net_worth.reshape(-1, self.years_to_live)
+        years_to_retirement = earliest_retirement(flat_net_worth, self.min_worth[None, :])
+        # Once retired with at least the min worth, the surplus just compounds until death, when the min worth is
+        #  exactly the last withdrawal
+        retired = years_to_retirement != NEVER_RETIRE
+        retirement_year = np.where(retired, years_to_retirement, 0)
+        surplus = flat_net_worth[np.arange(len(flat_net_worth)), retirement_year] - self.min_worth[retirement_year]
+        waste = np.where(retired, surplus * (1 + self.post_retirement_growth_rate) ** (self.years_to_live - 1 - retirement_year), np.nan)
+
+        axes = [(LEAVE_DATE_AXIS, leave_dates), (SHARE_PRICE_AXIS, share_prices)]
+        return EquityPlanResult(axes, years_to_retirement.reshape(shape), waste.reshape(shape), payouts, payout_years)
@@ -0,0 +1,348 @@
+from retirement_age_calculator import Series, AccountValueFunction, ActualWithdrawalsFunction
+
+class _ListFunction:
+    """
+    Read-only function over a series owned by IncrementalRetirementCalculator, so the regular *Function classes
+     can be built on top of it
+    """
+    def __init__(self, values):
+        self.values = values
+
+    def apply(self, years_in_future):
+        return self.values[years_in_future]
+
+    def data(self):
+        return self.values.copy()
+
+class IncrementalRetirementCalculator:
+    """
+    Mutable RetirementAgeCalculator for what-if editing: after the initial build, each edit to a manual change or a
+     scalar input only recomputes the part of the series it can affect.
+
+    Contributions, withdrawals and net worth run forward in time, so an edit at year X only touches them from X on;
+     min worth runs backwards, so it's only touched up to X. The retirement search is then re-run over just the years
+     whose outcome can have changed. Every value is computed with the same arithmetic, in the same order, as
+     RetirementAgeCalculator, so results are identical to a full rebuild.
+    """
+    def __init__(self,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None):
+        self.current_retirement_savings = current_retirement_savings
+        self.annual_contribution = annual_contribution
+        self.annual_contribution_increase_rate = annual_contribution_increase_rate
+        self.pre_retirement_growth_rate = pre_retirement_growth_rate
+        self.post_retirement_growth_rate = post_retirement_growth_rate
+        self.inflation_rate = inflation_rate
+        self.years_to_live = years_to_live
+        self.desired_net_retirement_income_todays_dollars = desired_net_retirement_income_todays_dollars
+        self.retirement_tax_rate = retirement_tax_rate
+        self.manual_contrib_changes = dict(manual_contrib_changes) if manual_contrib_changes is not None else {}
+        self.manual_net_worth_changes = dict(manual_net_worth_changes) if manual_net_worth_changes is not None else {}
+        self.manual_retirement_income_changes = dict(manual_retirement_income_changes) if manual_retirement_income_changes is not None else {}
+        self._rebuild()
+
+    # ========================== Full computation ==========================
+
+    def _validate(self):
+        if self.years_to_live < 1:
+            raise ValueError("Years to live must be >= 1")
+        for changes, name in (
+                (self.manual_contrib_changes, 'contrib'),
+                (self.manual_net_worth_changes, 'net worth'),
+                (self.manual_retirement_income_changes, 'retirement income')):
+            for years_out in changes.keys():
+                self._validate_year(years_out, name)
+
+    def _validate_year(self, years_out, name):
+        if years_out < 0 or years_out >= self.years_to_live:
+            raise ValueError("Invalid %s change year '%s'; must be in range [0,%s)" % (name, years_out, self.years_to_live))
+
+    def _rebuild(self):
+        self._validate()
+        self.contribs = [0] * self.years_to_live
+        self.net_worth = [0] * self.years_to_live
+        self.withdrawals = [0] * self.years_to_live
+        self.min_worth = [0] * self.years_to_live
+        self._update_contribs(0, self.years_to_live)
+        self._update_net_worth(0)
+        self._update_withdrawals(0, self.years_to_live)
+        self._update_min_worth(self.years_to_live)
+        self.years_to_retirement = None
+        self._update_retirement(0, self.years_to_live)
+
+    # ========================== Partial recomputation ==========================
+
+    @staticmethod
+    def _next_change(changes, years_out):
+        """
+        First change year after years_out, i.e. the end of the stretch an edit at years_out can affect
+        """
+        later_years = [year for year in changes.keys() if year > years_out]
+        return min(later_years) if later_years else None
+
+    def _update_contribs(self, start, end):
+        """
+        Recompute contributions for years [start, end), same as ContributionFunction
+        """
+        current_base_contrib = self.annual_contribution
+        current_contrib_rate = self.annual_contribution_increase_rate
+        last_change = 0
+        earlier_years = [year for year in self.manual_contrib_changes.keys() if year <= start]
+        if earlier_years:
+            last_change = max(earlier_years)
+            current_base_contrib, current_contrib_rate = self.manual_contrib_changes[last_change]
+        years_since_last_change = start - last_change
+        for i in range(start, end):
+            if i in self.manual_contrib_changes:
+                current_base_contrib, current_contrib_rate = self.manual_contrib_changes[i]
+                years_since_last_change = 0
+            self.contribs[i] = current_base_contrib * (1 + current_contrib_rate) ** years_since_last_change
+            years_since_last_change = years_since_last_change + 1
+
+    def _update_net_worth(self, start):
+        """
+        Recompute net worth for years [start, years_to_live), same as NoRetirementNetWorthFunction
+        """
+        # Locals rather than attribute lookups, as this runs on every drag
+        net_worth = self.net_worth
+        contribs = self.contribs
+        changes = self.manual_net_worth_changes
+        growth = 1 + self.pre_retirement_growth_rate
+        for i in range(start, self.years_to_live):
+            if i == 0:
+                value_to_append = self.current_retirement_savings
+            else:
+                value_to_append = net_worth[i - 1] * growth + contribs[i - 1]
+            net_worth[i] = max(0, value_to_append + changes.get(i, 0))
+
+    def _update_withdrawals(self, start, end):
+        """
+        Recompute withdrawals for years [start, end), same as RetirementWithdrawalsFunction
+        """
+        net_income = self.desired_net_retirement_income_todays_dollars
+        earlier_years = [year for year in self.manual_retirement_income_changes.keys() if year <= start]
+        if earlier_years:
+            net_income = self.manual_retirement_income_changes[max(earlier_years)]
+        for i in range(start, end):
+            if i in self.manual_retirement_income_changes:
+                net_income = self.manual_retirement_income_changes[i]
+            gross_income = net_income / (1.0 - self.retirement_tax_rate)
+            self.withdrawals[i] = gross_income * (1.0 + self.inflation_rate) ** i
+
+    def _update_min_worth(self, end):
+        """
+        Recompute min worth for years [0, end), same as RetirementMinWorthFunction
+        """
+        min_worth = self.min_worth
+        withdrawals = self.withdrawals
+        growth = 1 + self.post_retirement_growth_rate
+        last_year = self.years_to_live - 1
+        for i in range(end - 1, -1, -1):
+            if i == last_year:
+                min_worth[i] = withdrawals[i]
+            else:
+                # Our bank account can be a little lower because we'll get in-year growth
+                min_worth[i] = withdrawals[i] + min_worth[i + 1] / growth
+
+    def _first_retirement(self, start, end):
+        net_worth = self.net_worth
+        min_worth = self.min_worth
+        for i in range(start, end):
+            if net_worth[i] >= min_worth[i]:
+                return i
+        return None
+
+    def _update_retirement(self, start, end):
+        """
+        Re-run the retirement search given that only years [start, end) can have changed whether you can retire
+        """
+        previous = self.years_to_retirement
+        if previous is None or previous >= start:
+            self.years_to_retirement = self._first_retirement(start, end)
+            if self.years_to_retirement is None and previous is not None:
+                if previous >= end:
+                    # Years in [end, previous) couldn't retire before and haven't changed
+                    self.years_to_retirement = previous
+                else:
+                    self.years_to_retirement = self._first_retirement(end, self.years_to_live)
+        self._update_waste()
+
+    def _update_waste(self):
+        """
+        Same as reading the last year of AccountValueFunction and ActualWithdrawalsFunction, without building them
+        """
+        self.waste = None
+        if self.years_to_retirement is not None:
+            withdrawals = self.withdrawals
+            growth = 1 + self.post_retirement_growth_rate
+            account_value = self.net_worth[self.years_to_retirement]
+            for i in range(self.years_to_retirement + 1, self.years_to_live):
+                account_value = max(0, (account_value - withdrawals[i - 1]) * growth)
+            self.waste = account_value - withdrawals[self.years_to_live - 1]
+
+    def _contribs_edited(self, *edited_years):
+        for years_out in edited_years:
+            end = self._next_change(self.manual_contrib_changes, years_out)
+            self._update_contribs(years_out, end if end is not None else self.years_to_live)
+        # Net worth in year i uses the contribution from year i-1, and one forward pass covers every edit
+        start = min(edited_years) + 1
+        if start < self.years_to_live:
+            self._update_net_worth(start)
+            self._update_retirement(start, self.years_to_live)
+
+    def _net_worth_edited(self, *edited_years):
+        start = min(edited_years)
+        self._update_net_worth(start)
+        self._update_retirement(start, self.years_to_live)
+
+    def _withdrawals_edited(self, *edited_years):
+        min_worth_end = 0
+        for years_out in edited_years:
+            end = self._next_change(self.manual_retirement_income_changes, years_out)
+            end = end if end is not None else self.years_to_live
+            self._update_withdrawals(years_out, end)
+            min_worth_end = max(min_worth_end, end)
+        # Min worth runs backwards, so one pass from the latest affected year covers every edit
+        self._update_min_worth(min_worth_end)
+        self._update_retirement(0, min_worth_end)
+
+    # ========================== Edits ==========================
+
+    def set_contrib_change(self, years_out, contrib, contrib_rate):
+        """
+        Add or replace the contribution change at the start of year years_out
+        """
+        self._validate_year(years_out, 'contrib')
+        self.manual_contrib_changes[years_out] = (contrib, contrib_rate)
+        self._contribs_edited(years_out)
+
+    def remove_contrib_change(self, years_out):
+        del self.manual_contrib_changes[years_out]
+        self._contribs_edited(years_out)
+
+    def move_contrib_change(self, from_years_out, to_years_out):
+        self._validate_year(to_years_out, 'contrib')
+        if to_years_out in self.manual_contrib_changes and to_years_out != from_years_out:
+            raise ValueError("There's already a contrib change in year '%s'" % to_years_out)
+        self.manual_contrib_changes[to_years_out] = self.manual_contrib_changes.pop(from_years_out)
+        self._contribs_edited(from_years_out, to_years_out)
+
+    def set_net_worth_change(self, years_out, change):
+        """
+        Add or replace the one-off net worth change at the start of year years_out
+        """
+        self._validate_year(years_out, 'net worth')
+        self.manual_net_worth_changes[years_out] = change
+        self._net_worth_edited(years_out)
+
+    def remove_net_worth_change(self, years_out):
+        del self.manual_net_worth_changes[years_out]
+        self._net_worth_edited(years_out)
+
+    def move_net_worth_change(self, from_years_out, to_years_out):
+        self._validate_year(to_years_out, 'net worth')
+        if to_years_out in self.manual_net_worth_changes and to_years_out != from_years_out:
+            raise ValueError("There's already a net worth change in year '%s'" % to_years_out)
+        self.manual_net_worth_changes[to_years_out] = self.manual_net_worth_changes.pop(from_years_out)
+        self._net_worth_edited(from_years_out, to_years_out)
+
+    def set_retirement_income_change(self, years_out, net_income):
+        """
+        Add or replace the retirement income change (in today's dollars) at the start of year years_out
+        """
+        self._validate_year(years_out, 'retirement income')
+        self.manual_retirement_income_changes[years_out] = net_income
+        self._withdrawals_edited(years_out)
+
+    def remove_retirement_income_change(self, years_out):
+        del self.manual_retirement_income_changes[years_out]
+        self._withdrawals_edited(years_out)
+
+    def move_retirement_income_change(self, from_years_out, to_years_out):
+        self._validate_year(to_years_out, 'retirement income')
+        if to_years_out in self.manual_retirement_income_changes and to_years_out != from_years_out:
+            raise ValueError("There's already a retirement income change in year '%s'" % to_years_out)
+        self.manual_retirement_income_changes[to_years_out] = self.manual_retirement_income_changes.pop(from_years_out)
+        self._withdrawals_edited(from_years_out, to_years_out)
+
+    def set_input(self, name, value):
+        """
+        Change one of the scalar RetirementAgeCalculator inputs, e.g. set_input('inflation_rate', 0.03)
+        """
+        if name == 'years_to_live':
+            previous = self.years_to_live
+            self.years_to_live = value
+            try:
+                self._rebuild()
+            except ValueError:
+                self.years_to_live = previous
+                self._rebuild()
+                raise
+            return
+        if name not in (
+                'current_retirement_savings',
+                'annual_contribution',
+                'annual_contribution_increase_rate',
+                'pre_retirement_growth_rate',
+                'post_retirement_growth_rate',
+                'inflation_rate',
+                'desired_net_retirement_income_todays_dollars',
+                'retirement_tax_rate'):
+            raise ValueError("Unknown input '%s'" % name)
+        setattr(self, name, value)
+
+        if name == 'current_retirement_savings':
+            self._net_worth_edited(0)
+        elif name == 'pre_retirement_growth_rate':
+            if self.years_to_live > 1:
+                self._net_worth_edited(1)
+        elif name in ('annual_contribution', 'annual_contribution_increase_rate'):
+            # Only matters until the first manual contrib change, if there's one in year 0 it doesn't matter at all
+            if 0 not in self.manual_contrib_changes:
+                self._contribs_edited(0)
+        elif name == 'desired_net_retirement_income_todays_dollars':
+            if 0 not in self.manual_retirement_income_changes:
+                self._withdrawals_edited(0)
+        elif name in ('retirement_tax_rate', 'inflation_rate'):
+            self._update_withdrawals(0, self.years_to_live)
+            self._update_min_worth(self.years_to_live)
+            self._update_retirement(0, self.years_to_live)
+        else:
+            self._update_min_worth(self.years_to_live)
+            self._update_retirement(0, self.years_to_live)
+
+    # ========================== Results ==========================
+
+    def get_earliest_retirement(self):
+        """
+        Get the smallest number of years after which you'll be able to retire, or None if not possible
+        """
+        return self.years_to_retirement
+
+    def get_waste(self):
+        """
+        Dollars you'd die with (or None if you never get to retire), see RetirementAgeCalculator.get_waste
+        """
+        return self.waste
+
+    def get_series_data(self, series):
+        if series == Series.ACCOUNT_VALUE:
+            return AccountValueFunction(self.years_to_live, self.years_to_retirement, _ListFunction(self.net_worth), self.post_retirement_growth_rate, _ListFunction(self.withdrawals)).data()
+        if series == Series.ACTUAL_WITHDRAWALS:
+            return ActualWithdrawalsFunction(self.years_to_live, self.years_to_retirement, _ListFunction(self.withdrawals)).data()
+        return {
+            Series.ALL_WITHDRAWALS: self.withdrawals,
+            Series.MIN_RETIREMENT_WORTH: self.min_worth,
+            Series.CONTRIBUTIONS: self.contribs,
+            Series.NO_RETIREMENT: self.net_worth,
+        }[series].copy()
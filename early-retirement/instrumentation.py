@@ -0,0 +1,193 @@
+"""
+Opt-in per-stage instrumentation for RetirementAgeCalculator (and anything else that wants it).
+
+Pass an Instrumentation to the calculator and it records, for every stage it goes through (validation, each series,
+ the retirement scan, ...), the wall time and the net number of memory blocks allocated (sys.getallocatedblocks), and
+ aggregates them across every calculation it's passed to. Without one, calculators use NULL_INSTRUMENTATION, whose
+ stages are a shared do-nothing context manager, so the disabled cost is one no-op `with` per stage.
+
+The CLI exposes this with --stats, plus --profile (cProfile) and --trace-malloc (tracemalloc) captures of the whole
+ run; see add_cli_arguments.
+"""
+
+from contextlib import nullcontext
+import atexit
+import json
+import sys
+import time
+
+CALCULATION_STAGE = 'calculation'
+
+PROFILE_KEY = 'profile'
+TRACE_MALLOC_KEY = 'trace_malloc'
+STATS_KEY = 'stats'
+# Number of entries shown for --profile and --trace-malloc
+REPORT_LIMIT = 20
+
+class _StageTimer:
+    __slots__ = ('instrumentation', 'name', 'start', 'start_blocks')
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        self.start_blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.perf_counter() - self.start
+        self.instrumentation.record(self.name, seconds, sys.getallocatedblocks() - self.start_blocks)
+        return False
+
+class Instrumentation:
+    """
+    Aggregated per-stage wall time and allocated blocks over every calculation it's been passed to
+    """
+    enabled = True
+
+    def __init__(self):
+        # Stage name -> [count, total seconds, min seconds, max seconds, total allocated blocks], in first-seen order
+        self._stages = {}
+
+    def stage(self, name):
+        """
+        Context manager timing one run of the named stage
+        """
+        return _StageTimer(self, name)
+
+    def calculation(self):
+        """
+        Context manager around a whole calculation, whose count is the number of calculations
+        """
+        return _StageTimer(self, CALCULATION_STAGE)
+
+    def record(self, name, seconds, allocated_blocks, count=1, min_seconds=None, max_seconds=None):
+        stage = self._stages.get(name)
+        min_seconds = seconds if min_seconds is None else min_seconds
+        max_seconds = seconds if max_seconds is None else max_seconds
+        if stage is None:
+            self._stages[name] = [count, seconds, min_seconds, max_seconds, allocated_blocks]
+        else:
+            stage[0] += count
+            stage[1] += seconds
+            stage[2] = min(stage[2], min_seconds)
+            stage[3] = max(stage[3], max_seconds)
+            stage[4] += allocated_blocks
+
+    def merge(self, stats):
+        """
+        Add in the stats() of another Instrumentation, e.g. one from a worker process
+        """
+        for name, stage in stats['stages'].items():
+            self.record(name, stage['total_seconds'], stage['allocated_blocks'], stage['count'], stage['min_seconds'], stage['max_seconds'])
+
+    def reset(self):
+        self._stages = {}
+
+    def stats(self):
+        """
+        Dict with the number of calculations and, per stage, its count, total/mean/min/max seconds and total/mean net
+         allocated blocks
+        """
+        stages = {}
+        for name, (count, seconds, min_seconds, max_seconds, allocated_blocks) in self._stages.items():
+            stages[name] = {
+                'count': count,
+                'total_seconds': seconds,
+                'mean_seconds': seconds / count,
+                'min_seconds': min_seconds,
+                'max_seconds': max_seconds,
+                'allocated_blocks': allocated_blocks,
+                'mean_allocated_blocks': allocated_blocks / count,
+            }
+        calculations = stages[CALCULATION_STAGE]['count'] if CALCULATION_STAGE in stages else 0
+        return {'calculations': calculations, 'stages': stages}
+
+    def to_json(self, indent=2):
+        return json.dumps(self.stats(), indent=indent)
+
+class NullInstrumentation:
+    """
+    Instrumentation that records nothing, used when instrumentation is off
+    """
+    enabled = False
+    _stage = nullcontext()
+
+    def stage(self, name):
+        return self._stage
+
+    def calculation(self):
+        return self._stage
+
+    def merge(self, stats):
+        pass
+
+    def stats(self):
+        return {'calculations': 0, 'stages': {}}
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+def nearest_rank_percentile(sorted_values, percentile):
+    """
+    Nearest-rank percentile (0-100) of a non-empty sorted list, so it's always one of the measured values
+    """
+    index = max(0, -(-len(sorted_values) * percentile // 100) - 1)
+    return sorted_values[index]
+
+# ========================== CLI ===========================================================
+
+def add_cli_arguments(parser):
+    parser.add_argument('--stats', dest=STATS_KEY, nargs='?', const='-', default=None, metavar='path', help='Record per-stage timings and allocations for every calculation, and write them as JSON to this file at exit (stderr if no file is given)')
+    parser.add_argument('--profile', dest=PROFILE_KEY, nargs='?', const='-', default=None, metavar='path', help='Run under cProfile and print the top functions by cumulative time to stderr at exit, or dump the raw profile to this file')
+    parser.add_argument('--trace-malloc', dest=TRACE_MALLOC_KEY, default=False, action='store_true', help='Trace allocations with tracemalloc and print the top allocation sites and peak memory to stderr at exit')
+
+def start_from_cli(parsed_args):
+    """
+    Start whatever add_cli_arguments' flags asked for, reporting at exit (so the CLI can still sys.exit anywhere), and
+     return the Instrumentation to pass to calculators, or NULL_INSTRUMENTATION without --stats
+    """
+    instrumentation = NULL_INSTRUMENTATION
+    stats_path = parsed_args.get(STATS_KEY)
+    if stats_path is not None:
+        instrumentation = Instrumentation()
+        atexit.register(_write_stats, instrumentation, stats_path)
+
+    if parsed_args.get(TRACE_MALLOC_KEY):
+        import tracemalloc
+        tracemalloc.start()
+        atexit.register(_report_trace_malloc)
+
+    profile_path = parsed_args.get(PROFILE_KEY)
+    if profile_path is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        # Registered last so it runs first, before the other reports add their own noise
+        atexit.register(_report_profile, profiler, profile_path)
+    return instrumentation
+
+def _write_stats(instrumentation, path):
+    if path == '-':
+        print(instrumentation.to_json(), file=sys.stderr)
+    else:
+        with open(path, 'w') as stats_file:
+            stats_file.write(instrumentation.to_json() + '\n')
+
+def _report_trace_malloc():
+    import tracemalloc
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("TRACEMALLOC: current %s KB, peak %s KB; top allocation sites:" % ('{:,.0f}'.format(current / 1024), '{:,.0f}'.format(peak / 1024)), file=sys.stderr)
+    for statistic in snapshot.statistics('lineno')[:REPORT_LIMIT]:
+        print("  %s" % statistic, file=sys.stderr)
+
+def _report_profile(profiler, path):
+    import pstats
+    profiler.disable()
+    if path == '-':
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(REPORT_LIMIT)
+    else:
+        profiler.dump_stats(path)
@@ -0,0 +1,224 @@
+"""
+Monte Carlo retirement engine: instead of one fixed growth/inflation rate for every year, each simulated path draws
+ its own per-year pre-retirement growth, post-retirement growth and inflation, and is then evaluated the same way
+ RetirementAgeCalculator evaluates a single scenario.
+
+Paths are simulated in fixed-size blocks, each a single vectorized batch with its own child seed, and blocks can be
+ spread across a process pool. Because the block layout only depends on the number of paths and the block size,
+ a given seed produces the same results no matter how many workers are used.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from retirement_age_calculator import RetirementAgeCalculator
+from batch_retirement_calculator import (
+    NEVER_RETIRE,
+    contribution_matrix,
+    cumulative_growth,
+    net_worth_change_matrix,
+    no_retirement_matrix,
+    withdrawals_matrix,
+    min_worth_matrix,
+    earliest_retirement,
+    account_value_matrix,
+    actual_withdrawals_matrix,
+    waste_vector,
+)
+
+DEFAULT_BLOCK_SIZE = 10000
+
+class FixedRate:
+    """
+    The same rate every year, on every path
+    """
+    def __init__(self, rate):
+        self.mean = rate
+
+    def sample(self, rng, shape):
+        return np.full(shape, float(self.mean))
+
+class NormalRate:
+    """
+    Yearly rates drawn independently from a normal distribution
+    """
+    def __init__(self, mean, stdev):
+        self.mean = mean
+        self.stdev = stdev
+
+    def sample(self, rng, shape):
+        return rng.normal(self.mean, self.stdev, shape)
+
+class LogNormalRate:
+    """
+    Yearly rates such that (1 + rate) is lognormal with the given arithmetic mean and standard deviation of the rate;
+     unlike NormalRate this can never lose more than 100% in a year
+    """
+    def __init__(self, mean, stdev):
+        self.mean = mean
+        self.stdev = stdev
+        variance = np.log(1 + (stdev / (1 + mean)) ** 2)
+        self.log_mean = np.log(1 + mean) - variance / 2
+        self.log_stdev = np.sqrt(variance)
+
+    def sample(self, rng, shape):
+        return np.exp(rng.normal(self.log_mean, self.log_stdev, shape)) - 1
+
+def _as_distribution(rate):
+    return rate if hasattr(rate, 'sample') else FixedRate(rate)
+
+class MonteCarloResult:
+    """
+    Per-path outcomes of a Monte Carlo run
+    """
+    def __init__(self, planned_retirement, years_to_retirement, waste, plan_succeeded):
+        self.planned_retirement = planned_retirement
+        self.years_to_retirement = years_to_retirement
+        self.waste = waste
+        self.plan_succeeded = plan_succeeded
+
+    def __len__(self):
+        return len(self.years_to_retirement)
+
+    def success_probability(self):
+        """
+        Fraction of paths on which retiring at the planned year never runs out of money
+        """
+        return float(self.plan_succeeded.mean())
+
+    def retirement_probability(self):
+        """
+        Fraction of paths on which retirement is possible at all before death
+        """
+        return float((self.years_to_retirement != NEVER_RETIRE).mean())
+
+    def retirement_year_distribution(self):
+        """
+        Dict of earliest retirement year -> fraction of paths, with None for paths that never get to retire
+        """
+        years, counts = np.unique(self.years_to_retirement, return_counts=True)
+        return {
+            (None if year == NEVER_RETIRE else int(year)): float(count / len(self))
+            for year, count in zip(years, counts)
+        }
+
+    def waste_percentiles(self, percentiles=(5, 25, 50, 75, 95)):
+        """
+        Dict of percentile -> dollars at death, over the paths that get to retire
+        """
+        waste = self.waste[~np.isnan(self.waste)]
+        if len(waste) == 0:
+            return {percentile: None for percentile in percentiles}
+        return dict(zip(percentiles, np.percentile(waste, percentiles).tolist()))
+
+class MonteCarloRetirementSimulator:
+    """
+    Takes the same inputs as RetirementAgeCalculator, except that the growth and inflation rates may be distributions
+     (FixedRate, NormalRate, LogNormalRate or anything with mean and sample(rng, shape)) instead of plain numbers
+    """
+    def __init__(self,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None):
+        self.pre_retirement_growth_rate = _as_distribution(pre_retirement_growth_rate)
+        self.post_retirement_growth_rate = _as_distribution(post_retirement_growth_rate)
+        self.inflation_rate = _as_distribution(inflation_rate)
+        self.years_to_live = years_to_live
+        self.current_retirement_savings = current_retirement_savings
+
+        # The plan you'd make with the expected rates; this also validates the inputs
+        self.expected_calculator = RetirementAgeCalculator(
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            self.pre_retirement_growth_rate.mean,
+            self.post_retirement_growth_rate.mean,
+            self.inflation_rate.mean,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=manual_contrib_changes,
+            manual_net_worth_changes=manual_net_worth_changes,
+            manual_retirement_income_changes=manual_retirement_income_changes)
+
+        # Everything that doesn't depend on the sampled rates is computed once, as a single row shared by all paths
+        self.contributions = contribution_matrix(
+            years_to_live,
+            [manual_contrib_changes or {}],
+            np.array([annual_contribution], dtype=float),
+            np.array([annual_contribution_increase_rate], dtype=float))
+        self.net_worth_changes = net_worth_change_matrix(years_to_live, [manual_net_worth_changes or {}])
+        # Withdrawals with zero inflation are just the gross income; each path applies its own inflation on top
+        self.gross_income = withdrawals_matrix(
+            years_to_live,
+            np.array([desired_net_retirement_income_todays_dollars], dtype=float),
+            np.array([retirement_tax_rate], dtype=float),
+            np.zeros(1),
+            [manual_retirement_income_changes or {}])
+
+    def run(self, num_paths, seed=None, planned_retirement=None, block_size=DEFAULT_BLOCK_SIZE, workers=None):
+        """
+        Simulate num_paths paths and return a MonteCarloResult.
+
+        planned_retirement is the retirement year whose success probability is reported, defaulting to the earliest
+         retirement with the expected rates. workers > 1 shards the blocks across that many processes.
+        """
+        if num_paths < 1:
+            raise ValueError("Number of paths must be >= 1")
+        if planned_retirement is None:
+            planned_retirement = self.expected_calculator.get_earliest_retirement()
+        if planned_retirement is not None and (planned_retirement < 0 or planned_retirement >= self.years_to_live):
+            raise ValueError("Invalid planned retirement year '%s'; must be in range [0,%s)" % (planned_retirement, self.years_to_live))
+
+        block_sizes = [block_size] * (num_paths // block_size)
+        if num_paths % block_size:
+            block_sizes.append(num_paths % block_size)
+        block_seeds = np.random.SeedSequence(seed).spawn(len(block_sizes))
+        block_args = [(size, block_seed, planned_retirement) for size, block_seed in zip(block_sizes, block_seeds)]
+
+        if workers is not None and workers > 1 and len(block_args) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                blocks = list(executor.map(self._simulate_block, *zip(*block_args)))
+        else:
+            blocks = [self._simulate_block(*args) for args in block_args]
+
+        years_to_retirement, waste, plan_succeeded = (np.concatenate(parts) for parts in zip(*blocks))
+        return MonteCarloResult(planned_retirement, years_to_retirement, waste, plan_succeeded)
+
+    def _simulate_block(self, num_paths, block_seed, planned_retirement):
+        rng = np.random.default_rng(block_seed)
+        shape = (num_paths, self.years_to_live)
+        pre_retirement_growth_rates = self.pre_retirement_growth_rate.sample(rng, shape)
+        post_retirement_growth_rates = self.post_retirement_growth_rate.sample(rng, shape)
+        inflation_rates = self.inflation_rate.sample(rng, shape)
+
+        years_to_live = np.full(num_paths, self.years_to_live)
+        all_withdrawals = self.gross_income * cumulative_growth(inflation_rates)
+        min_worth = min_worth_matrix(years_to_live, all_withdrawals, post_retirement_growth_rates)
+        no_retirement = no_retirement_matrix(
+            self.net_worth_changes,
+            np.full(num_paths, float(self.current_retirement_savings)),
+            pre_retirement_growth_rates,
+            self.contributions)
+
+        years_to_retirement = earliest_retirement(no_retirement, min_worth)
+        account_value = account_value_matrix(years_to_retirement, no_retirement, all_withdrawals, post_retirement_growth_rates)
+        actual_withdrawals = actual_withdrawals_matrix(years_to_retirement, all_withdrawals)
+        waste = waste_vector(years_to_live, account_value, actual_withdrawals)
+
+        if planned_retirement is None:
+            plan_succeeded = np.zeros(num_paths, dtype=bool)
+        else:
+            # Having at least the minimum worth at retirement is exactly what keeps the account from running dry
+            plan_succeeded = no_retirement[:, planned_retirement] >= min_worth[:, planned_retirement]
+        return years_to_retirement, waste, plan_succeeded
@@ -0,0 +1,172 @@
+"""
+Monthly-resolution counterpart to RetirementAgeCalculator, for paychecks, withdrawals and equity vesting that happen
+ every month rather than once a year.
+
+Inputs are the same as RetirementAgeCalculator's, still given as annual amounts and annual rates, but the series step
+ in months: rates are compounded monthly ((1 + annual rate) ** (1/12) per month), contributions and withdrawals are
+ paid a twelfth of the annual amount each month, and manual changes are keyed by months out instead of years out.
+ Within a month everything is timed like a year in RetirementAgeCalculator: withdrawals come out at the start of the
+ month, and contributions go in after that month's growth.
+
+Rather than stepping month by month, each series is a piecewise closed form over NumPy arrays (e.g. compounded
+ balances as a discounted cumulative sum), so 12x the steps cost roughly the same as the annual engine.
+"""
+
+import numpy as np
+
+from retirement_age_calculator import Series
+
+MONTHS_PER_YEAR = 12
+# Balances, where the annual view takes the value at the start of each year; the others are flows, summed over a year
+STOCK_SERIES = (Series.NO_RETIREMENT, Series.ACCOUNT_VALUE, Series.MIN_RETIREMENT_WORTH)
+
+def monthly_rate(annual_rate):
+    """
+    Monthly rate that compounds to the given annual rate over 12 months
+    """
+    return (1 + annual_rate) ** (1 / MONTHS_PER_YEAR) - 1
+
+def _segments(num_months, changes, initial_value):
+    """
+    For every month, the index of the segment (between manual changes) it falls in, plus the month each segment starts
+     in and the value it starts with
+    """
+    change_months = sorted(changes.keys())
+    starts = np.array([0] + [month for month in change_months if month != 0])
+    values = [changes[0] if 0 in changes else initial_value] + [changes[month] for month in change_months if month != 0]
+    segment = np.searchsorted(starts, np.arange(num_months), side='right') - 1
+    return segment, starts, values
+
+def _compounded(first_value, growth, additions, clip=True):
+    """
+    x[0] = first_value, x[m] = x[m-1] * growth + additions[m], floored at 0 with clip. Written out, x[m] is
+     growth^m * (x[0] + the sum of additions[k] / growth^k up to m), a cumulative sum; whenever the floor kicks in, the
+     sum restarts from 0 at that month.
+    """
+    num_months = len(additions)
+    exponents = np.arange(num_months)
+    powers = growth ** exponents
+    discounts = 1 / powers
+    discounted_additions = additions * discounts
+    values = np.empty(num_months)
+    start, start_value = 0, max(0, first_value) if clip else first_value
+    while True:
+        segment = powers[start:] / powers[start] * start_value
+        segment[1:] += powers[start + 1:] * np.cumsum(discounted_additions[start + 1:])
+        below_zero = np.flatnonzero(segment < 0) if clip else []
+        if len(below_zero) == 0:
+            values[start:] = segment
+            return values
+        # Everything before the first month that goes below 0 stands; restart from 0 there
+        end = start + below_zero[0]
+        values[start:end] = segment[:below_zero[0]]
+        start, start_value = end, 0.0
+
+class MonthlyRetirementAgeCalculator:
+    """
+    Same interface as RetirementAgeCalculator, at monthly resolution. Annual amounts and rates are converted to monthly
+     ones; manual changes are {months_out: ...} dicts with the same values as the annual ones (annual amounts), for
+     months_out in [0, years_to_live * 12).
+    """
+    def __init__(self,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None):
+        manual_contrib_changes = manual_contrib_changes if manual_contrib_changes is not None else {}
+        manual_net_worth_changes = manual_net_worth_changes if manual_net_worth_changes is not None else {}
+        manual_retirement_income_changes = manual_retirement_income_changes if manual_retirement_income_changes is not None else {}
+
+        if years_to_live < 1:
+            raise ValueError("Years to live must be >= 1")
+        num_months = years_to_live * MONTHS_PER_YEAR
+        for name, changes in (('contrib', manual_contrib_changes), ('net worth', manual_net_worth_changes), ('retirement income', manual_retirement_income_changes)):
+            for months_out in changes.keys():
+                if months_out < 0 or months_out >= num_months:
+                    raise ValueError("Invalid %s change month '%s'; must be in range [0,%s)" % (name, months_out, num_months))
+
+        self.years_to_live = years_to_live
+        months = np.arange(num_months)
+        pre_retirement_growth = 1 + monthly_rate(pre_retirement_growth_rate)
+        post_retirement_growth = 1 + monthly_rate(post_retirement_growth_rate)
+
+        # Contributions grow continuously at the (annual) increase rate from the last change on
+        segment, starts, values = _segments(num_months, manual_contrib_changes, (annual_contribution, annual_contribution_increase_rate))
+        base_contribs = np.array([contrib for contrib, _ in values], dtype=float)[segment]
+        contrib_rates = np.array([contrib_rate for _, contrib_rate in values], dtype=float)[segment]
+        contributions = base_contribs / MONTHS_PER_YEAR * (1 + contrib_rates) ** ((months - starts[segment]) / MONTHS_PER_YEAR)
+
+        # Inflation always counts from today, as retirement income is given in today's dollars
+        segment, _, values = _segments(num_months, manual_retirement_income_changes, desired_net_retirement_income_todays_dollars)
+        net_income = np.array(values, dtype=float)[segment]
+        all_withdrawals = net_income / MONTHS_PER_YEAR / (1.0 - retirement_tax_rate) * (1 + inflation_rate) ** (months / MONTHS_PER_YEAR)
+
+        # Min worth at m is the withdrawals from m on, each discounted back to m by the post-retirement growth
+        discounts = post_retirement_growth ** -months.astype(float)
+        min_worth = np.cumsum((all_withdrawals * discounts)[::-1])[::-1] / discounts
+
+        net_worth_changes = np.zeros(num_months)
+        for months_out, change in manual_net_worth_changes.items():
+            net_worth_changes[months_out] = change
+        additions = net_worth_changes.copy()
+        additions[1:] += contributions[:-1]
+        no_retirement = _compounded(current_retirement_savings + net_worth_changes[0], pre_retirement_growth, additions)
+
+        can_retire = no_retirement >= min_worth
+        self.months_to_retirement = int(can_retire.argmax()) if can_retire.any() else None
+
+        self.series = {
+            Series.ALL_WITHDRAWALS: all_withdrawals,
+            Series.MIN_RETIREMENT_WORTH: min_worth,
+            Series.CONTRIBUTIONS: contributions,
+            Series.NO_RETIREMENT: no_retirement,
+        }
+        self.waste = None
+        if self.months_to_retirement is not None:
+            retirement = self.months_to_retirement
+            # After retiring, each month's withdrawal comes out before that month's growth
+            retired_additions = np.zeros(num_months - retirement)
+            retired_additions[1:] = -all_withdrawals[retirement:-1] * post_retirement_growth
+            account_value = no_retirement.copy()
+            account_value[retirement:] = _compounded(no_retirement[retirement], post_retirement_growth, retired_additions)
+            actual_withdrawals = np.where(months >= retirement, all_withdrawals, 0.0)
+            self.series[Series.ACCOUNT_VALUE] = account_value
+            self.series[Series.ACTUAL_WITHDRAWALS] = actual_withdrawals
+            self.waste = float(account_value[-1] - actual_withdrawals[-1])
+
+    def get_earliest_retirement(self, annual=False):
+        """
+        Get the smallest number of months after which you'll be able to retire (in years, possibly fractional, with
+         annual=True), or None if not possible
+        """
+        if self.months_to_retirement is None or not annual:
+            return self.months_to_retirement
+        return self.months_to_retirement / MONTHS_PER_YEAR
+
+    def get_waste(self):
+        """
+        Dollars you'd die with (or None if you never get to retire)
+        """
+        return self.waste
+
+    def get_series_data(self, series, annual=False):
+        """
+        One value per month, or with annual=True one per year: the balance at the start of the year for
+         NO_RETIREMENT, ACCOUNT_VALUE and MIN_RETIREMENT_WORTH, and the year's total for the other (flow) series.
+         ACCOUNT_VALUE and ACTUAL_WITHDRAWALS only exist if you can retire.
+        """
+        if series not in self.series:
+            raise ValueError("No %s series, as you can't retire with these parameters" % series.name)
+        data = self.series[series]
+        if annual:
+            by_year = data.reshape(self.years_to_live, MONTHS_PER_YEAR)
+            data = by_year[:, 0] if series in STOCK_SERIES else by_year.sum(axis=1)
+        return data.tolist()
@@ -0,0 +1,228 @@
+"""
+Sensitivity grids over RetirementAgeCalculator inputs (e.g. inflation x growth x income), without rebuilding every
+ series for every cell.
+
+The series only depend on a subset of the inputs each:
+ - withdrawals and min worth on the WITHDRAWAL_INPUTS
+ - contributions on the CONTRIBUTION_INPUTS
+ - net worth if you never retire on the ACCUMULATION_INPUTS (which include the contribution inputs)
+so each distinct sub-series is computed once, for the product of the axes it depends on, and the cells just pick
+ their rows out of those. Only the retirement search and the post-retirement account value run per cell, as one
+ vectorized pass.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+
+import numpy as np
+
+from batch_retirement_calculator import (
+    NEVER_RETIRE,
+    validate_change_years,
+    contribution_matrix,
+    net_worth_change_matrix,
+    no_retirement_matrix,
+    withdrawals_matrix,
+    min_worth_matrix,
+    earliest_retirement,
+    account_value_matrix,
+    actual_withdrawals_matrix,
+    waste_vector,
+)
+
+WITHDRAWAL_INPUTS = (
+    'desired_net_retirement_income_todays_dollars',
+    'retirement_tax_rate',
+    'inflation_rate',
+    'post_retirement_growth_rate',
+    'years_to_live',
+    'manual_retirement_income_changes',
+)
+CONTRIBUTION_INPUTS = (
+    'annual_contribution',
+    'annual_contribution_increase_rate',
+    'years_to_live',
+    'manual_contrib_changes',
+)
+ACCUMULATION_INPUTS = CONTRIBUTION_INPUTS + (
+    'current_retirement_savings',
+    'pre_retirement_growth_rate',
+    'manual_net_worth_changes',
+)
+CHANGE_INPUTS = ('manual_contrib_changes', 'manual_net_worth_changes', 'manual_retirement_income_changes')
+
+DEFAULT_CHUNK_SIZE = 20000
+
+class SweepResult:
+    """
+    Earliest retirement year and waste for every cell of a sweep, as arrays with one dimension per axis (in the order
+     the axes were given)
+    """
+    def __init__(self, axes, years_to_retirement, waste):
+        self.axes = axes
+        self.years_to_retirement = years_to_retirement
+        self.waste = waste
+
+    def get_earliest_retirement(self):
+        """
+        Grid of earliest retirement years, NEVER_RETIRE where retiring isn't possible
+        """
+        return self.years_to_retirement
+
+    def get_waste(self):
+        """
+        Grid of dollars at death, NaN where retiring isn't possible
+        """
+        return self.waste
+
+    def _cell_index(self, labels):
+        if set(labels.keys()) != set(name for name, _ in self.axes):
+            raise ValueError("Expected a value for each of the axes %s" % [name for name, _ in self.axes])
+        return tuple(values.index(labels[name]) for name, values in self.axes)
+
+    def cell(self, **labels):
+        """
+        (earliest retirement, waste) for the cell with the given axis values, with None for both if retiring isn't
+         possible, like RetirementAgeCalculator
+        """
+        index = self._cell_index(labels)
+        years_to_retirement = int(self.years_to_retirement[index])
+        if years_to_retirement == NEVER_RETIRE:
+            return None, None
+        return years_to_retirement, float(self.waste[index])
+
+    def to_records(self):
+        """
+        One dict per cell with the axis values plus 'years_to_retirement' and 'waste' (None if retiring isn't possible)
+        """
+        records = []
+        for index in np.ndindex(self.years_to_retirement.shape):
+            record = {name: values[i] for (name, values), i in zip(self.axes, index)}
+            years_to_retirement = int(self.years_to_retirement[index])
+            record['years_to_retirement'] = None if years_to_retirement == NEVER_RETIRE else years_to_retirement
+            record['waste'] = None if years_to_retirement == NEVER_RETIRE else float(self.waste[index])
+            records.append(record)
+        return records
+
+# Sub-series shared with pool workers through the initializer, so each chunk only ships its row indexes
+_shared_series = None
+
+def _share_series(series):
+    global _shared_series
+    _shared_series = series
+
+def _evaluate_cells(withdrawal_rows, accumulation_rows):
+    """
+    Retirement year and waste for cells given by their rows in the shared sub-series
+    """
+    all_withdrawals, min_worth, no_retirement, post_retirement_growth_rate, years_to_live = _shared_series
+    cell_withdrawals = all_withdrawals[withdrawal_rows]
+    cell_no_retirement = no_retirement[accumulation_rows]
+    cell_growth_rate = post_retirement_growth_rate[withdrawal_rows]
+    cell_years_to_live = years_to_live[withdrawal_rows]
+
+    years_to_retirement = earliest_retirement(cell_no_retirement, min_worth[withdrawal_rows])
+    account_value = account_value_matrix(years_to_retirement, cell_no_retirement, cell_withdrawals, cell_growth_rate)
+    actual_withdrawals = actual_withdrawals_matrix(years_to_retirement, cell_withdrawals)
+    return years_to_retirement, waste_vector(cell_years_to_live, account_value, actual_withdrawals)
+
+class ParameterSweep:
+    """
+    base_scenario is a dict of RetirementAgeCalculator keyword arguments; axes is a list of (input name, values)
+     pairs, each varying one of those inputs (change inputs take a list of change dicts)
+    """
+    def __init__(self, base_scenario, axes):
+        self.base_scenario = dict(base_scenario)
+        for name in CHANGE_INPUTS:
+            if self.base_scenario.get(name) is None:
+                self.base_scenario[name] = {}
+        self.axes = [(name, list(values)) for name, values in axes]
+
+        axis_names = [name for name, _ in self.axes]
+        if len(axis_names) == 0:
+            raise ValueError("At least one axis is required")
+        for name in axis_names:
+            if name not in ACCUMULATION_INPUTS + WITHDRAWAL_INPUTS:
+                raise ValueError("Unknown sweep input '%s'" % name)
+        if len(set(axis_names)) != len(axis_names):
+            raise ValueError("Each input can only be swept along one axis")
+        for name, values in self.axes:
+            if len(values) == 0:
+                raise ValueError("Axis '%s' has no values" % name)
+        self.shape = tuple(len(values) for _, values in self.axes)
+
+    def _sub_grid(self, input_names):
+        """
+        Rows for every combination of the axes that input_names depends on (as dicts of input -> values), plus the row
+         of each cell of the full grid
+        """
+        axis_positions = [k for k, (name, _) in enumerate(self.axes) if name in input_names]
+        axis_names = [self.axes[k][0] for k in axis_positions]
+        rows = {name: [] for name in input_names}
+        for combination in itertools.product(*[self.axes[k][1] for k in axis_positions]):
+            values = dict(zip(axis_names, combination))
+            for name in input_names:
+                rows[name].append(values[name] if name in values else self.base_scenario[name])
+
+        cell_indexes = np.indices(self.shape).reshape(len(self.shape), -1)
+        if axis_positions:
+            cell_rows = np.ravel_multi_index(cell_indexes[axis_positions], [self.shape[k] for k in axis_positions])
+        else:
+            cell_rows = np.zeros(cell_indexes.shape[1], dtype=int)
+        return rows, cell_rows
+
+    def run(self, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Evaluate every cell and return a SweepResult. workers > 1 evaluates chunks of cells across that many processes.
+        """
+        withdrawal_rows, cell_withdrawal_rows = self._sub_grid(WITHDRAWAL_INPUTS)
+        contribution_rows, cell_contribution_rows = self._sub_grid(CONTRIBUTION_INPUTS)
+        accumulation_rows, cell_accumulation_rows = self._sub_grid(ACCUMULATION_INPUTS)
+
+        withdrawal_years_to_live = np.array(withdrawal_rows['years_to_live'])
+        if np.any(withdrawal_years_to_live < 1):
+            raise ValueError("Years to live must be >= 1")
+        num_years = int(withdrawal_years_to_live.max())
+        validate_change_years(withdrawal_rows['manual_retirement_income_changes'], withdrawal_rows['years_to_live'], 'retirement income')
+        validate_change_years(contribution_rows['manual_contrib_changes'], contribution_rows['years_to_live'], 'contrib')
+        validate_change_years(accumulation_rows['manual_net_worth_changes'], accumulation_rows['years_to_live'], 'net worth')
+
+        all_withdrawals = withdrawals_matrix(
+            num_years,
+            np.array(withdrawal_rows['desired_net_retirement_income_todays_dollars'], dtype=float),
+            np.array(withdrawal_rows['retirement_tax_rate'], dtype=float),
+            np.array(withdrawal_rows['inflation_rate'], dtype=float),
+            withdrawal_rows['manual_retirement_income_changes'])
+        post_retirement_growth_rate = np.array(withdrawal_rows['post_retirement_growth_rate'], dtype=float)
+        min_worth = min_worth_matrix(withdrawal_years_to_live, all_withdrawals, post_retirement_growth_rate)
+
+        contributions = contribution_matrix(
+            num_years,
+            contribution_rows['manual_contrib_changes'],
+            np.array(contribution_rows['annual_contribution'], dtype=float),
+            np.array(contribution_rows['annual_contribution_increase_rate'], dtype=float))
+        # Accumulation axes include the contribution axes, so any cell tells us an accumulation row's contribution row
+        accumulation_contribution_rows = np.empty(len(accumulation_rows['years_to_live']), dtype=int)
+        accumulation_contribution_rows[cell_accumulation_rows] = cell_contribution_rows
+        no_retirement = no_retirement_matrix(
+            net_worth_change_matrix(num_years, accumulation_rows['manual_net_worth_changes']),
+            np.array(accumulation_rows['current_retirement_savings'], dtype=float),
+            np.array(accumulation_rows['pre_retirement_growth_rate'], dtype=float),
+            contributions[accumulation_contribution_rows])
+
+        series = (all_withdrawals, min_worth, no_retirement, post_retirement_growth_rate, withdrawal_years_to_live)
+        chunks = [
+            (cell_withdrawal_rows[start:start + chunk_size], cell_accumulation_rows[start:start + chunk_size])
+            for start in range(0, len(cell_withdrawal_rows), chunk_size)
+        ]
+        if workers is not None and workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_share_series, initargs=(series,)) as executor:
+                results = list(executor.map(_evaluate_cells, *zip(*chunks)))
+        else:
+            _share_series(series)
+            results = [_evaluate_cells(*chunk) for chunk in chunks]
+            _share_series(None)
+
+        years_to_retirement = np.concatenate([result[0] for result in results]).reshape(self.shape)
+        waste = np.concatenate([result[1] for result in results]).reshape(self.shape)
+        return SweepResult(self.axes, years_to_retirement, waste)
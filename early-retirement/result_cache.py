@@ -0,0 +1,226 @@
+"""
+Memoization for repeated scenarios (the same plan re-opened, a sweep re-visiting cells, ...).
+
+Results are keyed on a hash of a canonical form of all the inputs, so e.g. change dicts given in a different order, or
+ 100000 vs 100000.0, hit the same entry. ResultCache keeps a bounded in-memory LRU, optionally backed by a sqlite file
+ that survives restarts and can be shared by several processes (e.g. batch workers). The file records the version of
+ the results it holds (CACHE_VERSION plus a hash of the calculator's source), and is emptied when opened by code with a
+ different one, so results from an older calculator are never served.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import sqlite3
+
+import retirement_age_calculator
+from retirement_age_calculator import RetirementAgeCalculator
+
+DEFAULT_MAX_ENTRIES = 100000
+# How long a process waits for another one to finish writing to the disk tier
+DISK_TIMEOUT_SECONDS = 30
+# Bump when cached results change shape or meaning; edits to the calculator's source are picked up by RESULTS_VERSION
+CACHE_VERSION = 2
+VERSION_META_KEY = 'version'
+# Counters that add up across processes (see ResultCache.merge)
+COUNTERS = ('hits', 'disk_hits', 'misses', 'evictions')
+
+def _source_hash(module):
+    with open(module.__file__, 'rb') as source:
+        return hashlib.sha256(source.read()).hexdigest()
+
+RESULTS_VERSION = '%s:%s' % (CACHE_VERSION, _source_hash(retirement_age_calculator))
+
+def _canonical(value):
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, dict):
+        items = [[_canonical(key), _canonical(item)] for key, item in value.items()]
+        return sorted(items, key=lambda item: json.dumps(item[0]))
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item) for item in value]
+    raise ValueError("Can't build a cache key from a value of type %s" % type(value).__name__)
+
+def canonical_key(inputs):
+    """
+    Hex sha256 of a canonical form of inputs, which can be any nesting of dicts, lists/tuples, numbers, strings,
+     booleans and None. Dicts are sorted by key and ints are treated like the equivalent floats.
+    """
+    canonical = json.dumps(_canonical(inputs), separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class ResultCache:
+    """
+    Bounded LRU of JSON-serializable results, keyed on canonical_key of the inputs. If path is given, results are also
+     written through to a sqlite database there, which is checked on in-memory misses.
+
+    The database is tagged with version, and one tagged with another version is emptied when it's opened.
+
+    Counters (see stats): hits are served from memory, disk_hits from the database, misses had to be computed, and
+     evictions dropped out of memory to make room (they stay on disk).
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, path=None, version=RESULTS_VERSION):
+        if max_entries < 1:
+            raise ValueError("Max entries must be >= 1")
+        self.max_entries = max_entries
+        self.path = path
+        self.version = version
+        self._entries = OrderedDict()
+        self._connection = None
+        self._connection_pid = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        # Send only the configuration to other processes: each gets its own memory tier and database connection
+        return {'max_entries': self.max_entries, 'path': self.path, 'version': self.version}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _disk(self):
+        # sqlite connections can't be shared across a fork, so reconnect in each process
+        if self._connection is None or self._connection_pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=DISK_TIMEOUT_SECONDS)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # Checked and reset in one write transaction, so concurrent processes don't each clear the others' results
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            row = connection.execute('SELECT value FROM meta WHERE name = ?', (VERSION_META_KEY,)).fetchone()
+            if row is None or row[0] != self.version:
+                connection.execute('DELETE FROM results')
+                connection.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (VERSION_META_KEY, self.version))
+            connection.commit()
+            self._connection = connection
+            self._connection_pid = os.getpid()
+        return self._connection
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_compute(self, inputs, compute):
+        """
+        Cached result for inputs, calling compute() (and caching what it returns) if there isn't one
+        """
+        key = canonical_key(inputs)
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        if self.path is not None:
+            row = self._disk().execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self.disk_hits += 1
+                value = json.loads(row[0])
+                self._remember(key, value)
+                return value
+
+        self.misses += 1
+        # Round-trip through JSON so a result looks the same whichever tier it comes from
+        encoded = json.dumps(compute())
+        value = json.loads(encoded)
+        self._remember(key, value)
+        if self.path is not None:
+            connection = self._disk()
+            connection.execute('INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)', (key, encoded))
+            connection.commit()
+        return value
+
+    def counters(self):
+        """
+        Dict of just the COUNTERS, e.g. to send back from a worker process to merge
+        """
+        return {counter: getattr(self, counter) for counter in COUNTERS}
+
+    def merge(self, counters):
+        """
+        Add in the counters() (or stats()) of another ResultCache, e.g. a worker process's copy of this one
+        """
+        for counter in COUNTERS:
+            setattr(self, counter, getattr(self, counter) + counters[counter])
+
+    def stats(self):
+        """
+        Dict of the counters, plus the current number of in-memory entries and the overall hit rate
+        """
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        """
+        Drop every entry, from disk too, and reset the counters
+        """
+        self._entries.clear()
+        if self.path is not None:
+            connection = self._disk()
+            connection.execute('DELETE FROM results')
+            connection.commit()
+        self.hits = self.disk_hits = self.misses = self.evictions = 0
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+def cached_retirement(cache,
+        current_retirement_savings,
+        annual_contribution,
+        annual_contribution_increase_rate,
+        pre_retirement_growth_rate,
+        post_retirement_growth_rate,
+        inflation_rate,
+        years_to_live,
+        desired_net_retirement_income_todays_dollars,
+        retirement_tax_rate,
+        manual_contrib_changes=None,
+        manual_net_worth_changes=None,
+        manual_retirement_income_changes=None,
+        instrumentation=None):
+    """
+    (earliest retirement, waste) for a scenario, exactly as the CLI's RetirementAgeCalculator (and the batch calculator)
+     give them (both None if you can't retire), from cache if it's been seen before. Invalid inputs raise ValueError and aren't cached.
+     instrumentation, if given, records the calculation on a miss; it isn't part of the key.
+    """
+    scenario = {
+        'current_retirement_savings': current_retirement_savings,
+        'annual_contribution': annual_contribution,
+        'annual_contribution_increase_rate': annual_contribution_increase_rate,
+        'pre_retirement_growth_rate': pre_retirement_growth_rate,
+        'post_retirement_growth_rate': post_retirement_growth_rate,
+        'inflation_rate': inflation_rate,
+        'years_to_live': years_to_live,
+        'desired_net_retirement_income_todays_dollars': desired_net_retirement_income_todays_dollars,
+        'retirement_tax_rate': retirement_tax_rate,
+        'manual_contrib_changes': manual_contrib_changes if manual_contrib_changes is not None else {},
+        'manual_net_worth_changes': manual_net_worth_changes if manual_net_worth_changes is not None else {},
+        'manual_retirement_income_changes': manual_retirement_income_changes if manual_retirement_income_changes is not None else {},
+    }
+
+    def compute():
+        calculator = RetirementAgeCalculator(instrumentation=instrumentation, **scenario)
+        years_to_retirement = calculator.get_earliest_retirement()
+        return [years_to_retirement, calculator.get_waste() if years_to_retirement is not None else None]
+
+    years_to_retirement, waste = cache.get_or_compute(['RetirementAgeCalculator', scenario], compute)
+    return years_to_retirement, waste
@@ -1,15 +1,34 @@
+from array import array
+from bisect import bisect_right
 from enum import Enum, auto
 
-# TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO 
-# This whole class models data as arrays, but
-#  it could (and probably should) be modeled as mathematical functions
-# TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO TODO 
+from instrumentation import NULL_INSTRUMENTATION
+
+# NOTE: The *Function classes below model data as arrays; the Lazy*Function classes model contributions, withdrawals
+#  and min worth as piecewise geometric formulas between manual changes instead, and only build arrays on data().
+#  Net worth and account value still need arrays, because they get clipped at 0 every year.
+# Arrays are lists while they're built; compact() packs them into contiguous float64 buffers (array.array), about a
+#  quarter of the memory. data() always copies out a list, while view() is a read-only memoryview of the buffer
+#  itself once compacted (and of a freshly packed buffer before that).
+
+SERIES_TYPECODE = 'd'
+
+def _pack(values):
+    return array(SERIES_TYPECODE, values) if isinstance(values, list) else values
+
+def _copy_list(values):
+    return values.tolist() if isinstance(values, array) else values.copy()
+
+def _readonly_view(values):
+    return memoryview(_pack(values)).toreadonly()
 
 class ContributionFunction:
     """
     Function that returns the yearly contribution amount for any given year in the [0, years_to_live),
      taking into account contrib increases and changes.
     """
+    __slots__ = ('contribs',)
+
     def __init__(self, years_to_live, manual_contrib_changes, initial_contrib_amount, initial_contrib_rate):
         self.contribs = []
         current_base_contrib = initial_contrib_amount
@@ -26,13 +45,21 @@ class ContributionFunction:
         return self.contribs[years_in_future]
 
     def data(self):
-        return self.contribs.copy()
+        return _copy_list(self.contribs)
+
+    def view(self):
+        return _readonly_view(self.contribs)
+
+    def compact(self):
+        self.contribs = _pack(self.contribs)
 
 class NoRetirementNetWorthFunction:
     """
     Function that returns net worth for a given year in range [0, years_to_live), accounting for net worth and
      contribution changes.
     """
+    __slots__ = ('net_worth',)
+
     def __init__(self, years_to_live, manual_net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, contribution_function):
         # TODO make this a nice math formula
         # We assume:
@@ -54,12 +81,20 @@ class NoRetirementNetWorthFunction:
         return self.net_worth[years_in_future]
 
     def data(self):
-        return self.net_worth.copy()
+        return _copy_list(self.net_worth)
+
+    def view(self):
+        return _readonly_view(self.net_worth)
+
+    def compact(self):
+        self.net_worth = _pack(self.net_worth)
 
 class RetirementWithdrawalsFunction:
     """
     Describes, for each year in [0, years_to_live), the inflation-adjusted absolute withdrawal amount required to meet the desired net retirement income in today's dollars
     """
+    __slots__ = ('withdrawals',)
+
     def __init__(self, years_to_live, net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes):
         net_income = net_retirement_income_todays_dollars
         self.withdrawals = []
@@ -74,12 +109,20 @@ class RetirementWithdrawalsFunction:
         return self.withdrawals[years_in_future]
 
     def data(self):
-        return self.withdrawals.copy()
+        return _copy_list(self.withdrawals)
+
+    def view(self):
+        return _readonly_view(self.withdrawals)
+
+    def compact(self):
+        self.withdrawals = _pack(self.withdrawals)
 
 class RetirementMinWorthFunction:
     """
     Function to describe the minimum worth needed at every year in [0,years_to_live) to not run out of money before dying
     """
+    __slots__ = ('min_worth',)
+
     def __init__(self, years_to_live, withdrawal_function, post_retirement_growth_rate):
         # This is a super stupid, but super clear, way to do this
         min_worth_for_last_x_year = []
@@ -101,13 +144,138 @@ class RetirementMinWorthFunction:
         return self.min_worth[years_in_future]
 
     def data(self):
-        return self.min_worth.copy()
+        return _copy_list(self.min_worth)
+
+    def view(self):
+        return _readonly_view(self.min_worth)
+
+    def compact(self):
+        self.min_worth = _pack(self.min_worth)
+
+def _geometric_sum(ratio, num_terms):
+    """
+    1 + ratio + ratio^2 + ... + ratio^(num_terms - 1)
+    """
+    if ratio == 1:
+        return num_terms
+    return (1 - ratio ** num_terms) / (1 - ratio)
+
+class LazyContributionFunction:
+    """
+    Same values as ContributionFunction, but computed on demand from the manual changes in effect rather than
+     stored for every year
+    """
+    __slots__ = ('years_to_live', 'segments', 'segment_starts')
+
+    def __init__(self, years_to_live, manual_contrib_changes, initial_contrib_amount, initial_contrib_rate):
+        self.years_to_live = years_to_live
+        # (start year, base contrib, contrib rate) for each stretch of years between manual changes
+        self.segments = [(0, initial_contrib_amount, initial_contrib_rate)]
+        for years_out in sorted(manual_contrib_changes.keys()):
+            contrib, contrib_rate = manual_contrib_changes[years_out]
+            if years_out == 0:
+                self.segments[0] = (0, contrib, contrib_rate)
+            else:
+                self.segments.append((years_out, contrib, contrib_rate))
+        self.segment_starts = [segment[0] for segment in self.segments]
+
+    def apply(self, years_in_future):
+        start, base_contrib, contrib_rate = self.segments[bisect_right(self.segment_starts, years_in_future) - 1]
+        return base_contrib * (1 + contrib_rate) ** (years_in_future - start)
+
+    def data(self):
+        return [self.apply(i) for i in range(0, self.years_to_live)]
+
+    def view(self):
+        return _readonly_view(array(SERIES_TYPECODE, map(self.apply, range(0, self.years_to_live))))
+
+    def compact(self):
+        # Nothing stored per year to begin with
+        pass
+
+class LazyRetirementWithdrawalsFunction:
+    """
+    Same values as RetirementWithdrawalsFunction, but computed on demand from the retirement income in effect
+    """
+    __slots__ = ('years_to_live', 'inflation_rate', 'segments', 'segment_starts')
+
+    def __init__(self, years_to_live, net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes):
+        self.years_to_live = years_to_live
+        self.inflation_rate = inflation_rate
+        # (start year, gross income in today's dollars) for each stretch of years between manual changes
+        self.segments = [(0, net_retirement_income_todays_dollars / (1.0 - retirement_tax_rate))]
+        for years_out in sorted(manual_retirement_income_changes.keys()):
+            gross_income = manual_retirement_income_changes[years_out] / (1.0 - retirement_tax_rate)
+            if years_out == 0:
+                self.segments[0] = (0, gross_income)
+            else:
+                self.segments.append((years_out, gross_income))
+        self.segment_starts = [segment[0] for segment in self.segments]
+
+    def apply(self, years_in_future):
+        _, gross_income = self.segments[bisect_right(self.segment_starts, years_in_future) - 1]
+        return gross_income * (1.0 + self.inflation_rate) ** years_in_future
+
+    def data(self):
+        return [self.apply(i) for i in range(0, self.years_to_live)]
+
+    def view(self):
+        return _readonly_view(array(SERIES_TYPECODE, map(self.apply, range(0, self.years_to_live))))
+
+    def compact(self):
+        # Nothing stored per year to begin with
+        pass
+
+class LazyRetirementMinWorthFunction:
+    """
+    Same values as RetirementMinWorthFunction (up to floating point rounding), in closed form: within a stretch of
+     constant retirement income the min worth is a geometric series of inflated withdrawals discounted by growth,
+     plus the discounted min worth at the start of the next stretch
+    """
+    __slots__ = ('years_to_live', 'withdrawal_function', 'discount', 'ratio', 'min_worth_at_segment_end', 'segment_ends')
+
+    def __init__(self, years_to_live, withdrawal_function, post_retirement_growth_rate):
+        self.years_to_live = years_to_live
+        self.withdrawal_function = withdrawal_function
+        self.discount = 1 / (1 + post_retirement_growth_rate)
+        self.ratio = (1 + withdrawal_function.inflation_rate) * self.discount
+
+        # Min worth needed at the end of each segment, working backwards from 0 at death
+        segment_ends = withdrawal_function.segment_starts[1:] + [years_to_live]
+        self.min_worth_at_segment_end = [0] * len(segment_ends)
+        for segment_index in range(len(segment_ends) - 2, -1, -1):
+            next_start = segment_ends[segment_index]
+            self.min_worth_at_segment_end[segment_index] = self._segment_min_worth(segment_index + 1, next_start, segment_ends[segment_index + 1])
+        self.segment_ends = segment_ends
+
+    def _segment_min_worth(self, segment_index, years_in_future, segment_end):
+        _, gross_income = self.withdrawal_function.segments[segment_index]
+        withdrawal = gross_income * (1.0 + self.withdrawal_function.inflation_rate) ** years_in_future
+        years_left_in_segment = segment_end - years_in_future
+        return (withdrawal * _geometric_sum(self.ratio, years_left_in_segment)
+            + self.min_worth_at_segment_end[segment_index] * self.discount ** years_left_in_segment)
+
+    def apply(self, years_in_future):
+        segment_index = bisect_right(self.withdrawal_function.segment_starts, years_in_future) - 1
+        return self._segment_min_worth(segment_index, years_in_future, self.segment_ends[segment_index])
+
+    def data(self):
+        return [self.apply(i) for i in range(0, self.years_to_live)]
+
+    def view(self):
+        return _readonly_view(array(SERIES_TYPECODE, map(self.apply, range(0, self.years_to_live))))
+
+    def compact(self):
+        # Nothing stored per year to begin with
+        pass
 
 class AccountValueFunction:
     """
     Function representing the actual account value over time, with
      retirement factored in.
     """
+    __slots__ = ('account_value',)
+
     def __init__(self, years_to_live, retirement, no_retirement_func, post_retirement_growth_rate, withdrawal_func):
         self.account_value = None
         if retirement is not None:
@@ -131,9 +299,17 @@ class AccountValueFunction:
         return self.account_value[years_in_future]
 
     def data(self):
-        return self.account_value.copy()
+        return _copy_list(self.account_value)
+
+    def view(self):
+        return _readonly_view(self.account_value)
+
+    def compact(self):
+        self.account_value = _pack(self.account_value)
 
 class ActualWithdrawalsFunction:
+    __slots__ = ('withdrawals',)
+
     def __init__(self, years_to_live, retirement, withdrawals_func):
         self.withdrawals = None
         if retirement is not None:
@@ -146,7 +322,13 @@ class ActualWithdrawalsFunction:
         return self.withdrawals[years_in_future]
 
     def data(self):
-        return self.withdrawals.copy()
+        return _copy_list(self.withdrawals)
+
+    def view(self):
+        return _readonly_view(self.withdrawals)
+
+    def compact(self):
+        self.withdrawals = _pack(self.withdrawals)
 
 
 class Series(Enum):
@@ -178,46 +360,100 @@ class RetirementAgeCalculator:
             retirement_tax_rate,
             manual_contrib_changes=None,
             manual_net_worth_changes=None,
-            manual_retirement_income_changes=None):
+            manual_retirement_income_changes=None,
+            lazy=False,
+            compact=False,
+            instrumentation=None):
         # TODO actually handle net worth changes at any point in time
         """
         NOTE: As of 2020-04-19, any net worth or contribution changes made after the projected retirement date
          are ignored, leading to incorrect projections
+
+        With lazy=True, contributions, withdrawals and min worth are evaluated from closed-form formulas, the search
+         stops at the earliest retirement year and no per-year lists are built unless get_series_data is called.
+         Results match the default mode up to floating point rounding.
+
+        With compact=True, the per-year series are packed into float64 buffers once calculated, about a quarter of the
+         memory of lists of floats, and get_series_data(series, copy=False) returns views of them without copying.
+
+        With an Instrumentation (see instrumentation.py), the time and allocations of each stage of the calculation
+         are recorded in it.
         """
-        manual_contrib_changes = manual_contrib_changes if manual_contrib_changes is not None else {}
-        manual_net_worth_changes = manual_net_worth_changes if manual_net_worth_changes is not None else {}
-        manual_retirement_income_changes = manual_retirement_income_changes if manual_retirement_income_changes is not None else {}
-
-        for years_out in manual_contrib_changes.keys():
-            if years_out < 0 or years_out >= years_to_live:
-                raise ValueError("Invalid contrib change year '%s'; must be in range [0,%s)" % years_out, years_to_live)
-        for years_out in manual_net_worth_changes.keys():
-            if years_out < 0 or years_out >= years_to_live:
-                raise ValueError("Invalid net worth change year '%s'; must be in range [0,%s)" % years_out, years_to_live)
-        for years_out in manual_retirement_income_changes.keys():
-            if years_out < 0 or years_out >= years_to_live:
-                raise ValueError("Invalid retirement income change year '%s'; must be in range [0,%s)" % years_out, years_to_live)
-        if years_to_live < 1:
-            raise ValueError("Years to live must be >= 1")
-
-        all_withdrawals_function = RetirementWithdrawalsFunction(years_to_live, desired_net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes)
-        min_worth_function = RetirementMinWorthFunction(years_to_live, all_withdrawals_function, post_retirement_growth_rate)
-
-        contribution_function = ContributionFunction(
+        instrumentation = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+        self._instrumentation = instrumentation
+        self._compact = compact
+        with instrumentation.calculation():
+            with instrumentation.stage('validate'):
+                manual_contrib_changes = manual_contrib_changes if manual_contrib_changes is not None else {}
+                manual_net_worth_changes = manual_net_worth_changes if manual_net_worth_changes is not None else {}
+                manual_retirement_income_changes = manual_retirement_income_changes if manual_retirement_income_changes is not None else {}
+
+                for years_out in manual_contrib_changes.keys():
+                    if years_out < 0 or years_out >= years_to_live:
+                        raise ValueError("Invalid contrib change year '%s'; must be in range [0,%s)" % (years_out, years_to_live))
+                for years_out in manual_net_worth_changes.keys():
+                    if years_out < 0 or years_out >= years_to_live:
+                        raise ValueError("Invalid net worth change year '%s'; must be in range [0,%s)" % (years_out, years_to_live))
+                for years_out in manual_retirement_income_changes.keys():
+                    if years_out < 0 or years_out >= years_to_live:
+                        raise ValueError("Invalid retirement income change year '%s'; must be in range [0,%s)" % (years_out, years_to_live))
+                if years_to_live < 1:
+                    raise ValueError("Years to live must be >= 1")
+
+            init = self._init_lazy if lazy else self._init_eager
+            init(
+                current_retirement_savings,
+                annual_contribution,
+                annual_contribution_increase_rate,
+                pre_retirement_growth_rate,
+                post_retirement_growth_rate,
+                inflation_rate,
+                years_to_live,
+                desired_net_retirement_income_todays_dollars,
+                retirement_tax_rate,
+                manual_contrib_changes,
+                manual_net_worth_changes,
+                manual_retirement_income_changes)
+
+    def _init_eager(self,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
             years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
             manual_contrib_changes,
-            annual_contribution,
-            annual_contribution_increase_rate)
-        no_retirement_function = NoRetirementNetWorthFunction(years_to_live, manual_net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, contribution_function)
+            manual_net_worth_changes,
+            manual_retirement_income_changes):
+        instrumentation = self._instrumentation
+        with instrumentation.stage('withdrawals'):
+            all_withdrawals_function = RetirementWithdrawalsFunction(years_to_live, desired_net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes)
+        with instrumentation.stage('min_worth'):
+            min_worth_function = RetirementMinWorthFunction(years_to_live, all_withdrawals_function, post_retirement_growth_rate)
+
+        with instrumentation.stage('contributions'):
+            contribution_function = ContributionFunction(
+                years_to_live,
+                manual_contrib_changes,
+                annual_contribution,
+                annual_contribution_increase_rate)
+        with instrumentation.stage('no_retirement'):
+            no_retirement_function = NoRetirementNetWorthFunction(years_to_live, manual_net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, contribution_function)
 
         # Contigent-on-retirement-solution
-        self.years_to_retirement = None
-        for i in range(0, years_to_live):
-            if no_retirement_function.apply(i) >= min_worth_function.apply(i):
-                self.years_to_retirement = i
-                break
-        actual_withdrawals_function = ActualWithdrawalsFunction(years_to_live, self.years_to_retirement, all_withdrawals_function)
-        account_value_function = AccountValueFunction(years_to_live, self.years_to_retirement, no_retirement_function, post_retirement_growth_rate, all_withdrawals_function)
+        with instrumentation.stage('retirement_scan'):
+            self.years_to_retirement = None
+            for i in range(0, years_to_live):
+                if no_retirement_function.apply(i) >= min_worth_function.apply(i):
+                    self.years_to_retirement = i
+                    break
+        with instrumentation.stage('actual_withdrawals'):
+            actual_withdrawals_function = ActualWithdrawalsFunction(years_to_live, self.years_to_retirement, all_withdrawals_function)
+        with instrumentation.stage('account_value'):
+            account_value_function = AccountValueFunction(years_to_live, self.years_to_retirement, no_retirement_function, post_retirement_growth_rate, all_withdrawals_function)
 
         self.waste = None
         if self.years_to_retirement is not None:
@@ -232,6 +468,82 @@ class RetirementAgeCalculator:
             Series.ACCOUNT_VALUE: account_value_function,
             Series.ACTUAL_WITHDRAWALS: actual_withdrawals_function,
         }
+        if self._compact:
+            self._compact_series()
+
+    def _init_lazy(self,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes,
+            manual_net_worth_changes,
+            manual_retirement_income_changes):
+        instrumentation = self._instrumentation
+        with instrumentation.stage('withdrawals'):
+            all_withdrawals_function = LazyRetirementWithdrawalsFunction(years_to_live, desired_net_retirement_income_todays_dollars, retirement_tax_rate, inflation_rate, manual_retirement_income_changes)
+        with instrumentation.stage('min_worth'):
+            min_worth_function = LazyRetirementMinWorthFunction(years_to_live, all_withdrawals_function, post_retirement_growth_rate)
+        with instrumentation.stage('contributions'):
+            contribution_function = LazyContributionFunction(
+                years_to_live,
+                manual_contrib_changes,
+                annual_contribution,
+                annual_contribution_increase_rate)
+
+        # Net worth gets clipped at 0 every year so it has no closed form; walk it forward one value at a time
+        #  (same arithmetic as NoRetirementNetWorthFunction) and stop as soon as we can retire
+        with instrumentation.stage('retirement_scan'):
+            self.years_to_retirement = None
+            net_worth = None
+            for i in range(0, years_to_live):
+                if i == 0:
+                    value = current_retirement_savings
+                else:
+                    value = net_worth * (1 + pre_retirement_growth_rate) + contribution_function.apply(i - 1)
+                net_worth = max(0, value + manual_net_worth_changes.get(i, 0))
+                if net_worth >= min_worth_function.apply(i):
+                    self.years_to_retirement = i
+                    break
+
+        # Once retired with at least the min worth, the surplus over the min worth just compounds at the post-retirement
+        #  growth rate (the account never hits 0), and at death the min worth is exactly the last withdrawal
+        self.waste = None
+        if self.years_to_retirement is not None:
+            surplus = net_worth - min_worth_function.apply(self.years_to_retirement)
+            self.waste = surplus * (1 + post_retirement_growth_rate) ** (years_to_live - 1 - self.years_to_retirement)
+
+        self.underlying_funcs = {
+            Series.ALL_WITHDRAWALS: all_withdrawals_function,
+            Series.MIN_RETIREMENT_WORTH: min_worth_function,
+            Series.CONTRIBUTIONS: contribution_function,
+        }
+        # The remaining series are only built if someone asks for them
+        self._materialize_args = (years_to_live, manual_net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, post_retirement_growth_rate)
+
+    def _materialize(self):
+        with self._instrumentation.stage('materialize'):
+            self._materialize_series()
+
+    def _materialize_series(self):
+        years_to_live, manual_net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, post_retirement_growth_rate = self._materialize_args
+        all_withdrawals_function = self.underlying_funcs[Series.ALL_WITHDRAWALS]
+        no_retirement_function = NoRetirementNetWorthFunction(years_to_live, manual_net_worth_changes, current_retirement_savings, pre_retirement_growth_rate, self.underlying_funcs[Series.CONTRIBUTIONS])
+        self.underlying_funcs[Series.NO_RETIREMENT] = no_retirement_function
+        self.underlying_funcs[Series.ACCOUNT_VALUE] = AccountValueFunction(years_to_live, self.years_to_retirement, no_retirement_function, post_retirement_growth_rate, all_withdrawals_function)
+        self.underlying_funcs[Series.ACTUAL_WITHDRAWALS] = ActualWithdrawalsFunction(years_to_live, self.years_to_retirement, all_withdrawals_function)
+        if self._compact:
+            self._compact_series()
+
+    def _compact_series(self):
+        with self._instrumentation.stage('compact'):
+            for function in self.underlying_funcs.values():
+                function.compact()
 
     def get_earliest_retirement(self):
         """
@@ -247,5 +559,13 @@ class RetirementAgeCalculator:
         """
         return self.waste
 
-    def get_series_data(self, series):
-        return self.underlying_funcs[series].data()
+    def get_series_data(self, series, copy=True):
+        """
+        Values of the series for each year in [0, years_to_live), as a new list. With copy=False, a read-only
+         memoryview (format 'd') instead, which numpy.asarray can wrap without copying: of the calculator's own buffer
+         when built with compact=True, otherwise of a buffer packed for this call, which still skips building a list.
+        """
+        if series not in self.underlying_funcs:
+            self._materialize()
+        function = self.underlying_funcs[series]
+        return function.data() if copy else function.view()
@@ -0,0 +1,209 @@
+import math
+
+from instrumentation import NULL_INSTRUMENTATION
+from retirement_age_calculator import (
+    RetirementAgeCalculator,
+    ContributionFunction,
+    NoRetirementNetWorthFunction,
+    RetirementWithdrawalsFunction,
+    RetirementMinWorthFunction,
+)
+
+# Answers are in dollars, so solve to the cent
+PRECISION = 0.01
+# Past this many dollars we consider a target unreachable
+MAX_SEARCH_VALUE = 1e15
+
+def _round_to_cent(value, up):
+    # Round off float noise first so e.g. 12.34 doesn't turn into 1234.0000000000002 cents and get rounded up
+    cents = round(value * 100, 6)
+    return (math.ceil(cents) if up else math.floor(cents)) / 100
+
+class RetirementSolver:
+    """
+    Inverse of RetirementAgeCalculator: given every input but one, find the most you can spend or the least you need
+     to put in to be able to retire by a target year.
+
+    Takes the same inputs as RetirementAgeCalculator; whichever one is being solved for is ignored. Instead of
+     rebuilding the calculator per guess, this uses the fact that min worth is linear in the retirement income, and net
+     worth is linear in the contribution and current savings (as long as it never gets clipped at 0), so the answer is
+     the best of one closed-form bound per year. Only when clipping breaks linearity does it fall back to bisecting,
+     and then only the net worth series is rebuilt per guess.
+
+    With an Instrumentation, the reference calculation's stages and the time of each solve are recorded in it.
+    """
+    def __init__(self,
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None,
+            instrumentation=None):
+        self._instrumentation = instrumentation if instrumentation is not None else NULL_INSTRUMENTATION
+        self.current_retirement_savings = current_retirement_savings
+        self.annual_contribution = annual_contribution
+        self.annual_contribution_increase_rate = annual_contribution_increase_rate
+        self.pre_retirement_growth_rate = pre_retirement_growth_rate
+        self.post_retirement_growth_rate = post_retirement_growth_rate
+        self.inflation_rate = inflation_rate
+        self.years_to_live = years_to_live
+        self.desired_net_retirement_income_todays_dollars = desired_net_retirement_income_todays_dollars
+        self.retirement_tax_rate = retirement_tax_rate
+        self.manual_contrib_changes = manual_contrib_changes if manual_contrib_changes is not None else {}
+        self.manual_net_worth_changes = manual_net_worth_changes if manual_net_worth_changes is not None else {}
+        self.manual_retirement_income_changes = manual_retirement_income_changes if manual_retirement_income_changes is not None else {}
+
+        # Building the calculator once validates the inputs and gives the current answer, for reference
+        self.calculator = RetirementAgeCalculator(
+            current_retirement_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            retirement_tax_rate,
+            manual_contrib_changes=self.manual_contrib_changes,
+            manual_net_worth_changes=self.manual_net_worth_changes,
+            manual_retirement_income_changes=self.manual_retirement_income_changes,
+            instrumentation=self._instrumentation)
+
+    def _validate_target_year(self, target_year):
+        if target_year < 0 or target_year >= self.years_to_live:
+            raise ValueError("Invalid target retirement year '%s'; must be in range [0,%s)" % (target_year, self.years_to_live))
+
+    def _min_worth_function(self, net_retirement_income_todays_dollars):
+        withdrawals_function = RetirementWithdrawalsFunction(
+            self.years_to_live,
+            net_retirement_income_todays_dollars,
+            self.retirement_tax_rate,
+            self.inflation_rate,
+            self.manual_retirement_income_changes)
+        return RetirementMinWorthFunction(self.years_to_live, withdrawals_function, self.post_retirement_growth_rate)
+
+    def _no_retirement_function(self, current_retirement_savings, annual_contribution):
+        contribution_function = ContributionFunction(
+            self.years_to_live,
+            self.manual_contrib_changes,
+            annual_contribution,
+            self.annual_contribution_increase_rate)
+        return NoRetirementNetWorthFunction(
+            self.years_to_live,
+            self.manual_net_worth_changes,
+            current_retirement_savings,
+            self.pre_retirement_growth_rate,
+            contribution_function)
+
+    @staticmethod
+    def _can_retire_by(target_year, no_retirement_function, min_worth_function):
+        # Same comparison RetirementAgeCalculator makes, so the answers agree with it exactly
+        for i in range(0, target_year + 1):
+            if no_retirement_function.apply(i) >= min_worth_function.apply(i):
+                return True
+        return False
+
+    def max_retirement_income(self, target_year):
+        """
+        Largest desired net retirement income (today's dollars, rounded down to the cent) that still lets you retire
+         by target_year; None if not even zero income works, or infinity if manual retirement income changes take
+         over before you'd need the base income at all
+        """
+        with self._instrumentation.stage('solve'):
+            return self._max_retirement_income(target_year)
+
+    def _max_retirement_income(self, target_year):
+        self._validate_target_year(target_year)
+        no_retirement_function = self._no_retirement_function(self.current_retirement_savings, self.annual_contribution)
+        # Min worth = income * per_dollar + fixed, where fixed comes from the manual income changes
+        fixed_min_worth_function = self._min_worth_function(0)
+        unit_min_worth_function = self._min_worth_function(1)
+
+        best_income = None
+        for i in range(0, target_year + 1):
+            fixed = fixed_min_worth_function.apply(i)
+            per_dollar = unit_min_worth_function.apply(i) - fixed
+            surplus = no_retirement_function.apply(i) - fixed
+            if per_dollar <= 0:
+                # From here on only the manual changes matter
+                if surplus >= 0:
+                    return math.inf
+            elif surplus >= 0:
+                best_income = max(best_income if best_income is not None else 0, surplus / per_dollar)
+        if best_income is None:
+            return None
+
+        income = _round_to_cent(best_income, up=False)
+        # Rounding in the full calculation can land a hair on the wrong side of the bound
+        while income > 0 and not self._can_retire_by(target_year, no_retirement_function, self._min_worth_function(income)):
+            income = _round_to_cent(income - PRECISION, up=False)
+        return max(income, 0)
+
+    def min_annual_contribution(self, target_year):
+        """
+        Smallest annual contribution (rounded up to the cent, never negative) that lets you retire by target_year,
+         or None if no contribution is enough
+        """
+        return self._solve_min_input(
+            target_year,
+            lambda annual_contribution: self._no_retirement_function(self.current_retirement_savings, annual_contribution))
+
+    def min_current_savings(self, target_year):
+        """
+        Smallest current retirement savings (rounded up to the cent, never negative) that lets you retire by
+         target_year, or None if no amount is enough
+        """
+        return self._solve_min_input(
+            target_year,
+            lambda current_retirement_savings: self._no_retirement_function(current_retirement_savings, self.annual_contribution))
+
+    def _solve_min_input(self, target_year, no_retirement_function_for):
+        with self._instrumentation.stage('solve'):
+            return self._min_input(target_year, no_retirement_function_for)
+
+    def _min_input(self, target_year, no_retirement_function_for):
+        self._validate_target_year(target_year)
+        min_worth_function = self._min_worth_function(self.desired_net_retirement_income_todays_dollars)
+
+        def can_retire_with(value):
+            return self._can_retire_by(target_year, no_retirement_function_for(value), min_worth_function)
+
+        if can_retire_with(0):
+            return 0
+
+        # Net worth = value * per_dollar + base, as long as nothing gets clipped at 0
+        base_function = no_retirement_function_for(0)
+        unit_function = no_retirement_function_for(1)
+        best_value = None
+        for i in range(0, target_year + 1):
+            base = base_function.apply(i)
+            per_dollar = unit_function.apply(i) - base
+            if per_dollar > 0:
+                required = (min_worth_function.apply(i) - base) / per_dollar
+                best_value = required if best_value is None else min(best_value, required)
+        if best_value is not None:
+            value = _round_to_cent(best_value, up=True)
+            if can_retire_with(value) and not can_retire_with((round(value * 100) - 1) / 100):
+                return value
+
+        # Clipping made net worth non-linear, so bisect (feasibility only improves as the value grows). This is over
+        #  whole cents, so the answer is exactly the smallest cent that works: 0 doesn't, high always does
+        low_cents, high_cents = 0, max(round(value * 100), 100) if best_value is not None else 100
+        while not can_retire_with(high_cents / 100):
+            if high_cents / 100 >= MAX_SEARCH_VALUE:
+                return None
+            low_cents, high_cents = high_cents, high_cents * 2
+        while high_cents - low_cents > 1:
+            middle_cents = (low_cents + high_cents) // 2
+            if can_retire_with(middle_cents / 100):
+                high_cents = middle_cents
+            else:
+                low_cents = middle_cents
+        return high_cents / 100
@@ -0,0 +1,333 @@
+"""
+Reading scenarios from CSV/JSONL and evaluating them as a stream, for running many scenarios through one process
+ instead of starting the CLI once per scenario.
+
+Each record has the same fields as the CLI's positional arguments (current_savings, annual_contribution, ...), plus
+ optional change lists and an optional 'id' that's passed through to the result:
+ - net_worth_change: years_out:value entries
+ - contrib_change: years_out:contrib:contrib_rate entries
+ - retirement_income_change: years_out:net_income entries
+In CSV the entries are separated by ';' (e.g. "5:100000;12:-20000"); in JSONL they can also be given as a list of
+ lists (e.g. [[5, 100000], [12, -20000]]).
+
+Results come out in input order, one per record, with bad records reported in the result's 'error' field rather than
+ stopping the stream. Each chunk of records is calculated with one BatchRetirementAgeCalculator (or one
+ RetirementAgeCalculator per record without numpy), both of which give exactly the same answers as the CLI.
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import itertools
+import json
+
+from instrumentation import NULL_INSTRUMENTATION, Instrumentation
+from retirement_age_calculator import RetirementAgeCalculator
+from result_cache import cached_retirement
+
+try:
+    from batch_retirement_calculator import BatchRetirementAgeCalculator, NEVER_RETIRE
+    have_numpy = True
+except ImportError:
+    have_numpy = False
+
+CSV_FORMAT = 'csv'
+JSONL_FORMAT = 'jsonl'
+FORMATS = (CSV_FORMAT, JSONL_FORMAT)
+
+ID_FIELD = 'id'
+# (record field, converter, RetirementAgeCalculator argument), in the CLI's positional order
+SCENARIO_FIELDS = (
+    ('current_savings', int, 'current_retirement_savings'),
+    ('annual_contribution', int, 'annual_contribution'),
+    ('annual_contrib_increase_rate', float, 'annual_contribution_increase_rate'),
+    ('pre_growth_rate', float, 'pre_retirement_growth_rate'),
+    ('post_growth_rate', float, 'post_retirement_growth_rate'),
+    ('inflation_rate', float, 'inflation_rate'),
+    ('years_to_live', int, 'years_to_live'),
+    ('net_retirement_income', int, 'desired_net_retirement_income_todays_dollars'),
+    ('retirement_tax_rate', float, 'retirement_tax_rate'),
+)
+NET_WORTH_CHANGE_FIELD = 'net_worth_change'
+CONTRIB_CHANGE_FIELD = 'contrib_change'
+RETIREMENT_INCOME_CHANGE_FIELD = 'retirement_income_change'
+CHANGE_ARGUMENTS = ('manual_contrib_changes', 'manual_net_worth_changes', 'manual_retirement_income_changes')
+RESULT_FIELDS = ('row', ID_FIELD, 'years_to_retirement', 'waste', 'error')
+
+CHANGE_SEPARATOR = ';'
+CHANGE_VALUE_SEPARATOR = ':'
+
+DEFAULT_CHUNK_SIZE = 1000
+# Longer horizons than anyone plans for; scenarios are padded to the longest in their batch, so one huge years_to_live
+#  would otherwise make every scenario it's batched with allocate for it
+MAX_YEARS_TO_LIVE = 150
+
+def parse_net_worth_changes(entries, years_to_live):
+    """
+    Dict of years_out -> net worth change from (years_out, value) entries, e.g. as given on the command line
+    """
+    return _parse_changes(entries, years_to_live, 'net worth', int)
+
+def parse_contrib_changes(entries, years_to_live):
+    """
+    Dict of years_out -> (contrib, contrib_rate) from (years_out, contrib, contrib_rate) entries
+    """
+    return _parse_changes(entries, years_to_live, 'contrib', lambda contrib, contrib_rate: (int(contrib), float(contrib_rate)))
+
+def parse_retirement_income_changes(entries, years_to_live):
+    """
+    Dict of years_out -> net retirement income from (years_out, net_income) entries
+    """
+    return _parse_changes(entries, years_to_live, 'retirement income', int)
+
+def _parse_changes(entries, years_to_live, name, convert):
+    # Validate no duplicates, for sanity
+    changes = {}
+    for entry in entries:
+        try:
+            years_out = int(entry[0])
+            change = convert(*entry[1:])
+        except (TypeError, ValueError, IndexError, KeyError):
+            shown = CHANGE_VALUE_SEPARATOR.join(str(value) for value in entry) if isinstance(entry, (list, tuple)) else entry
+            raise ValueError("Invalid %s change '%s'" % (name, shown))
+        if years_out in changes:
+            raise ValueError("Two %s changes defined with the same year '%s'" % (name, years_out))
+        if years_out < 0 or years_out >= years_to_live:
+            raise ValueError("Invalid %s change year '%s'; must be between [0,%s)" % (name, years_out, years_to_live))
+        changes[years_out] = change
+    return changes
+
+def _change_entries(value):
+    """
+    Change entries from a record field: either "years_out:value;..." or a list of lists
+    """
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        return [entry.strip().split(CHANGE_VALUE_SEPARATOR) for entry in value.split(CHANGE_SEPARATOR) if entry.strip()]
+    if not isinstance(value, list):
+        raise ValueError("Expected changes as a list or a '%s'-separated string, got '%s'" % (CHANGE_SEPARATOR, value))
+    return value
+
+def parse_scenario(record):
+    """
+    RetirementAgeCalculator keyword arguments for a record, raising ValueError if it's invalid
+    """
+    if not isinstance(record, dict):
+        raise ValueError("Expected an object with the scenario fields")
+    scenario = {}
+    for field, convert, argument in SCENARIO_FIELDS:
+        value = record.get(field)
+        if value is None or value == '':
+            raise ValueError("Missing field '%s'" % field)
+        try:
+            scenario[argument] = convert(value)
+        except (TypeError, ValueError):
+            raise ValueError("Invalid value '%s' for field '%s'" % (value, field))
+
+    years_to_live = scenario['years_to_live']
+    if years_to_live < 1:
+        raise ValueError("Invalid years to live; are you expecting to die today??")
+    if years_to_live > MAX_YEARS_TO_LIVE:
+        raise ValueError("Invalid years to live '%s'; must be at most %s" % (years_to_live, MAX_YEARS_TO_LIVE))
+    # The calculator divides by (1 - tax rate) and (1 + growth rate), so these would blow up mid-calculation
+    if not 0 <= scenario['retirement_tax_rate'] < 1:
+        raise ValueError("Invalid retirement tax rate '%s'; must be in range [0,1)" % scenario['retirement_tax_rate'])
+    for field, argument in (('pre_growth_rate', 'pre_retirement_growth_rate'), ('post_growth_rate', 'post_retirement_growth_rate'), ('inflation_rate', 'inflation_rate')):
+        if not scenario[argument] > -1:
+            raise ValueError("Invalid value '%s' for field '%s'; must be > -1" % (scenario[argument], field))
+    scenario['manual_net_worth_changes'] = parse_net_worth_changes(_change_entries(record.get(NET_WORTH_CHANGE_FIELD)), years_to_live)
+    scenario['manual_contrib_changes'] = parse_contrib_changes(_change_entries(record.get(CONTRIB_CHANGE_FIELD)), years_to_live)
+    scenario['manual_retirement_income_changes'] = parse_retirement_income_changes(_change_entries(record.get(RETIREMENT_INCOME_CHANGE_FIELD)), years_to_live)
+    return scenario
+
+def _retirement_outcomes(scenarios):
+    """
+    (years_to_retirement, waste) for each of a list of parse_scenario scenarios, both None if you can't retire.
+     Uses the batch calculator whenever numpy is available, even for a single scenario, so an answer doesn't depend
+     on what else happened to be in its batch.
+    """
+    if have_numpy:
+        arguments = {argument: [scenario[argument] for scenario in scenarios] for _, _, argument in SCENARIO_FIELDS}
+        for argument in CHANGE_ARGUMENTS:
+            arguments[argument] = [scenario[argument] for scenario in scenarios]
+        calculator = BatchRetirementAgeCalculator(**arguments)
+        return [
+            (None, None) if years == NEVER_RETIRE else (int(years), float(waste))
+            for years, waste in zip(calculator.get_earliest_retirement(), calculator.get_waste())
+        ]
+    outcomes = []
+    for scenario in scenarios:
+        calculator = RetirementAgeCalculator(**scenario)
+        years = calculator.get_earliest_retirement()
+        outcomes.append((years, calculator.get_waste() if years is not None else None))
+    return outcomes
+
+def _outcome(scenario, years_to_retirement, waste):
+    # Same restriction as the CLI, as the calculator doesn't handle these
+    if years_to_retirement is not None and any(key > years_to_retirement for key in scenario['manual_net_worth_changes']):
+        return _failure("Net worth change after projected retirement, which currently can't be handled")
+    return {'years_to_retirement': years_to_retirement, 'waste': waste, 'error': None}
+
+def _failure(message):
+    return {'years_to_retirement': None, 'waste': None, 'error': message}
+
+def _error_message(error):
+    # ArithmeticErrors are e.g. rates so extreme the numbers overflow; still only their own scenario's problem
+    if isinstance(error, ValueError):
+        return str(error)
+    if isinstance(error, MemoryError):
+        return "Calculation failed: out of memory"
+    return "Calculation failed: %s" % error
+
+def evaluate_scenarios(scenarios):
+    """
+    Result dicts (years_to_retirement, waste and error) for a list of parse_scenario scenarios, evaluated as one
+     batch. If the batch fails (e.g. one scenario's rates overflow, or it doesn't fit in memory), every scenario is
+     evaluated on its own instead, so only the ones at fault get an error.
+    """
+    if len(scenarios) == 0:
+        return []
+    try:
+        outcomes = _retirement_outcomes(scenarios)
+    except (ValueError, ArithmeticError, MemoryError) as error:
+        if len(scenarios) > 1:
+            return [result for scenario in scenarios for result in evaluate_scenarios([scenario])]
+        return [_failure(_error_message(error))]
+    return [_outcome(scenario, years_to_retirement, waste) for scenario, (years_to_retirement, waste) in zip(scenarios, outcomes)]
+
+# Optional ResultCache used by evaluate_record, set per process (pool workers get it through the initializer)
+_cache = None
+
+def _share_cache(cache):
+    global _cache
+    _cache = cache
+
+def _parse_record(row, record, instrumentation):
+    """
+    (result dict with the row and id filled in, parse_scenario scenario or None if the record is invalid, in which
+     case the result has the error)
+    """
+    result = {'row': row, ID_FIELD: None, 'years_to_retirement': None, 'waste': None, 'error': None}
+    try:
+        if isinstance(record, str):
+            try:
+                record = json.loads(record)
+            except ValueError as error:
+                raise ValueError("Invalid JSON: %s" % error)
+        if isinstance(record, dict):
+            result[ID_FIELD] = record.get(ID_FIELD)
+        with instrumentation.stage('parse'):
+            return result, parse_scenario(record)
+    except ValueError as error:
+        result['error'] = str(error)
+        return result, None
+
+def _cached_outcome(scenario, instrumentation):
+    try:
+        with instrumentation.stage('cache_lookup'):
+            years_to_retirement, waste = cached_retirement(_cache, instrumentation=instrumentation, **scenario)
+    except (ValueError, ArithmeticError) as error:
+        return _failure(_error_message(error))
+    return _outcome(scenario, years_to_retirement, waste)
+
+def evaluate_record(row, record, instrumentation=NULL_INSTRUMENTATION):
+    """
+    Result dict for one record: its row number and id, plus either years_to_retirement and waste (both None if you
+     can't retire) or an error message
+    """
+    return _evaluate_chunk([(row, record)], instrumentation)[0]
+
+def _evaluate_chunk(chunk, instrumentation=NULL_INSTRUMENTATION):
+    results = []
+    # (result, scenario) for the records that parsed, which are calculated together
+    valid = []
+    for row, record in chunk:
+        result, scenario = _parse_record(row, record, instrumentation)
+        results.append(result)
+        if scenario is not None:
+            valid.append((result, scenario))
+    if _cache is not None:
+        outcomes = [_cached_outcome(scenario, instrumentation) for _, scenario in valid]
+    else:
+        with instrumentation.stage('batch_calculation'):
+            outcomes = evaluate_scenarios([scenario for _, scenario in valid])
+    for (result, _), outcome in zip(valid, outcomes):
+        result.update(outcome)
+    return results
+
+def _evaluate_chunk_in_worker(chunk, instrumented):
+    # Instrumentation and cache counters can't be shared across processes, so workers record each chunk separately and
+    #  send back the stats, and how much the cache's counters went up
+    instrumentation = Instrumentation() if instrumented else NULL_INSTRUMENTATION
+    before = _cache.counters() if _cache is not None else None
+    results = _evaluate_chunk(chunk, instrumentation)
+    cache_counters = {counter: count - before[counter] for counter, count in _cache.counters().items()} if _cache is not None else None
+    return results, instrumentation.stats(), cache_counters
+
+def read_records(stream, format):
+    """
+    Records from a text stream, lazily: dicts for CSV, lines of JSON (parsed when evaluated, so a bad line only
+     fails its own row) for JSONL. Blank JSONL lines are skipped.
+    """
+    if format == CSV_FORMAT:
+        return csv.DictReader(stream)
+    if format == JSONL_FORMAT:
+        return (line for line in stream if line.strip())
+    raise ValueError("Unknown format '%s'; must be one of %s" % (format, FORMATS))
+
+def evaluate_stream(records, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, cache=None, instrumentation=NULL_INSTRUMENTATION):
+    """
+    Evaluate records (any iterable, consumed lazily) and yield their results in input order, a chunk (list) at a
+     time, with rows numbered from 1. workers > 1 evaluates chunks across that many processes, keeping at most two
+     chunks per worker in flight so memory stays bounded however long the input is.
+    With a ResultCache, repeated scenarios are only calculated once; give it a path to share results between workers.
+     Its counters include the workers' lookups.
+    With an Instrumentation, every calculation's stages are recorded in it, including those run by workers.
+    """
+    if chunk_size < 1:
+        raise ValueError("Chunk size must be >= 1")
+    numbered_records = enumerate(records, 1)
+    chunks = iter(lambda: list(itertools.islice(numbered_records, chunk_size)), [])
+    if workers is None or workers <= 1:
+        _share_cache(cache)
+        try:
+            for chunk in chunks:
+                yield _evaluate_chunk(chunk, instrumentation)
+        finally:
+            _share_cache(None)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_share_cache, initargs=(cache,)) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_evaluate_chunk_in_worker, chunk, instrumentation.enabled))
+            if len(pending) >= 2 * workers:
+                yield _collect(pending.popleft(), cache, instrumentation)
+        while pending:
+            yield _collect(pending.popleft(), cache, instrumentation)
+
+def _collect(future, cache, instrumentation):
+    results, stats, cache_counters = future.result()
+    instrumentation.merge(stats)
+    if cache is not None:
+        cache.merge(cache_counters)
+    return results
+
+def write_results(results, stream, format):
+    """
+    Write chunks of results (as yielded by evaluate_stream) to a text stream, flushing after each chunk so they show
+     up as soon as they're done
+    """
+    if format == CSV_FORMAT:
+        writer = csv.DictWriter(stream, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        write = writer.writerow
+    elif format == JSONL_FORMAT:
+        write = lambda result: stream.write(json.dumps(result) + '\n')
+    else:
+        raise ValueError("Unknown format '%s'; must be one of %s" % (format, FORMATS))
+    for chunk in results:
+        for result in chunk:
+            write(result)
+        stream.flush()
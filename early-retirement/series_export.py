@@ -0,0 +1,143 @@
+"""
+Columnar binary export of the per-year series of many scenarios, for analytics that would rather memory-map arrays
+ than parse the CLI's text tables.
+
+export_series writes a directory with one .npy file per series, each a float64 (scenarios, years) matrix where years
+ is the longest years_to_live, NaN past each scenario's own years_to_live (and throughout ACCOUNT_VALUE and
+ ACTUAL_WITHDRAWALS for scenarios that can't retire). Alongside are one-entry-per-scenario columns: years_to_live,
+ years_to_retirement (NEVER_RETIRE if not possible) and waste (NaN if not possible), plus a manifest.json listing
+ every file with its dtype and shape, written last. The matrices are filled through numpy.lib.format.open_memmap a
+ chunk of scenarios at a time, so exports bigger than memory are fine, and load_series maps them back read-only
+ without reading them in (np.load(path, mmap_mode='r') works on any single file too).
+"""
+
+import json
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from batch_retirement_calculator import BatchRetirementAgeCalculator
+from retirement_age_calculator import Series
+from scenario_stream import SCENARIO_FIELDS
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+DEFAULT_CHUNK_SIZE = 1000
+
+YEARS_TO_LIVE_COLUMN = 'years_to_live'
+YEARS_TO_RETIREMENT_COLUMN = 'years_to_retirement'
+WASTE_COLUMN = 'waste'
+# (column, dtype) for the one-entry-per-scenario files
+COLUMNS = (
+    (YEARS_TO_LIVE_COLUMN, np.int64),
+    (YEARS_TO_RETIREMENT_COLUMN, np.int64),
+    (WASTE_COLUMN, np.float64),
+)
+SCENARIO_ARGUMENTS = tuple(argument for _, _, argument in SCENARIO_FIELDS)
+CHANGE_ARGUMENTS = ('manual_contrib_changes', 'manual_net_worth_changes', 'manual_retirement_income_changes')
+
+def _file_name(name):
+    return '%s.npy' % name.lower()
+
+def _batch_arguments(scenarios, offset):
+    arguments = {}
+    for argument in SCENARIO_ARGUMENTS:
+        values = []
+        for row, scenario in enumerate(scenarios, offset):
+            if argument not in scenario:
+                raise ValueError("Scenario %s is missing '%s'" % (row, argument))
+            values.append(scenario[argument])
+        arguments[argument] = values
+    for argument in CHANGE_ARGUMENTS:
+        arguments[argument] = [scenario.get(argument) for scenario in scenarios]
+    return arguments
+
+def export_series(directory, scenarios, series=None, chunk_size=DEFAULT_CHUNK_SIZE, ids=None, rows=None):
+    """
+    Calculate every scenario (a dict of RetirementAgeCalculator keyword arguments, e.g. from
+     scenario_stream.parse_scenario) and write the given series (all of them by default) to directory, which is
+     created if needed. ids and rows (e.g. the input row each scenario came from, when some were skipped), if given,
+     are stored in the manifest, one per scenario. Returns the manifest.
+    """
+    if chunk_size < 1:
+        raise ValueError("Chunk size must be >= 1")
+    if len(scenarios) == 0:
+        raise ValueError("At least one scenario is required")
+    if ids is not None and len(ids) != len(scenarios):
+        raise ValueError("Expected %s ids, one per scenario, but got %s" % (len(scenarios), len(ids)))
+    if rows is not None and len(rows) != len(scenarios):
+        raise ValueError("Expected %s rows, one per scenario, but got %s" % (len(scenarios), len(rows)))
+    series = list(Series) if series is None else list(series)
+    years_to_live = np.array([scenario.get('years_to_live', 0) for scenario in scenarios], dtype=np.int64)
+    if np.any(years_to_live < 1):
+        raise ValueError("Years to live must be >= 1")
+    num_scenarios = len(scenarios)
+    num_years = int(years_to_live.max())
+
+    os.makedirs(directory, exist_ok=True)
+    # Written fresh each time, so a manifest left over from an earlier export doesn't describe half-written files
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    matrices = {
+        one_series.name: open_memmap(os.path.join(directory, _file_name(one_series.name)), mode='w+', dtype=np.float64, shape=(num_scenarios, num_years))
+        for one_series in series
+    }
+    columns = {
+        column: open_memmap(os.path.join(directory, _file_name(column)), mode='w+', dtype=dtype, shape=(num_scenarios,))
+        for column, dtype in COLUMNS
+    }
+    columns[YEARS_TO_LIVE_COLUMN][:] = years_to_live
+    for start in range(0, num_scenarios, chunk_size):
+        chunk = scenarios[start:start + chunk_size]
+        stop = start + len(chunk)
+        calculator = BatchRetirementAgeCalculator(keep_series=True, **_batch_arguments(chunk, start))
+        for one_series in series:
+            data = calculator.get_series_data(one_series)
+            matrix = matrices[one_series.name]
+            matrix[start:stop, :data.shape[1]] = data
+            matrix[start:stop, data.shape[1]:] = np.nan
+        columns[YEARS_TO_RETIREMENT_COLUMN][start:stop] = calculator.get_earliest_retirement()
+        columns[WASTE_COLUMN][start:stop] = calculator.get_waste()
+
+    files = {}
+    for name, array in list(matrices.items()) + list(columns.items()):
+        array.flush()
+        files[name] = {'file': _file_name(name), 'dtype': array.dtype.str, 'shape': list(array.shape)}
+    del matrices, columns
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'num_scenarios': num_scenarios,
+        'num_years': num_years,
+        'series': [one_series.name for one_series in series],
+        'columns': [column for column, _ in COLUMNS],
+        'files': files,
+        'ids': list(ids) if ids is not None else None,
+        'rows': list(rows) if rows is not None else None,
+    }
+    temporary_path = manifest_path + '.tmp'
+    with open(temporary_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(temporary_path, manifest_path)
+    return manifest
+
+def load_series(directory):
+    """
+    (manifest, arrays) for an export_series directory, where arrays maps each series name (e.g. 'NO_RETIREMENT') and
+     column to a read-only memory-mapped array
+    """
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        raise ValueError("No %s in '%s'; is it a complete series export?" % (MANIFEST_FILE, directory))
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError("Unsupported series export version '%s'" % manifest.get('version'))
+    arrays = {
+        name: np.load(os.path.join(directory, entry['file']), mmap_mode='r')
+        for name, entry in manifest['files'].items()
+    }
+    return manifest, arrays
@@ -0,0 +1,520 @@
+"""
+Tax-aware counterpart to RetirementAgeCalculator, with savings split across account types and retirement income
+ taxed by brackets instead of a single flat rate:
+ - taxable: after-tax money with a cost basis; the gains part of each withdrawal (in proportion to the balance) pays
+   a flat capital gains tax, and growth adds to the gains
+ - deferred (traditional 401k/IRA): withdrawals are ordinary income, taxed by the TaxBrackets
+ - roth: after-tax money, never taxed again
+Every retired year, a withdrawal policy decides how much ordinary income to take out of the deferred account (anything
+ beyond that year's spending is a Roth conversion) and which of the taxable and Roth accounts covers the rest first.
+ If both run dry, more comes out of the deferred account.
+
+Everything is worked out in today's dollars (brackets are assumed to be inflation indexed), with real growth rates,
+ and the series are converted back to nominal dollars like RetirementAgeCalculator's.
+
+Finding the best ordinary income for every year by trying every sequence of choices explodes with the horizon, so
+ it's done with dynamic programming instead. Going backwards from death, for every deferred balance on a grid, it
+ works out the least taxable + Roth money (valued after the gains tax of selling it) that's still enough to fund
+ every remaining year, choosing each year's ordinary income from a few candidate levels: none, the top of each tax
+ bracket, exactly enough to cover spending, and everything. More of that money never hurts, so the least amount says
+ everything a table over every combination of balances would, at the cost of the other dimensions. Balances in
+ between grid points are interpolated, and the bracket arithmetic is memoized, as the same few incomes come up every
+ year.
+
+The policies searched are the ordinary incomes the dynamic programming picks, plus fixed yearly ordinary incomes
+ (none, filling each bracket, or exactly covering spending), each with either the taxable or the Roth account drawn
+ first. The earliest retirement is the first year in which one of them, simulated exactly, funds every year after.
+ Being able to retire isn't monotone in the year (e.g. a net worth change can take away money a plan retiring before
+ it never needed, and brackets and gains tax can make a bigger balance cost more), so the years are tried in order,
+ skipping those whose savings couldn't cover the spending even if there were no tax at all. The objective picks which
+ of the policies that work to follow from then on:
+ - EARLIEST_RETIREMENT: one with the dynamic programming's ordinary incomes (each year the least of them that still
+   leaves a fundable plan, so tax is put off), needing the least savings
+ - LEAST_TAX: whichever pays the least tax over retirement, counting the tax still due on what's left at death
+"""
+
+from bisect import bisect_right
+from functools import lru_cache
+
+import numpy as np
+
+from retirement_age_calculator import ContributionFunction, RetirementWithdrawalsFunction, Series
+
+DEFAULT_GRID_SIZE = 2048
+# Bound on the incomes TaxBrackets remembers the tax of
+TAX_CACHE_SIZE = 4096
+# Shortfalls smaller than a cent are float noise on plans that are exactly tight
+SHORTFALL_TOLERANCE = 0.01
+
+EARLIEST_RETIREMENT = 'earliest_retirement'
+LEAST_TAX = 'least_tax'
+OBJECTIVES = (EARLIEST_RETIREMENT, LEAST_TAX)
+
+# Policies are (ordinary income, liquid order), where the ordinary income is one of these or a fixed yearly amount
+SEARCHED_INCOME = 'searched'
+COVER_SPENDING = 'cover_spending'
+TAXABLE_FIRST = 'taxable_first'
+ROTH_FIRST = 'roth_first'
+LIQUID_ORDERS = (TAXABLE_FIRST, ROTH_FIRST)
+
+# Names for get_account_data
+DEFERRED_ACCOUNT = 'deferred'
+TAXABLE_ACCOUNT = 'taxable'
+ROTH_ACCOUNT = 'roth'
+ORDINARY_INCOME = 'ordinary_income'
+TAXES = 'taxes'
+ACCOUNT_DATA = (DEFERRED_ACCOUNT, TAXABLE_ACCOUNT, ROTH_ACCOUNT, ORDINARY_INCOME, TAXES)
+
+class TaxBrackets:
+    """
+    Progressive income tax, in today's dollars: rates[k] applies to taxable income between thresholds[k] and
+     thresholds[k + 1] (the last rate to everything above), where taxable income is income less the standard
+     deduction. thresholds must start at 0 and increase.
+    """
+    def __init__(self, thresholds, rates, deduction=0):
+        if len(thresholds) == 0 or len(thresholds) != len(rates):
+            raise ValueError("Expected one rate per bracket threshold")
+        if thresholds[0] != 0 or any(upper <= lower for lower, upper in zip(thresholds, thresholds[1:])):
+            raise ValueError("Bracket thresholds must start at 0 and increase")
+        if any(rate < 0 or rate >= 1 for rate in rates):
+            raise ValueError("Tax rates must be in range [0,1)")
+        if deduction < 0:
+            raise ValueError("Deduction must be >= 0")
+
+        # Brackets over gross income, with the deduction as a 0% bracket of its own
+        self.starts = [deduction + threshold for threshold in thresholds]
+        self.rates = list(rates)
+        if deduction > 0:
+            self.starts.insert(0, 0)
+            self.rates.insert(0, 0.0)
+        # Tax owed, and income left after tax, at the start of each bracket
+        self.taxes_at_starts = [0.0]
+        for k in range(1, len(self.starts)):
+            self.taxes_at_starts.append(self.taxes_at_starts[k - 1] + self.rates[k - 1] * (self.starts[k] - self.starts[k - 1]))
+        self.net_at_starts = [start - tax for start, tax in zip(self.starts, self.taxes_at_starts)]
+        # Memoized per instance, and bounded, as the incomes can be any floats
+        self.tax = lru_cache(maxsize=TAX_CACHE_SIZE)(self._tax)
+        self.gross_up = lru_cache(maxsize=TAX_CACHE_SIZE)(self._gross_up)
+
+    @classmethod
+    def flat(cls, rate):
+        """
+        A single rate on all income, like RetirementAgeCalculator's retirement_tax_rate
+        """
+        return cls([0], [rate])
+
+    def bracket_tops(self):
+        """
+        Gross incomes at which each bracket but the last one fills up
+        """
+        return self.starts[1:]
+
+    def _tax(self, income):
+        """
+        Tax owed on a gross income
+        """
+        k = max(0, bisect_right(self.starts, income) - 1)
+        return self.taxes_at_starts[k] + self.rates[k] * max(0, income - self.starts[k])
+
+    def tax_array(self, incomes):
+        """
+        tax for every entry of an array of gross incomes
+        """
+        incomes = np.asarray(incomes, dtype=float)
+        # The tax is piecewise linear between bracket starts, continuing at the top rate past the last one
+        return np.interp(incomes, self.starts, self.taxes_at_starts) + self.rates[-1] * np.maximum(0, incomes - self.starts[-1])
+
+    def net(self, income):
+        """
+        Income left after tax on a gross income
+        """
+        return income - self.tax(income)
+
+    def _gross_up(self, net_income):
+        """
+        Gross income that leaves net_income after tax
+        """
+        k = max(0, bisect_right(self.net_at_starts, net_income) - 1)
+        return self.starts[k] + max(0, net_income - self.net_at_starts[k]) / (1 - self.rates[k])
+
+def _real_rate(rate, inflation_rate):
+    return (1 + rate) / (1 + inflation_rate) - 1
+
+class TaxAwareRetirementCalculator:
+    """
+    Same interface as RetirementAgeCalculator, with the savings split into current_taxable_savings (with
+     current_taxable_basis, all of it by default), current_deferred_savings and current_roth_savings, and the flat
+     retirement_tax_rate replaced by tax_brackets, a TaxBrackets, and capital_gains_tax_rate. deferred_contribution_share
+     and roth_contribution_share of every contribution go to those accounts, the rest to the taxable account. Manual
+     net worth changes go to (or come out of) the taxable account. objective is one of OBJECTIVES, and grid_size is
+     the number of deferred balances the search works on; more is more precise but slower.
+
+    Waste is what's left in the accounts at death, before tax, like RetirementAgeCalculator's; get_after_tax_waste
+     takes off the tax that would still be due on it.
+    """
+    def __init__(self,
+            current_taxable_savings,
+            current_deferred_savings,
+            current_roth_savings,
+            annual_contribution,
+            annual_contribution_increase_rate,
+            deferred_contribution_share,
+            pre_retirement_growth_rate,
+            post_retirement_growth_rate,
+            inflation_rate,
+            years_to_live,
+            desired_net_retirement_income_todays_dollars,
+            tax_brackets,
+            manual_contrib_changes=None,
+            manual_net_worth_changes=None,
+            manual_retirement_income_changes=None,
+            roth_contribution_share=0,
+            current_taxable_basis=None,
+            capital_gains_tax_rate=0,
+            objective=EARLIEST_RETIREMENT,
+            grid_size=DEFAULT_GRID_SIZE):
+        manual_contrib_changes = manual_contrib_changes if manual_contrib_changes is not None else {}
+        manual_net_worth_changes = manual_net_worth_changes if manual_net_worth_changes is not None else {}
+        manual_retirement_income_changes = manual_retirement_income_changes if manual_retirement_income_changes is not None else {}
+        current_taxable_basis = current_taxable_basis if current_taxable_basis is not None else current_taxable_savings
+
+        if years_to_live < 1:
+            raise ValueError("Years to live must be >= 1")
+        for name, changes in (('contrib', manual_contrib_changes), ('net worth', manual_net_worth_changes), ('retirement income', manual_retirement_income_changes)):
+            for years_out in changes.keys():
+                if years_out < 0 or years_out >= years_to_live:
+                    raise ValueError("Invalid %s change year '%s'; must be in range [0,%s)" % (name, years_out, years_to_live))
+        if min(current_taxable_savings, current_taxable_basis, current_deferred_savings, current_roth_savings) < 0:
+            raise ValueError("Account balances and basis must be >= 0")
+        if min(deferred_contribution_share, roth_contribution_share) < 0 or deferred_contribution_share + roth_contribution_share > 1:
+            raise ValueError("Deferred and Roth contribution shares must be >= 0 and add up to at most 1")
+        if capital_gains_tax_rate < 0 or capital_gains_tax_rate >= 1:
+            raise ValueError("Capital gains tax rate must be in range [0,1)")
+        if objective not in OBJECTIVES:
+            raise ValueError("Unknown objective '%s'; must be one of %s" % (objective, OBJECTIVES))
+        if grid_size < 2:
+            raise ValueError("Grid size must be >= 2")
+
+        self.years_to_live = years_to_live
+        self.tax_brackets = tax_brackets
+        self.capital_gains_tax_rate = capital_gains_tax_rate
+        self.objective = objective
+        # Converts today's dollars to nominal dollars in each year
+        self.inflation = (1 + inflation_rate) ** np.arange(years_to_live)
+        self.inflation_growth = 1 + inflation_rate
+        self.pre_retirement_growth = 1 + _real_rate(pre_retirement_growth_rate, inflation_rate)
+        self.post_retirement_growth = 1 + _real_rate(post_retirement_growth_rate, inflation_rate)
+
+        # Net income wanted in each year, in today's dollars (the existing withdrawals function, untaxed and uninflated)
+        self.spending = np.array(RetirementWithdrawalsFunction(years_to_live, desired_net_retirement_income_todays_dollars, 0, 0, manual_retirement_income_changes).data())
+        self.contributions = np.array(ContributionFunction(years_to_live, manual_contrib_changes, annual_contribution, annual_contribution_increase_rate).data())
+
+        # Balances (and the taxable basis) if you never retire, in today's dollars. The basis is fixed in nominal
+        #  dollars, so in today's dollars inflation wears it down
+        self.no_retirement = {name: np.empty(years_to_live) for name in (DEFERRED_ACCOUNT, TAXABLE_ACCOUNT, ROTH_ACCOUNT)}
+        self.no_retirement_basis = np.empty(years_to_live)
+        deferred, taxable, roth, basis = current_deferred_savings, current_taxable_savings, current_roth_savings, current_taxable_basis
+        taxable_contribution_share = 1 - deferred_contribution_share - roth_contribution_share
+        for i in range(0, years_to_live):
+            if i > 0:
+                # Last year's contribution goes in after growth, so it's in this year's dollars
+                contribution = self.contributions[i - 1] / self.inflation[i]
+                deferred = deferred * self.pre_retirement_growth + contribution * deferred_contribution_share
+                roth = roth * self.pre_retirement_growth + contribution * roth_contribution_share
+                taxable = taxable * self.pre_retirement_growth + contribution * taxable_contribution_share
+                basis = basis / self.inflation_growth + contribution * taxable_contribution_share
+            change = manual_net_worth_changes.get(i, 0) / self.inflation[i]
+            if change >= 0:
+                taxable, basis = taxable + change, basis + change
+            else:
+                # Sold in proportion, like a withdrawal
+                remaining = max(0, taxable + change)
+                basis = basis * remaining / taxable if taxable > 0 else 0
+                taxable = remaining
+            self.no_retirement[DEFERRED_ACCOUNT][i] = deferred
+            self.no_retirement[TAXABLE_ACCOUNT][i] = taxable
+            self.no_retirement[ROTH_ACCOUNT][i] = roth
+            self.no_retirement_basis[i] = basis
+
+        # Deferred balances to search over in each year, up to the most you could have by then: retiring with what
+        #  you'd have in some earlier year and letting it grow. The grids are denser at the low end, where the
+        #  brackets make the most difference
+        tops = np.empty(years_to_live)
+        top = 0.0
+        for i in range(0, years_to_live):
+            top = max(top * max(1.0, self.post_retirement_growth), self.no_retirement[DEFERRED_ACCOUNT][i], 1.0)
+            tops[i] = top
+        self.grids = tops[:, np.newaxis] * np.linspace(0, 1, grid_size) ** 2
+        self.grid_taxes = tax_brackets.tax_array(self.grids)
+        self._search()
+
+        self.years_to_retirement = self._find_retirement()
+        self.policy = None
+        self.retired = None
+        if self.years_to_retirement is not None:
+            self.policy, self.retired = self._choose_policy(self.years_to_retirement)
+
+    # ========================== Search ===========================================================
+
+    def _income_levels(self, year):
+        """
+        Candidate ordinary incomes for a year: none, the top of each bracket and exactly enough to cover spending
+         (everything in the deferred account is a candidate too, and every level is capped at it)
+        """
+        return [0.0] + self.tax_brackets.bracket_tops() + [self.tax_brackets.gross_up(float(self.spending[year]))]
+
+    def _min_liquid(self, years, deferred):
+        """
+        Least taxable + Roth money needed at the start of each of the given years for each of the given deferred
+         balances
+        """
+        rows = np.atleast_1d(years)
+        deferred = np.atleast_1d(deferred)
+        return np.maximum(0, [np.interp(balance, self.grids[year], self.min_liquid[year]) for year, balance in zip(rows, deferred)])
+
+    def _liquid_needed(self, year, deferred, incomes, taxes):
+        """
+        Taxable + Roth money needed at the start of the year with the given deferred balances, taking the given
+         ordinary incomes (and paying the given taxes on them) and then needing the least from next year on
+        """
+        needed = self.spending[year] - (incomes - taxes)
+        if year + 1 < self.years_to_live:
+            next_deferred = (deferred - incomes) * self.post_retirement_growth
+            needed = needed + np.maximum(0, np.interp(next_deferred, self.grids[year + 1], self.min_liquid[year + 1])) / self.post_retirement_growth
+        return needed
+
+    def _search(self):
+        """
+        Fill in min_liquid, the least taxable + Roth money needed at the start of every year for every deferred
+         balance on the grid, backwards from the last year. It's kept negative where the deferred account alone is
+         more than enough (and clipped at 0 when read), so interpolating near where it reaches 0, which is where
+         plans are tight, is as accurate as anywhere else
+        """
+        self.min_liquid = np.zeros(self.grids.shape)
+        for year in range(self.years_to_live - 1, -1, -1):
+            grid = self.grids[year]
+            grid_taxes = self.grid_taxes[year]
+            # Each candidate level capped at the deferred balance, plus taking all of it
+            options = []
+            for level in self._income_levels(year):
+                incomes = np.minimum(level, grid)
+                taxes = np.where(grid < level, grid_taxes, self.tax_brackets.tax(level))
+                options.append(self._liquid_needed(year, grid, incomes, taxes))
+            options.append(self._liquid_needed(year, grid, grid, grid_taxes))
+            self.min_liquid[year] = np.min(options, axis=0)
+
+    def _searched_income(self, year, deferred, liquid):
+        """
+        Ordinary income for the year, out of the candidates: the least that the given taxable + Roth money (valued
+         after gains tax) still covers the rest of, deferring the tax, or else the one that needs the least of it
+        """
+        incomes = np.array([min(level, deferred) for level in self._income_levels(year)] + [deferred])
+        taxes = np.array([self.tax_brackets.tax(income) for income in incomes])
+        needed = self._liquid_needed(year, deferred, incomes, taxes)
+        covered = needed <= liquid + SHORTFALL_TOLERANCE
+        if covered.any():
+            return float(incomes[covered].min())
+        return float(incomes[np.argmin(needed)])
+
+    def _after_gains_tax(self, taxable, basis):
+        return taxable - self.capital_gains_tax_rate * max(0, taxable - basis)
+
+    # ========================== Policies ===========================================================
+
+    def _policies(self):
+        """
+        Every policy searched, the ones with the searched ordinary incomes first
+        """
+        incomes = [SEARCHED_INCOME, COVER_SPENDING, 0.0] + self.tax_brackets.bracket_tops()
+        return [(income, order) for income in incomes for order in LIQUID_ORDERS]
+
+    def _simulate(self, retirement, policy):
+        """
+        Balances, ordinary income and taxes for every year (in today's dollars) retiring at the given year and
+         following the given policy, plus what's left at death and the tax still due on it, or None if the policy
+         runs out of money
+        """
+        income_rule, liquid_order = policy
+        gains_tax_rate = self.capital_gains_tax_rate
+        balances = {name: self.no_retirement[name].copy() for name in self.no_retirement}
+        incomes = np.zeros(self.years_to_live)
+        taxes = np.zeros(self.years_to_live)
+        deferred = balances[DEFERRED_ACCOUNT][retirement]
+        taxable = balances[TAXABLE_ACCOUNT][retirement]
+        roth = balances[ROTH_ACCOUNT][retirement]
+        basis = self.no_retirement_basis[retirement]
+        income = 0.0
+        for year in range(retirement, self.years_to_live):
+            balances[DEFERRED_ACCOUNT][year] = deferred
+            balances[TAXABLE_ACCOUNT][year] = taxable
+            balances[ROTH_ACCOUNT][year] = roth
+            spending = self.spending[year]
+            if income_rule == SEARCHED_INCOME:
+                income = self._searched_income(year, deferred, roth + self._after_gains_tax(taxable, basis))
+            elif income_rule == COVER_SPENDING:
+                income = min(deferred, self.tax_brackets.gross_up(float(spending)))
+            else:
+                income = min(deferred, income_rule)
+            needed = spending - self.tax_brackets.net(income)
+            gains_tax = 0.0
+            if needed < 0:
+                # Ordinary income beyond spending is a Roth conversion
+                roth -= needed
+                needed = 0.0
+            for account in ((TAXABLE_ACCOUNT, ROTH_ACCOUNT) if liquid_order == TAXABLE_FIRST else (ROTH_ACCOUNT, TAXABLE_ACCOUNT)):
+                if needed <= 0:
+                    break
+                if account == TAXABLE_ACCOUNT and taxable > 0:
+                    gains_share = gains_tax_rate * max(0, 1 - basis / taxable)
+                    withdrawal = min(taxable, needed / (1 - gains_share))
+                    basis -= basis * withdrawal / taxable
+                    taxable -= withdrawal
+                    gains_tax += withdrawal * gains_share
+                    needed -= withdrawal * (1 - gains_share)
+                elif account == ROTH_ACCOUNT:
+                    withdrawal = min(roth, needed)
+                    roth -= withdrawal
+                    needed -= withdrawal
+            if needed > 0:
+                # Taxable and Roth money ran out, so the rest has to come out of the deferred account too
+                more_income = min(deferred, self.tax_brackets.gross_up(float(self.tax_brackets.net(income) + needed)))
+                needed -= self.tax_brackets.net(more_income) - self.tax_brackets.net(income)
+                income = more_income
+                if needed > SHORTFALL_TOLERANCE:
+                    return None
+            incomes[year] = income
+            taxes[year] = self.tax_brackets.tax(income) + gains_tax
+            deferred -= income
+            if year + 1 < self.years_to_live:
+                deferred *= self.post_retirement_growth
+                taxable *= self.post_retirement_growth
+                roth *= self.post_retirement_growth
+                basis /= self.inflation_growth
+
+        # The deferred money as if it all came out on top of the last year's income, and the taxable money sold
+        tax_due = self.tax_brackets.tax(income + deferred) - self.tax_brackets.tax(income) + (taxable - self._after_gains_tax(taxable, basis))
+        result = dict(balances)
+        result[ORDINARY_INCOME] = incomes
+        result[TAXES] = taxes
+        result['left'] = deferred + taxable + roth
+        result['tax_due'] = tax_due
+        result['total_tax'] = taxes.sum() + tax_due
+        return result
+
+    def _can_retire(self, year):
+        return any(self._simulate(year, policy) is not None for policy in self._policies())
+
+    def _find_retirement(self):
+        """
+        First year some policy funds every year after, or None if there isn't one. Every year is tried, in order,
+         except those that fail a necessary condition: every account grows at the same rate once retired and tax only
+         takes money away, so the total savings have to be at least the present value of the spending left
+        """
+        present_value = np.empty(self.years_to_live)
+        later = 0.0
+        for year in range(self.years_to_live - 1, -1, -1):
+            later = self.spending[year] + later / self.post_retirement_growth
+            present_value[year] = later
+        total = sum(self.no_retirement.values())
+        # Allowing for the shortfall tolerance each year and float noise, so no year that works is skipped
+        slack = SHORTFALL_TOLERANCE * (self.years_to_live - np.arange(self.years_to_live)) + 1e-9 * present_value
+        for year in np.flatnonzero(total + slack >= present_value):
+            if self._can_retire(int(year)):
+                return int(year)
+        return None
+
+    def _choose_policy(self, retirement):
+        """
+        (policy, simulation) to follow retiring at the given year, for the objective
+        """
+        working = []
+        for policy in self._policies():
+            simulation = self._simulate(retirement, policy)
+            if simulation is not None:
+                working.append((policy, simulation))
+        if self.objective == EARLIEST_RETIREMENT:
+            searched = [(policy, simulation) for policy, simulation in working if policy[0] == SEARCHED_INCOME]
+            working = searched or working
+        return min(working, key=lambda policy_simulation: policy_simulation[1]['total_tax'])
+
+    # ========================== Results ===========================================================
+
+    def get_earliest_retirement(self):
+        """
+        Get the smallest number of years after which you'll be able to retire, or None if not possible
+        """
+        return self.years_to_retirement
+
+    def get_waste(self):
+        """
+        Dollars you'd die with, before tax (or None if you never get to retire)
+        """
+        if self.retired is None:
+            return None
+        return self.retired['left'] * self.inflation[-1]
+
+    def get_after_tax_waste(self):
+        """
+        Dollars you'd die with, after the tax on withdrawing the deferred money and selling the taxable money (or None
+         if you never get to retire)
+        """
+        if self.retired is None:
+            return None
+        return (self.retired['left'] - self.retired['tax_due']) * self.inflation[-1]
+
+    def get_total_tax(self):
+        """
+        Tax paid over retirement plus the tax still due at death, in today's dollars (or None if you never get to
+         retire)
+        """
+        if self.retired is None:
+            return None
+        return float(self.retired['total_tax'])
+
+    def get_policy(self):
+        """
+        (ordinary income, liquid order) followed once retired, or None if you never get to retire: the ordinary income
+         is SEARCHED_INCOME, COVER_SPENDING or a fixed yearly amount in today's dollars, and the liquid order is one of
+         LIQUID_ORDERS
+        """
+        return self.policy
+
+    def get_series_data(self, series):
+        """
+        Same series as RetirementAgeCalculator, in nominal dollars, with balances summed over accounts:
+         ALL_WITHDRAWALS is the net income wanted (the tax on it depends on which account it comes from),
+         ACTUAL_WITHDRAWALS is what actually leaves the accounts once retired, taxes included, and
+         MIN_RETIREMENT_WORTH is the search's estimate of the least total worth you could retire with, given the
+         deferred balance you'd have. ACCOUNT_VALUE and ACTUAL_WITHDRAWALS only exist if you can retire.
+        """
+        if series == Series.ALL_WITHDRAWALS:
+            data = self.spending * self.inflation
+        elif series == Series.CONTRIBUTIONS:
+            data = self.contributions
+        elif series == Series.NO_RETIREMENT:
+            data = sum(self.no_retirement.values()) * self.inflation
+        elif series == Series.MIN_RETIREMENT_WORTH:
+            min_liquid = self._min_liquid(np.arange(self.years_to_live), self.no_retirement[DEFERRED_ACCOUNT])
+            data = (self.no_retirement[DEFERRED_ACCOUNT] + min_liquid) * self.inflation
+        elif self.retired is None:
+            raise ValueError("No %s series, as you can't retire with these parameters" % series.name)
+        elif series == Series.ACCOUNT_VALUE:
+            data = (self.retired[DEFERRED_ACCOUNT] + self.retired[TAXABLE_ACCOUNT] + self.retired[ROTH_ACCOUNT]) * self.inflation
+        else:
+            retired = np.arange(self.years_to_live) >= self.years_to_retirement
+            data = np.where(retired, self.spending + self.retired[TAXES], 0.0) * self.inflation
+        return data.tolist()
+
+    def get_account_data(self, name):
+        """
+        Per-year nominal values of one of ACCOUNT_DATA: an account's balance at the start of the year, or the
+         ordinary income taken from the deferred account and the tax paid (on it and on taxable gains). Balances
+         follow the no-retirement path until retirement; if you can't retire there's no income or taxes.
+        """
+        if name not in ACCOUNT_DATA:
+            raise ValueError("Unknown account data '%s'; must be one of %s" % (name, ACCOUNT_DATA))
+        if self.retired is not None:
+            return (self.retired[name] * self.inflation).tolist()
+        if name in self.no_retirement:
+            return (self.no_retirement[name] * self.inflation).tolist()
+        return [0.0] * self.years_to_live
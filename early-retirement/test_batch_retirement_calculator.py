@@ -0,0 +1,65 @@
+"""
+Regression tests for batch_retirement_calculator; run from this directory with
+ python -m unittest test_batch_retirement_calculator (or pytest)
+"""
+
+import random
+import unittest
+
+import numpy as np
+
+from batch_retirement_calculator import NEVER_RETIRE, BatchRetirementAgeCalculator
+from retirement_age_calculator import RetirementAgeCalculator, Series
+
+RETIRED_SERIES = (Series.ACCOUNT_VALUE, Series.ACTUAL_WITHDRAWALS)
+
+def _random_scenario(rng):
+    years_to_live = rng.randrange(1, 90)
+    return {
+        'current_retirement_savings': rng.randrange(0, 1000000),
+        'annual_contribution': rng.randrange(0, 80000),
+        'annual_contribution_increase_rate': round(rng.uniform(-0.02, 0.06), 4),
+        'pre_retirement_growth_rate': round(rng.uniform(-0.02, 0.12), 4),
+        'post_retirement_growth_rate': round(rng.uniform(-0.02, 0.08), 4),
+        'inflation_rate': round(rng.uniform(0, 0.06), 4),
+        'years_to_live': years_to_live,
+        'desired_net_retirement_income_todays_dollars': rng.randrange(0, 150000),
+        'retirement_tax_rate': round(rng.uniform(0, 0.5), 4),
+        'manual_contrib_changes': {rng.randrange(years_to_live): (rng.randrange(0, 80000), round(rng.uniform(0, 0.05), 4)) for _ in range(rng.randrange(3))},
+        'manual_net_worth_changes': {rng.randrange(years_to_live): rng.randrange(-300000, 300000) for _ in range(rng.randrange(3))},
+        'manual_retirement_income_changes': {rng.randrange(years_to_live): rng.randrange(0, 150000) for _ in range(rng.randrange(3))},
+    }
+
+class ScalarEquivalenceTest(unittest.TestCase):
+    """
+    Every scenario in a batch gets bit-for-bit the same results as its own RetirementAgeCalculator, whatever else is
+     in the batch
+    """
+    def test_matches_scalar_calculator(self):
+        rng = random.Random(1)
+        scenarios = [_random_scenario(rng) for _ in range(300)]
+        arguments = {argument: [scenario[argument] for scenario in scenarios] for argument in scenarios[0]}
+        batch = BatchRetirementAgeCalculator(keep_series=True, **arguments)
+
+        retired = 0
+        for row, scenario in enumerate(scenarios):
+            scalar = RetirementAgeCalculator(**scenario)
+            years_to_retirement = scalar.get_earliest_retirement()
+            years_to_live = scenario['years_to_live']
+            if years_to_retirement is None:
+                self.assertEqual(batch.get_earliest_retirement()[row], NEVER_RETIRE, row)
+                self.assertTrue(np.isnan(batch.get_waste()[row]), row)
+            else:
+                retired += 1
+                self.assertEqual(batch.get_earliest_retirement()[row], years_to_retirement, row)
+                self.assertEqual(batch.get_waste()[row], scalar.get_waste(), row)
+            for series in Series:
+                if years_to_retirement is None and series in RETIRED_SERIES:
+                    continue
+                self.assertEqual(batch.get_series_data(series)[row, :years_to_live].tolist(), [float(value) for value in scalar.get_series_data(series)], (row, series))
+        # Both outcomes are covered
+        self.assertGreater(retired, 0)
+        self.assertGreater(len(scenarios) - retired, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+"""
+Regression tests for incremental_retirement_calculator; run from this directory with
+ python -m unittest test_incremental_retirement_calculator (or pytest)
+"""
+
+import random
+import unittest
+
+from incremental_retirement_calculator import IncrementalRetirementCalculator
+from retirement_age_calculator import RetirementAgeCalculator, Series
+
+RETIRED_SERIES = (Series.ACCOUNT_VALUE, Series.ACTUAL_WITHDRAWALS)
+# Scalar inputs and a random value for each
+INPUTS = {
+    'current_retirement_savings': lambda rng: rng.randrange(0, 1000000),
+    'annual_contribution': lambda rng: rng.randrange(0, 80000),
+    'annual_contribution_increase_rate': lambda rng: round(rng.uniform(-0.02, 0.06), 4),
+    'pre_retirement_growth_rate': lambda rng: round(rng.uniform(-0.02, 0.12), 4),
+    'post_retirement_growth_rate': lambda rng: round(rng.uniform(-0.02, 0.08), 4),
+    'inflation_rate': lambda rng: round(rng.uniform(0, 0.06), 4),
+    'desired_net_retirement_income_todays_dollars': lambda rng: rng.randrange(0, 150000),
+    'retirement_tax_rate': lambda rng: round(rng.uniform(0, 0.5), 4),
+}
+# (changes attribute, set, remove, move, random change value)
+CHANGES = (
+    ('manual_contrib_changes', 'set_contrib_change', 'remove_contrib_change', 'move_contrib_change', lambda rng: (rng.randrange(0, 80000), round(rng.uniform(0, 0.05), 4))),
+    ('manual_net_worth_changes', 'set_net_worth_change', 'remove_net_worth_change', 'move_net_worth_change', lambda rng: (rng.randrange(-300000, 300000),)),
+    ('manual_retirement_income_changes', 'set_retirement_income_change', 'remove_retirement_income_change', 'move_retirement_income_change', lambda rng: (rng.randrange(0, 150000),)),
+)
+
+def _random_edit(rng, calculator):
+    """
+    Make one random, valid edit to calculator
+    """
+    if rng.random() < 0.2:
+        name = rng.choice(list(INPUTS) + ['years_to_live'])
+        if name == 'years_to_live':
+            # Longer only, so every existing change stays valid
+            calculator.set_input(name, calculator.years_to_live + rng.randrange(1, 5))
+        else:
+            calculator.set_input(name, INPUTS[name](rng))
+        return
+    attribute, set_change, remove_change, move_change, random_value = rng.choice(CHANGES)
+    changes = getattr(calculator, attribute)
+    action = rng.choice(('set', 'remove', 'move')) if changes else 'set'
+    if action == 'set':
+        getattr(calculator, set_change)(rng.randrange(calculator.years_to_live), *random_value(rng))
+    elif action == 'remove':
+        getattr(calculator, remove_change)(rng.choice(list(changes)))
+    else:
+        free_years = [year for year in range(calculator.years_to_live) if year not in changes]
+        if free_years:
+            getattr(calculator, move_change)(rng.choice(list(changes)), rng.choice(free_years))
+
+class RebuildEquivalenceTest(unittest.TestCase):
+    """
+    After every edit, the incremental calculator has exactly what a RetirementAgeCalculator built from scratch with
+     the same inputs has
+    """
+    def assertSameAsRebuild(self, calculator, message):
+        rebuilt = RetirementAgeCalculator(
+            years_to_live=calculator.years_to_live,
+            manual_contrib_changes=dict(calculator.manual_contrib_changes),
+            manual_net_worth_changes=dict(calculator.manual_net_worth_changes),
+            manual_retirement_income_changes=dict(calculator.manual_retirement_income_changes),
+            **{name: getattr(calculator, name) for name in INPUTS})
+        years_to_retirement = rebuilt.get_earliest_retirement()
+        self.assertEqual(calculator.get_earliest_retirement(), years_to_retirement, message)
+        self.assertEqual(calculator.get_waste(), rebuilt.get_waste(), message)
+        for series in Series:
+            if years_to_retirement is None and series in RETIRED_SERIES:
+                continue
+            self.assertEqual(calculator.get_series_data(series), rebuilt.get_series_data(series), (message, series))
+
+    def test_edits_match_rebuild(self):
+        rng = random.Random(6)
+        for scenario in range(40):
+            calculator = IncrementalRetirementCalculator(years_to_live=rng.randrange(1, 80), **{name: value(rng) for name, value in INPUTS.items()})
+            self.assertSameAsRebuild(calculator, (scenario, 'initial'))
+            for edit in range(40):
+                _random_edit(rng, calculator)
+                self.assertSameAsRebuild(calculator, (scenario, edit))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+Regression tests for RetirementAgeCalculator(lazy=True); run from this directory with
+ python -m unittest test_lazy_retirement_calculator (or pytest)
+"""
+
+import random
+import unittest
+
+from retirement_age_calculator import RetirementAgeCalculator, Series
+
+RETIRED_SERIES = (Series.ACCOUNT_VALUE, Series.ACTUAL_WITHDRAWALS)
+# Closed-form powers and summing the other way round only differ from the default mode in the last bits
+RELATIVE_TOLERANCE = 1e-9
+
+def _random_scenario(rng):
+    years_to_live = rng.randrange(1, 90)
+    return {
+        'current_retirement_savings': rng.randrange(0, 1000000),
+        'annual_contribution': rng.randrange(0, 80000),
+        'annual_contribution_increase_rate': round(rng.uniform(-0.02, 0.06), 4),
+        'pre_retirement_growth_rate': round(rng.uniform(-0.02, 0.12), 4),
+        'post_retirement_growth_rate': round(rng.uniform(-0.02, 0.08), 4),
+        'inflation_rate': round(rng.uniform(0, 0.06), 4),
+        'years_to_live': years_to_live,
+        'desired_net_retirement_income_todays_dollars': rng.randrange(0, 150000),
+        'retirement_tax_rate': round(rng.uniform(0, 0.5), 4),
+        'manual_contrib_changes': {rng.randrange(years_to_live): (rng.randrange(0, 80000), round(rng.uniform(0, 0.05), 4)) for _ in range(rng.randrange(3))},
+        'manual_net_worth_changes': {rng.randrange(years_to_live): rng.randrange(-300000, 300000) for _ in range(rng.randrange(3))},
+        'manual_retirement_income_changes': {rng.randrange(years_to_live): rng.randrange(0, 150000) for _ in range(rng.randrange(3))},
+    }
+
+class LazyEquivalenceTest(unittest.TestCase):
+    """
+    The lazy mode finds the same retirement year as the default mode, and the same waste and series up to floating
+     point rounding
+    """
+    def assertClose(self, actual, expected, message):
+        self.assertAlmostEqual(actual, expected, delta=RELATIVE_TOLERANCE * max(1, abs(expected)), msg=message)
+
+    def test_matches_default_mode(self):
+        rng = random.Random(3)
+        for _ in range(300):
+            scenario = _random_scenario(rng)
+            eager = RetirementAgeCalculator(**scenario)
+            lazy = RetirementAgeCalculator(lazy=True, **scenario)
+            years_to_retirement = eager.get_earliest_retirement()
+            self.assertEqual(lazy.get_earliest_retirement(), years_to_retirement, scenario)
+            if years_to_retirement is not None:
+                self.assertClose(lazy.get_waste(), eager.get_waste(), scenario)
+            # Asked for after the search, so the lazy mode has to build them then
+            for series in Series:
+                if years_to_retirement is None and series in RETIRED_SERIES:
+                    continue
+                expected = eager.get_series_data(series)
+                actual = lazy.get_series_data(series)
+                self.assertEqual(len(actual), len(expected))
+                for year, (actual_value, expected_value) in enumerate(zip(actual, expected)):
+                    self.assertClose(actual_value, expected_value, (scenario, series, year))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+Regression tests for monthly_retirement_calculator; run from this directory with
+ python -m unittest test_monthly_retirement_calculator (or pytest)
+"""
+
+import random
+import unittest
+
+from monthly_retirement_calculator import MONTHS_PER_YEAR, STOCK_SERIES, MonthlyRetirementAgeCalculator, monthly_rate
+from retirement_age_calculator import Series
+
+RETIRED_SERIES = (Series.ACCOUNT_VALUE, Series.ACTUAL_WITHDRAWALS)
+# The closed forms sum in a different order than stepping month by month, so only differ from it in the last bits
+RELATIVE_TOLERANCE = 1e-9
+
+def _random_scenario(rng):
+    num_months = rng.randrange(1, 60) * MONTHS_PER_YEAR
+    scenario = {
+        'current_retirement_savings': rng.randrange(0, 1000000),
+        'annual_contribution': rng.randrange(0, 80000),
+        'annual_contribution_increase_rate': round(rng.uniform(-0.02, 0.06), 4),
+        'pre_retirement_growth_rate': round(rng.uniform(-0.02, 0.12), 4),
+        'post_retirement_growth_rate': round(rng.uniform(-0.02, 0.08), 4),
+        'inflation_rate': round(rng.uniform(0, 0.06), 4),
+        'years_to_live': num_months // MONTHS_PER_YEAR,
+        'desired_net_retirement_income_todays_dollars': rng.randrange(0, 150000),
+        'retirement_tax_rate': round(rng.uniform(0, 0.5), 4),
+        'manual_contrib_changes': {rng.randrange(num_months): (rng.randrange(0, 80000), round(rng.uniform(0, 0.05), 4)) for _ in range(rng.randrange(3))},
+        'manual_net_worth_changes': {rng.randrange(num_months): rng.randrange(-300000, 300000) for _ in range(rng.randrange(3))},
+        'manual_retirement_income_changes': {rng.randrange(num_months): rng.randrange(0, 150000) for _ in range(rng.randrange(3))},
+    }
+    # Even the last month's withdrawal alone is cheap enough that almost everyone retires eventually, so also try
+    #  nothing saved at all
+    if rng.random() < 0.1:
+        scenario.update(current_retirement_savings=0, annual_contribution=0, manual_contrib_changes={}, manual_net_worth_changes={})
+    return scenario
+
+def _month_by_month(scenario):
+    """
+    (months to retirement, waste, {series: monthly values}) stepping through one month at a time, as the module
+     docstring describes
+    """
+    num_months = scenario['years_to_live'] * MONTHS_PER_YEAR
+    pre_retirement_growth = 1 + monthly_rate(scenario['pre_retirement_growth_rate'])
+    post_retirement_growth = 1 + monthly_rate(scenario['post_retirement_growth_rate'])
+
+    contributions = []
+    contrib, contrib_rate = scenario['annual_contribution'], scenario['annual_contribution_increase_rate']
+    months_since_last_change = 0
+    for month in range(num_months):
+        if month in scenario['manual_contrib_changes']:
+            contrib, contrib_rate = scenario['manual_contrib_changes'][month]
+            months_since_last_change = 0
+        contributions.append(contrib / MONTHS_PER_YEAR * (1 + contrib_rate) ** (months_since_last_change / MONTHS_PER_YEAR))
+        months_since_last_change += 1
+
+    withdrawals = []
+    net_income = scenario['desired_net_retirement_income_todays_dollars']
+    for month in range(num_months):
+        net_income = scenario['manual_retirement_income_changes'].get(month, net_income)
+        withdrawals.append(net_income / MONTHS_PER_YEAR / (1.0 - scenario['retirement_tax_rate']) * (1 + scenario['inflation_rate']) ** (month / MONTHS_PER_YEAR))
+
+    min_worth = [0.0] * num_months
+    for month in range(num_months - 1, -1, -1):
+        remaining_balance_needed = min_worth[month + 1] / post_retirement_growth if month + 1 < num_months else 0
+        min_worth[month] = withdrawals[month] + remaining_balance_needed
+
+    no_retirement = []
+    for month in range(num_months):
+        value = scenario['current_retirement_savings'] if month == 0 else no_retirement[-1] * pre_retirement_growth + contributions[month - 1]
+        no_retirement.append(max(0, value + scenario['manual_net_worth_changes'].get(month, 0)))
+
+    series = {
+        Series.ALL_WITHDRAWALS: withdrawals,
+        Series.MIN_RETIREMENT_WORTH: min_worth,
+        Series.CONTRIBUTIONS: contributions,
+        Series.NO_RETIREMENT: no_retirement,
+    }
+    retirement = next((month for month in range(num_months) if no_retirement[month] >= min_worth[month]), None)
+    if retirement is None:
+        return None, None, series
+    account_value = no_retirement[:retirement + 1]
+    for month in range(retirement + 1, num_months):
+        account_value.append(max(0, (account_value[-1] - withdrawals[month - 1]) * post_retirement_growth))
+    series[Series.ACCOUNT_VALUE] = account_value
+    series[Series.ACTUAL_WITHDRAWALS] = [withdrawal if month >= retirement else 0.0 for month, withdrawal in enumerate(withdrawals)]
+    return retirement, account_value[-1] - withdrawals[-1], series
+
+class MonthByMonthEquivalenceTest(unittest.TestCase):
+    """
+    The closed forms find the same retirement month as stepping month by month, and the same waste and series up to
+     floating point rounding
+    """
+    def assertClose(self, actual, expected, message):
+        self.assertAlmostEqual(actual, expected, delta=RELATIVE_TOLERANCE * max(1, abs(expected)), msg=message)
+
+    def test_matches_month_by_month(self):
+        rng = random.Random(12)
+        retired = 0
+        for _ in range(300):
+            scenario = _random_scenario(rng)
+            calculator = MonthlyRetirementAgeCalculator(**scenario)
+            months_to_retirement, waste, expected_series = _month_by_month(scenario)
+            self.assertEqual(calculator.get_earliest_retirement(), months_to_retirement, scenario)
+            if months_to_retirement is not None:
+                retired += 1
+                self.assertEqual(calculator.get_earliest_retirement(annual=True), months_to_retirement / MONTHS_PER_YEAR)
+                self.assertClose(calculator.get_waste(), waste, scenario)
+            for series in Series:
+                if months_to_retirement is None and series in RETIRED_SERIES:
+                    continue
+                actual = calculator.get_series_data(series)
+                self.assertEqual(len(actual), len(expected_series[series]))
+                for month, (actual_value, expected_value) in enumerate(zip(actual, expected_series[series])):
+                    self.assertClose(actual_value, expected_value, (scenario, series, month))
+                # A year is its first month's balance, or the total of its months' flows
+                for year, annual_value in enumerate(calculator.get_series_data(series, annual=True)):
+                    months = expected_series[series][year * MONTHS_PER_YEAR:(year + 1) * MONTHS_PER_YEAR]
+                    self.assertClose(annual_value, months[0] if series in STOCK_SERIES else sum(months), (scenario, series, year))
+        # Both outcomes are covered
+        self.assertGreater(retired, 0)
+        self.assertGreater(300 - retired, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+Regression tests for retirement_solver; run from this directory with python -m unittest test_retirement_solver (or pytest)
+"""
+
+import random
+import unittest
+
+from retirement_age_calculator import RetirementAgeCalculator
+from retirement_solver import RetirementSolver
+
+def _retires_by(scenario, target_year):
+    years_to_retirement = RetirementAgeCalculator(**scenario).get_earliest_retirement()
+    return years_to_retirement is not None and years_to_retirement <= target_year
+
+class ClippedNetWorthTest(unittest.TestCase):
+    """
+    Big early net worth withdrawals clip net worth at 0, which breaks the closed form and makes the solver bisect; the
+     answer must still be exactly the smallest cent that works
+    """
+    def test_min_inputs_are_exact_to_the_cent(self):
+        rng = random.Random(4)
+        checked = 0
+        for _ in range(150):
+            years_to_live = rng.randrange(20, 60)
+            scenario = {
+                'current_retirement_savings': rng.randrange(0, 300000),
+                'annual_contribution': rng.randrange(0, 50000),
+                'annual_contribution_increase_rate': round(rng.uniform(0, 0.04), 3),
+                'pre_retirement_growth_rate': round(rng.uniform(0, 0.1), 3),
+                'post_retirement_growth_rate': round(rng.uniform(0, 0.06), 3),
+                'inflation_rate': round(rng.uniform(0, 0.04), 3),
+                'years_to_live': years_to_live,
+                'desired_net_retirement_income_todays_dollars': rng.randrange(10000, 80000),
+                'retirement_tax_rate': round(rng.uniform(0, 0.3), 3),
+                'manual_net_worth_changes': {rng.randrange(0, 6): -rng.randrange(50000, 400000) for _ in range(2)},
+            }
+            target_year = rng.randrange(6, years_to_live)
+            solver = RetirementSolver(**scenario)
+            for solve, argument in ((solver.min_annual_contribution, 'annual_contribution'), (solver.min_current_savings, 'current_retirement_savings')):
+                value = solve(target_year)
+                if value is None or value == 0:
+                    continue
+                checked += 1
+                cents = round(value * 100)
+                self.assertEqual(cents / 100, value)
+                self.assertTrue(_retires_by(dict(scenario, **{argument: value}), target_year), (scenario, argument, value))
+                self.assertFalse(_retires_by(dict(scenario, **{argument: (cents - 1) / 100}), target_year), (scenario, argument, value))
+        self.assertGreater(checked, 100)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+"""
+Regression tests for scenario_stream; run from this directory with python -m unittest test_scenario_stream (or pytest)
+"""
+
+import io
+import random
+import unittest
+
+from result_cache import ResultCache
+from retirement_age_calculator import RetirementAgeCalculator
+from scenario_stream import CSV_FORMAT, evaluate_stream, parse_scenario, read_records
+
+HEADER = 'id,current_savings,annual_contribution,annual_contrib_increase_rate,pre_growth_rate,post_growth_rate,inflation_rate,years_to_live,net_retirement_income,retirement_tax_rate\n'
+VALID_ROW = 'good,150000,30000,0.02,0.07,0.04,0.025,60,60000,0.2\n'
+
+def _evaluate(csv_text, workers=None, cache=None):
+    records = read_records(io.StringIO(csv_text), CSV_FORMAT)
+    return [result for chunk in evaluate_stream(records, workers=workers, chunk_size=2, cache=cache) for result in chunk]
+
+def _random_rows(seed, count):
+    rng = random.Random(seed)
+    lines = []
+    for row in range(count):
+        lines.append('s%s,%s,%s,%s,%s,%s,%s,%s,%s,%s\n' % (
+            row,
+            rng.randrange(0, 1000000),
+            rng.randrange(0, 80000),
+            round(rng.uniform(0, 0.05), 4),
+            round(rng.uniform(0, 0.1), 4),
+            round(rng.uniform(0, 0.07), 4),
+            round(rng.uniform(0, 0.05), 4),
+            rng.randrange(10, 80),
+            rng.randrange(10000, 120000),
+            round(rng.uniform(0, 0.4), 4)))
+    return ''.join(lines)
+
+class BadRecordTest(unittest.TestCase):
+    """
+    Records the calculator can't handle get an error of their own instead of stopping the stream
+    """
+    ROWS = (
+        VALID_ROW
+        + 'full_tax,150000,30000,0.02,0.07,0.04,0.025,60,60000,1.0\n'
+        + 'lost_everything,150000,30000,0.02,0.07,-1,0.025,60,60000,0.2\n'
+        + 'overflow,150000,30000,0.02,0.07,0.04,1e10,100,60000,0.2\n'
+        + VALID_ROW
+    )
+
+    def check(self, results):
+        self.assertEqual([result['row'] for result in results], [1, 2, 3, 4, 5])
+        for result in results[1:4]:
+            self.assertIsNotNone(result['error'], result['id'])
+            self.assertIsNone(result['years_to_retirement'])
+        for result in (results[0], results[4]):
+            self.assertIsNone(result['error'])
+            self.assertIsNotNone(result['years_to_retirement'])
+        self.assertEqual(results[0], dict(results[4], row=1))
+
+    def test_huge_horizon(self):
+        # Would otherwise make the whole chunk it's batched with allocate for it
+        results = _evaluate(HEADER + VALID_ROW + 'forever,150000,30000,0.02,0.07,0.04,0.025,100000000,60000,0.2\n')
+        self.assertIn('years to live', results[1]['error'])
+        self.assertIsNone(results[0]['error'])
+
+    def test_bad_records_in_process(self):
+        self.check(_evaluate(HEADER + self.ROWS))
+
+    def test_bad_records_in_workers(self):
+        self.check(_evaluate(HEADER + self.ROWS, workers=2))
+
+class SameAsCliTest(unittest.TestCase):
+    """
+    Streamed results are exactly what the CLI's (eager) calculator gives for the same scenario
+    """
+    def test_matches_eager_calculator(self):
+        csv_text = HEADER + _random_rows(9, 200)
+        results = _evaluate(csv_text)
+        for result, record in zip(results, read_records(io.StringIO(csv_text), CSV_FORMAT)):
+            calculator = RetirementAgeCalculator(**parse_scenario(record))
+            years_to_retirement = calculator.get_earliest_retirement()
+            self.assertEqual(result['years_to_retirement'], years_to_retirement, result['id'])
+            self.assertEqual(result['waste'], calculator.get_waste() if years_to_retirement is not None else None, result['id'])
+
+    def test_cached_matches_uncached(self):
+        csv_text = HEADER + _random_rows(10, 100)
+        cache = ResultCache()
+        expected = _evaluate(csv_text)
+        self.assertEqual(_evaluate(csv_text, cache=cache), expected)
+        self.assertEqual(_evaluate(csv_text, cache=cache), expected)
+        self.assertEqual(cache.hits, 100)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+"""
+Regression tests for tax_aware_retirement_calculator; run from this directory with
+ python -m unittest test_tax_aware_retirement_calculator (or pytest)
+"""
+
+import random
+import unittest
+
+from retirement_age_calculator import RetirementAgeCalculator
+from tax_aware_retirement_calculator import TaxAwareRetirementCalculator, TaxBrackets
+
+BRACKETS = TaxBrackets([0, 11000, 44725, 95375, 182100], [0.10, 0.12, 0.22, 0.24, 0.32], deduction=13850)
+
+class FlatTaxTest(unittest.TestCase):
+    """
+    With a flat tax and everything in the deferred account (or no tax and everything in Roth), it's the same plan as
+     RetirementAgeCalculator's
+    """
+    def test_matches_scalar_calculator(self):
+        rng = random.Random(5)
+        for _ in range(40):
+            years_to_live = rng.randint(5, 60)
+            tax_rate = rng.uniform(0, 0.35)
+            savings = rng.randint(0, 900000)
+            scenario = {
+                'annual_contribution': rng.randint(0, 60000),
+                'annual_contribution_increase_rate': rng.uniform(0, 0.05),
+                'pre_retirement_growth_rate': rng.uniform(0.01, 0.1),
+                'post_retirement_growth_rate': rng.uniform(0, 0.06),
+                'inflation_rate': rng.uniform(0, 0.04),
+                'years_to_live': years_to_live,
+                'desired_net_retirement_income_todays_dollars': rng.randint(10000, 120000),
+                'manual_retirement_income_changes': {rng.randrange(years_to_live): rng.randint(10000, 90000)},
+            }
+            for expected, tax_aware in (
+                    (RetirementAgeCalculator(current_retirement_savings=savings, retirement_tax_rate=tax_rate, **scenario),
+                        TaxAwareRetirementCalculator(0, savings, 0, deferred_contribution_share=1, tax_brackets=TaxBrackets.flat(tax_rate), **scenario)),
+                    (RetirementAgeCalculator(current_retirement_savings=savings, retirement_tax_rate=0, **scenario),
+                        TaxAwareRetirementCalculator(0, 0, savings, deferred_contribution_share=0, roth_contribution_share=1, tax_brackets=BRACKETS, **scenario))):
+                years_to_retirement = expected.get_earliest_retirement()
+                self.assertEqual(tax_aware.get_earliest_retirement(), years_to_retirement, scenario)
+                if years_to_retirement is not None:
+                    self.assertAlmostEqual(tax_aware.get_waste(), expected.get_waste(), delta=1e-6 * max(1, abs(expected.get_waste())))
+
+class EarliestRetirementTest(unittest.TestCase):
+    """
+    With brackets, gains tax, several accounts and net worth changes, whether you can retire isn't monotone in the
+     year, and the earliest retirement must still be the first year that works
+    """
+    def test_year_before_a_gap(self):
+        # Retiring in year 7 dodges the year 8 net worth change, after which years 8 and 9 don't work. The coarse grid
+        #  puts the search's estimate at year 10, which walking back from would never get past
+        calculator = TaxAwareRetirementCalculator(
+            22677, 545748, 31637, 33521, 0.006, 0.243, 0.0476, 0.0351, 0.0208, 31, 44112, BRACKETS,
+            manual_net_worth_changes={8: -531873},
+            roth_contribution_share=0.2,
+            current_taxable_basis=21950,
+            grid_size=4)
+        self.assertEqual([calculator._can_retire(year) for year in range(7, 11)], [True, False, False, True])
+        self.assertEqual(calculator.get_earliest_retirement(), 7)
+
+    def test_first_fundable_year(self):
+        rng = random.Random(3)
+        not_monotone = 0
+        for _ in range(60):
+            years_to_live = rng.randint(10, 35)
+            taxable_savings = rng.randint(0, 400000)
+            calculator = TaxAwareRetirementCalculator(
+                taxable_savings,
+                rng.randint(0, 800000),
+                rng.randint(0, 200000),
+                rng.randint(0, 60000),
+                rng.uniform(0, 0.03),
+                rng.uniform(0, 0.7),
+                rng.uniform(0, 0.09),
+                rng.uniform(0, 0.06),
+                rng.uniform(0, 0.035),
+                years_to_live,
+                rng.randint(30000, 150000),
+                BRACKETS,
+                manual_net_worth_changes={rng.randrange(years_to_live): -rng.randint(100000, 900000)},
+                roth_contribution_share=rng.choice([0, 0.2]),
+                current_taxable_basis=taxable_savings * rng.uniform(0, 1),
+                capital_gains_tax_rate=rng.choice([0, 0.15, 0.2]),
+                grid_size=512)
+            fundable = [calculator._can_retire(year) for year in range(years_to_live)]
+            first = fundable.index(True) if True in fundable else None
+            self.assertEqual(calculator.get_earliest_retirement(), first)
+            if first is not None and not all(fundable[first:]):
+                not_monotone += 1
+        self.assertGreater(not_monotone, 0)
+
+if __name__ == '__main__':
+    unittest.main()
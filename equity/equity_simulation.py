@@ -0,0 +1,123 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .grant import month_index
+from .grant_book import GrantBook, to_month_indexes
+
+DEFAULT_BLOCK_SIZE = 10000
+
+
+def simulate_share_prices(initial_price, drift, volatility, months_ahead, num_paths, rng):
+    """
+        Lognormal (geometric Brownian motion) share prices with the given annual drift and volatility, sampled
+        only at the given (sorted, non-negative) numbers of months ahead, as a (paths, months) array.
+        Sampling the increments between consecutive months directly gives the same distribution as stepping
+        through every month in between.
+    """
+    years_between = np.diff(np.concatenate([[0], months_ahead])) / 12
+    increments = rng.normal(
+        (drift - volatility ** 2 / 2) * years_between,
+        volatility * np.sqrt(years_between),
+        (num_paths, len(months_ahead)))
+    return initial_price * np.exp(np.cumsum(increments, axis=1))
+
+
+class EquityValueDistribution:
+    """
+        Simulated after-fee, after-capital-gains values of a grant book, with one column per leave date
+    """
+    def __init__(self, leave_dates, share_prices, values, strike_prices):
+        self.leave_dates = leave_dates
+        self.share_prices = share_prices
+        self.values = values
+        self.strike_prices = strike_prices
+
+    def mean(self):
+        """
+            Mean value for each leave date
+        """
+        return self.values.mean(axis=0)
+
+    def percentiles(self, percentiles=(5, 25, 50, 75, 95)):
+        """
+            Dict of percentile -> array of values, one per leave date
+        """
+        return dict(zip(percentiles, np.percentile(self.values, percentiles, axis=0)))
+
+    def prob_underwater(self):
+        """
+            Probability, for each leave date, that the book as a whole is worth nothing or less, i.e. the share
+            price doesn't cover the strike prices of the vested shares
+        """
+        return (self.values <= 0).mean(axis=0)
+
+    def grant_prob_underwater(self):
+        """
+            Probability that the share price is below each grant's strike price, as a (dates, grants) array
+        """
+        sorted_prices = np.sort(self.share_prices, axis=0)
+        num_paths = sorted_prices.shape[0]
+        return np.array([
+            np.searchsorted(sorted_prices[:, date], self.strike_prices, side='left') / num_paths
+            for date in range(sorted_prices.shape[1])
+        ])
+
+
+class EquityPriceSimulator:
+    """
+        Simulates share price paths from today's price and values a grant book along them for each candidate
+        date of leaving, vectorized over paths and grants.
+    """
+    def __init__(self, grants, start_date, initial_price, drift, volatility, capital_gains, pay_execution_fee=True, pay_capital_gains=True):
+        """
+            grants is a GrantBook or a list of Grants
+            start_date is a string in format YYYY-mm, the month initial_price applies to
+            drift and volatility are annual, in the form 0.XX
+        """
+        self.book = grants if isinstance(grants, GrantBook) else GrantBook.from_grants(grants)
+        self.start_month = month_index(start_date)
+        self.initial_price = initial_price
+        self.drift = drift
+        self.volatility = volatility
+        self.capital_gains = capital_gains
+        self.pay_execution_fee = pay_execution_fee
+        self.pay_capital_gains = pay_capital_gains
+
+    def run(self, leave_dates, num_paths, seed=None, block_size=DEFAULT_BLOCK_SIZE, workers=None):
+        """
+            Simulate num_paths price paths and value the book at each leave date, returning an
+            EquityValueDistribution. Paths are simulated in blocks, each with its own child seed, and workers > 1
+            spreads the blocks across that many processes; a given seed gives the same result for any number of
+            workers.
+        """
+        if num_paths < 1:
+            raise ValueError("Number of paths must be >= 1")
+        leave_months = to_month_indexes(leave_dates)
+        months_ahead = leave_months - self.start_month
+        if np.any(months_ahead < 0):
+            raise ValueError("Leave dates can't be before the simulation start date")
+
+        # Prices only need sampling once per distinct month, in order
+        unique_months_ahead, date_columns = np.unique(months_ahead, return_inverse=True)
+        value_per_dollar, strike_cost = self.book.get_value_coefficients(leave_months, self.pay_execution_fee)
+
+        block_sizes = [block_size] * (num_paths // block_size)
+        if num_paths % block_size:
+            block_sizes.append(num_paths % block_size)
+        block_seeds = np.random.SeedSequence(seed).spawn(len(block_sizes))
+        if workers is not None and workers > 1 and len(block_sizes) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                blocks = list(executor.map(self._simulate_block, [unique_months_ahead] * len(block_sizes), block_sizes, block_seeds))
+        else:
+            blocks = [self._simulate_block(unique_months_ahead, size, block_seed) for size, block_seed in zip(block_sizes, block_seeds)]
+
+        share_prices = np.concatenate(blocks)[:, date_columns]
+        values = share_prices * value_per_dollar - strike_cost
+        if self.pay_capital_gains:
+            values = values * (1 - self.capital_gains)
+        return EquityValueDistribution(leave_dates, share_prices, values, self.book.strike_prices)
+
+    def _simulate_block(self, months_ahead, num_paths, block_seed):
+        rng = np.random.default_rng(block_seed)
+        return simulate_share_prices(self.initial_price, self.drift, self.volatility, months_ahead, num_paths, rng)
@@ -5,14 +5,27 @@ class EquityValueEstimator:
         so that vesting stops on those grants.
     """
     
-    def __init__(self, grants, share_price, capital_gains):
+    def __init__(self, grants, share_price, capital_gains, cache=None):
+        """
+            cache is optional, and memoizes total_value: any object with a get_or_compute(inputs, compute) method
+            that returns compute() or an earlier result for the same inputs, like early-retirement's ResultCache
+        """
         self.grants = grants
         self.share_price = share_price
         self.capital_gains = capital_gains
+        self.cache = cache
         
     def total_value(self, date_of_leaving, pay_execution_fee=True, pay_capital_gains=True):
+        if self.cache is None:
+            return self._total_value(date_of_leaving, pay_execution_fee, pay_capital_gains)
+        # Key on the grants themselves rather than the estimator, so the cache is still right if they're edited
+        grants = [[grant.total_shares, grant.shares_per_month, grant.end_month, grant.strike_price, grant.execution_fee] for grant in self.grants]
+        inputs = ['EquityValueEstimator.total_value', grants, self.share_price, self.capital_gains, date_of_leaving, pay_execution_fee, pay_capital_gains]
+        return self.cache.get_or_compute(inputs, lambda: self._total_value(date_of_leaving, pay_execution_fee, pay_capital_gains))
+
+    def _total_value(self, date_of_leaving, pay_execution_fee, pay_capital_gains):
         val = 0
-        for grant in grants:
+        for grant in self.grants:
             value_per_share = self.share_price - grant.strike_price
             total_value = grant.get_shares_vested(date_of_leaving) * value_per_share
             if (pay_execution_fee):
@@ -22,4 +35,14 @@ class EquityValueEstimator:
         if (pay_capital_gains):
             return val * (1 - self.capital_gains)
         else:
-            return val
\ No newline at end of file
+            return val
+
+    def simulate_total_value(self, start_date, leave_dates, drift, volatility, num_paths, seed=None, workers=None, pay_execution_fee=True, pay_capital_gains=True):
+        """
+            Instead of the fixed share_price, simulate num_paths lognormal share price paths starting from it at
+            start_date (format YYYY-mm), with the given annual drift and volatility, and return the distribution
+            of total_value for each of the leave dates (see EquityPriceSimulator)
+        """
+        from .equity_simulation import EquityPriceSimulator
+        simulator = EquityPriceSimulator(self.grants, start_date, self.share_price, drift, volatility, self.capital_gains, pay_execution_fee, pay_capital_gains)
+        return simulator.run(leave_dates, num_paths, seed=seed, workers=workers)
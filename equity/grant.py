@@ -1,5 +1,16 @@
 from datetime import datetime
-from dateutil import relativedelta as rd
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4096)
+def month_index(date):
+    """
+        Converts a date string in format YYYY-mm to a running month count (year * 12 + month - 1), so the number
+        of months between two dates is a plain subtraction. Parsed dates are cached, as the same few leave dates
+        tend to get asked about over and over.
+    """
+    parsed = datetime.strptime(date, '%Y-%m')
+    return parsed.year * 12 + parsed.month - 1
 
 
 class Grant:
@@ -17,13 +28,12 @@ class Grant:
         self.total_shares = total_shares
         self.shares_per_month = shares_per_month
         self.end_date = datetime.strptime(end_date, '%Y-%m')
+        self.end_month = month_index(end_date)
         self.strike_price = strike_price
         self.execution_fee = execution_fee
         
     def get_shares_remaining(self, at_date):
-        at_date = datetime.strptime(at_date, '%Y-%m')
-        delta = rd.relativedelta(self.end_date, at_date)
-        months_left = max(delta.years * 12 + delta.months, 0)
+        months_left = max(self.end_month - month_index(at_date), 0)
         return (months_left * self.shares_per_month)
     
     def get_shares_vested(self, at_date):
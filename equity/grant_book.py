@@ -0,0 +1,81 @@
+import numpy as np
+
+from .grant import month_index
+
+
+def to_month_indexes(dates):
+    """
+        Converts one or more leave dates, either strings in format YYYY-mm or month indexes as returned by
+        month_index, to a 1-D array of month indexes
+    """
+    dates = [dates] if isinstance(dates, (str, int, np.integer)) else dates
+    return np.array([month_index(date) if isinstance(date, str) else date for date in dates], dtype=np.int64)
+
+
+class GrantBook:
+    """
+        A compiled set of grants, stored as one array per Grant attribute, so vested shares and total value can be
+        evaluated for many leave dates and share prices at once instead of one Grant at a time.
+        Gives the same results as Grant and EquityValueEstimator (up to floating point summation order).
+    """
+    def __init__(self, total_shares, shares_per_month, end_months, strike_prices, execution_fees):
+        """
+            Each argument is a sequence with one entry per grant; end_months are month indexes (see month_index).
+            Use from_grants to build a book from Grant objects.
+        """
+        self.total_shares = np.asarray(total_shares, dtype=float)
+        self.shares_per_month = np.asarray(shares_per_month, dtype=float)
+        self.end_months = np.asarray(end_months, dtype=np.int64)
+        self.strike_prices = np.asarray(strike_prices, dtype=float)
+        self.execution_fees = np.asarray(execution_fees, dtype=float)
+        lengths = set(len(array) for array in (self.total_shares, self.shares_per_month, self.end_months, self.strike_prices, self.execution_fees))
+        if len(lengths) != 1:
+            raise ValueError("All grant attributes must have one entry per grant")
+
+    @classmethod
+    def from_grants(cls, grants):
+        return cls(
+            [grant.total_shares for grant in grants],
+            [grant.shares_per_month for grant in grants],
+            [grant.end_month for grant in grants],
+            [grant.strike_price for grant in grants],
+            [grant.execution_fee for grant in grants])
+
+    def __len__(self):
+        return len(self.total_shares)
+
+    def get_shares_vested(self, leave_dates):
+        """
+            Shares vested in each grant when leaving at each of the leave dates, as a (dates, grants) array
+        """
+        months_left = np.maximum(self.end_months - to_month_indexes(leave_dates)[:, None], 0)
+        return self.total_shares - months_left * self.shares_per_month
+
+    def get_total_shares_vested(self, leave_dates):
+        """
+            Shares vested across all grants for each of the leave dates
+        """
+        return self.get_shares_vested(leave_dates).sum(axis=1)
+
+    def get_value_coefficients(self, leave_dates, pay_execution_fee=True):
+        """
+            The value of each grant is vested * (price - strike) * fee factor, which summed over grants is
+            price * value_per_dollar - strike_cost. Returns (value_per_dollar, strike_cost), one entry per leave
+            date, so the grants only need to be reduced over once no matter how many prices get evaluated.
+        """
+        fee_factors = 1 - self.execution_fees if pay_execution_fee else np.ones(len(self))
+        vested = self.get_shares_vested(leave_dates)
+        return vested @ fee_factors, vested @ (self.strike_prices * fee_factors)
+
+    def total_value(self, leave_dates, share_prices, capital_gains, pay_execution_fee=True, pay_capital_gains=True):
+        """
+            Value of the book for every combination of leave date and share price, as a (dates, prices) array;
+            same as EquityValueEstimator.total_value for each combination
+        """
+        value_per_dollar, strike_cost = self.get_value_coefficients(leave_dates, pay_execution_fee)
+        share_prices = np.atleast_1d(np.asarray(share_prices, dtype=float))
+        values = value_per_dollar[:, None] * share_prices - strike_cost[:, None]
+        if pay_capital_gains:
+            return values * (1 - capital_gains)
+        else:
+            return values